@@ -1,86 +1,133 @@
-from ovito.io import import_file
-from ovito.modifiers import SelectTypeModifier
-from ovito.modifiers import SpatialBinningModifier
-from ovito.io import export_file
-import numpy as np
-import operator
+import argparse
+import xdatcar
+import density_grid
+import anion_sites
+import run_report
 
 ### Parameters ########################################################################################################################################
-in_filename       = 'XDATCAR'
-out_filename      = 'Li_density.xyz' 
+in_filename       = 'XDATCAR'    # also XDATCAR.gz, .xz, .bz2 or .zst (decompressed on the fly); without XDATCAR a compressed XDATCAR.* is used
+out_filename      = 'Li_density.xyz' # Extended xyz output (one line per grid point, e.g. for the OVITO GUI)
+out_binary        = 'Li_density'     # Binary output: Li_density.npy (grid) + Li_density.npz (lattice, shape, frames, species)
+OutputFormat      = 'both'           # 'both' (binary + xyz), 'npy', 'xyz' or 'sparse' (only occupied voxels: Li_density.sparse.npz)
 EquilibrationTime = 500        # Skip this number of STEPS from the XDATCAR. Not necessary fs -> remember NBLOCK from INCAR!
 bins_x            = 192        # number of bins in x direction
 bins_y            = 192        # number of bins in y direction
 bins_z            = 256        # number of bins in z direction
+Deposition        = 'ngp'      # 'ngp' (count every position in its voxel), 'cic' or 'gaussian' (spread over the neighbouring
+                               # grid points, allows much coarser grids, see grid_convergence.py and density_grid.py)
+Sigma             = 0.15       # Width of the Gaussian kernel in Angstrom
 AtomType          = 'Li'       # Species to be binned
+Workers           = 1          # Number of processes. The frames after EquilibrationTime are split into this many shards
+Checkpoint        = True       # Keep the raw hits in Li_density.checkpoint.npz, a rerun after appending a restart segment only bins the new frames
+ExtraSpecies      = []         # Further species binned in the same pass, e.g. ['P', 'S', 'Br'] -> P_density.npy, S_density.npy, ...
+SiteClasses       = False      # Also bin the S/Br on 4d and 4a sites separately -> S_on_4d_density.npy, Br_on_4a_density.npy, ...
+Structure_file    = 'POSCAR'   # Only needed for SiteClasses (classification of the 4d/4a sites, see anion_sites.py)
+Report            = True       # Time per stage, frames/s and peak memory -> Li_density.report.json (see run_report.py)
+Profile           = False      # Run the binning under cProfile -> Li_density.report.prof (only the main process, use 1 worker)
 ########################################################################################################################################################
 
 
-### Load a simulation trajectory consisting of several frames:
-pipeline = import_file(in_filename)
+# Everything below only runs when the script is executed (not when worker processes import it)
+if __name__ == "__main__":
 
+    parser = argparse.ArgumentParser(description="Time-averaged Li density from an XDATCAR")
+    parser.add_argument("--workers", type=int, default=Workers, help="number of worker processes (default: {})".format(Workers))
+    parser.add_argument("--format", choices=["npy", "xyz", "both", "sparse"], default=OutputFormat, help="output format (default: {})".format(OutputFormat))
+    parser.add_argument("--no-checkpoint", dest="checkpoint", action="store_false", default=Checkpoint, help="bin all frames again and do not write a checkpoint")
+    parser.add_argument("--species", nargs="*", default=ExtraSpecies, help="further species binned in the same pass (e.g. P S Br)")
+    parser.add_argument("--site-classes", action="store_true", default=SiteClasses, help="also bin S/Br per 4d/4a site class")
+    parser.add_argument("--deposition", choices=density_grid.KERNELS, default=Deposition, help="deposition kernel (default: {})".format(Deposition))
+    parser.add_argument("--sigma", type=float, default=Sigma, help="width of the Gaussian kernel in Angstrom (default: {})".format(Sigma))
+    parser.add_argument("--no-report", dest="report", action="store_false", default=Report, help="do not write Li_density.report.json")
+    parser.add_argument("--profile", action="store_true", default=Profile, help="profile the binning with cProfile")
+    args = parser.parse_args()
+    in_filename = xdatcar.FindTrajectory(in_filename)
 
-### Select Atom Type and add to pipeline
-sel_modifier = SelectTypeModifier(
-        operate_on = "particles",
-        property   = "Particle Type",
-        )
-sel_modifier.types = {AtomType}
-pipeline.modifiers.append(sel_modifier)
+    #   Stages: parse (header + frame index), select (atom groups), bin, reduce (hits -> density), write
+    report = run_report.StartReport("Li_density_ovito3.py", {"in_filename": in_filename, "EquilibrationTime": EquilibrationTime,
+                                                             "bins": [bins_x, bins_y, bins_z], "AtomType": AtomType,
+                                                             "workers": args.workers, "format": args.format,
+                                                             "checkpoint": args.checkpoint, "species": args.species,
+                                                             "site_classes": args.site_classes, "deposition": args.deposition,
+                                                             "sigma": args.sigma}, profile=args.profile)
+    kernel = density_grid.DepositionKernel(args.deposition, args.sigma)
 
 
-### Set up the binning operation. Binning can be done over "Selection" to count if any Li (is selected, hence: Selection = 1) is in the bin or not.
-binning     = SpatialBinningModifier(
-        bin_count_x   = bins_x,
-        bin_count_y   = bins_y,
-        bin_count_z   = bins_z,
-        property      = "Selection",
-        only_selected = True,
-        direction     = SpatialBinningModifier.Direction.XYZ,
-        reduction_operation = SpatialBinningModifier.Operation.SumVol
-        )
-pipeline.modifiers.append(binning)
+    ### Read the header of the trajectory (species, number of atoms, cell)
+    with run_report.Stage(report, "parse"):
+        header   = xdatcar.ReadHeader(in_filename)
+        N_frames = xdatcar.CountFrames(in_filename)
 
+    with run_report.Stage(report, "select"):
+        atoms = xdatcar.SpeciesSlice(header, AtomType)
+        #   Every group of atoms gets its own grid: (name, atoms, binary output, xyz output)
+        groups = [(AtomType, atoms, out_binary, out_filename)]
+        for name in args.species:
+            groups.append((name, xdatcar.SpeciesSlice(header, name), name + "_density", name + "_density.xyz"))
+        if args.site_classes:
+            sites = anion_sites.ClassifyPOSCAR(Structure_file)
+            anion_sites.PrintPositionalAnalysis(sites)
+            for name in ("S_on_4d", "Br_on_4d", "S_on_4a", "Br_on_4a"):
+                groups.append((name, sites["atoms"][name], name + "_density", name + "_density.xyz"))
+        #   With several groups all of them are binned in the same pass over the trajectory (stacked grids)
+        if len(groups) > 1:
+            atoms = [group[1] for group in groups]
+            print("Binning {} in one pass".format(", ".join(group[0] for group in groups)))
+        N_atoms_binned = sum(len(range(sum(header["counts"]))[group[1]]) if isinstance(group[1], slice) else len(group[1])
+                             for group in groups)
 
-### Compute pipeline
-print("Skipping first {} frames of {}".format(EquilibrationTime,pipeline.source.num_frames))
-grid = np.zeros(bins_x * bins_y * bins_z ,)
 
-for frame in range(EquilibrationTime,pipeline.source.num_frames):
-    if frame % 1000 == 0:
-        print("Computing frame {} of {}".format(frame,pipeline.source.num_frames),flush=True)
-    # Evaluate pipeline to let the modifier compute the RDF of the current frame:
-    data = pipeline.compute(frame)
-    #print(data.grids)
-    Li_selection = data.grids['binning[Selection]']['Selection']
-    grid+=Li_selection
-    
-grid/= (pipeline.source.num_frames-EquilibrationTime)
-grid = np.reshape( grid, (bins_z,bins_y,bins_x) )
+    ### Compute the density. Frames before EquilibrationTime are skipped without parsing.
+    #   The Li positions are converted to flat voxel indices and counted with one bincount per batch
+    #   of frames (integer hits). With --workers N the frame range is split into N shards that are binned
+    #   in parallel; the integer counts are summed up, so the result is identical to a serial run.
+    #   Division by frame count and bin volume is done once at the end.
+    if N_frames - EquilibrationTime <= 0:
+        raise SystemExit("EquilibrationTime = {} skips all {} frames of {}, nothing to bin".format(EquilibrationTime, N_frames, in_filename))
+    print("Skipping first {} frames of {}".format(EquilibrationTime,N_frames))
+    print("Binning with {} worker(s), deposition: {}".format(args.workers, args.deposition))
+    #   With --format sparse only the visited voxels are kept, from the binning up to the output file.
+    sparse = args.format == "sparse"
+    #   With checkpoints only the frames appended since the last run are binned (see density_grid.py).
+    with run_report.Stage(report, "bin", profile=True):
+        if args.checkpoint:
+            counts, cell, volumes, first = density_grid.BinTrajectoryCheckpointed(in_filename, EquilibrationTime, N_frames, atoms,
+                                                                                  (bins_z,bins_y,bins_x), out_binary,
+                                                                                  workers=args.workers, sparse=sparse, kernel=kernel)
+        else:
+            counts, cell, volumes = density_grid.BinTrajectory(in_filename, EquilibrationTime, N_frames, atoms,
+                                                               (bins_z,bins_y,bins_x), workers=args.workers, sparse=sparse,
+                                                               kernel=kernel)
+            first = EquilibrationTime
+    #   Throughput of this run: frames binned now (not those taken from the checkpoint) and positions binned
+    N_binned = EquilibrationTime + len(volumes) - first
+    run_report.Count(report, "frames", N_binned)
+    run_report.Count(report, "points", N_binned * N_atoms_binned)
+    run_report.Rate(report, "frames", "bin")
+    run_report.Rate(report, "points", "bin")
+    print(cell[0])
+    print(cell[1])
+    print(cell[2])
 
-a = np.array([data.cell[0][0],data.cell[1][0],data.cell[2][0]])
-b = np.array([data.cell[0][1],data.cell[1][1],data.cell[2][1]])
-c = np.array([data.cell[0][2],data.cell[1][2],data.cell[2][2]])
+    for (name, _, binary_name, xyz_name), group_counts in zip(groups, density_grid.SplitGroups(counts, (bins_z,bins_y,bins_x), len(groups), sparse)):
+        with run_report.Stage(report, "reduce"):
+            if sparse:
+                grid = density_grid.SparseFromCounts(group_counts, volumes, (bins_z,bins_y,bins_x), cell, name, args.deposition)
+            else:
+                grid = density_grid.CountsToDensity(group_counts, volumes, (bins_z,bins_y,bins_x))
 
-print(a)
-print(b)
-print(c)
+        with run_report.Stage(report, "write"):
+            if args.format in ("npy", "both"):
+                print("Writing {}.npy/.npz".format(binary_name))
+                density_grid.WriteDensityGrid(binary_name, grid, cell, len(volumes), name, args.deposition)
+            if args.format == "sparse":
+                print("Writing {}.sparse.npz ({} occupied voxels)".format(binary_name, len(grid["index"])))
+                density_grid.WriteSparseGrid(binary_name, grid)
+            if args.format in ("xyz", "both"):
+                print("Writing {}".format(xyz_name))
+                density_grid.WriteExtendedXYZ(xyz_name, grid, cell)
 
-with open(out_filename, 'w') as f:
-    f.write("{}\n".format(bins_x*bins_y*bins_z))
-    
-    lattice_string=""
-    for i in a:
-        lattice_string=lattice_string + "{:.8f} ".format(i)
-    for i in b:
-        lattice_string=lattice_string + "{:.8f} ".format(i)
-    for i in c:
-        lattice_string=lattice_string + "{:.8f} ".format(i)
-    f.write('Lattice="{}" Properties=pos:R:3:Density:R:1 Time=0.0\n'.format(lattice_string.rstrip()))
-    
-    for z in range(bins_z):
-        for y in range(bins_y):
-            for x in range(bins_x):
-                Coordinates = np.array([0,0,0])
-                Coordinates =  Coordinates + x*a/bins_x +  y*b/bins_y + z*c/bins_z
-                f.write( "{:.8f}\t{:.8f}\t{:.8f}\t{:.8f}\n".format(Coordinates[0],Coordinates[1],Coordinates[2],grid[z][y][x]) )
+    if args.report or args.profile:
+        report = run_report.FinishReport(report, out_binary + ".report.json")
+        run_report.PrintReport(report)
+        print("Writing {}.report.json".format(out_binary))
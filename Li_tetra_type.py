@@ -1,21 +1,42 @@
-import timeit
-tic=timeit.default_timer()
-
-from ovito.io import import_file
-from ovito.modifiers import *
-from ovito.data import *
 import numpy as np
-
-# The Li density needs extended xyz format for the PBC to be set properly!
+import anion_sites
+import density_grid
+import run_report
+import tetrahedra
+import xdatcar
+
+# The Li density is read either from the binary grid written by Li_density_ovito3.py (Li_density.npy + .npz),
+# its sparse version (Li_density.sparse.npz) or from an (archived) xyz file. The xyz file needs extended xyz format (Lattice="...") for the cell to be known!
 # Furthermore, a rather fine bin mesh is helpful to reduce numerical noise (because depending on the
-# atomic positions some bins might just be located inside or outside the tetrahdral sites
-Li_density_file="Li_density.xyz"
+# atomic positions some bins might just be located inside or outside the tetrahdral sites.
+# With a kernel deposition in Li_density_ovito3.py (Deposition='gaussian') a grid 4 times coarser per axis gives
+# converged occupancies, see grid_convergence.py)
+Li_density_file="Li_density.npy"
+
+# How the density inside the tetrahedra is summed up around every site:
+# "grid"   -> every tetrahedron type is rasterized once as voxel mask, the mask is shifted to the grid point
+#             closest to each site (fast)
+# "points" -> the tetrahedra are placed exactly at every site and tested against the nonzero density points,
+#             using a periodic cell list so that each tetrahedron only tests the points close to it
+#             (not the same numbers as "grid": grid points lying exactly on a face, e.g. of the T5 tetrahedra, are
+#             decided by round-off and fall inside for other sites than with the shifted masks. The T5 occupancy
+#             from the 4a sites can differ by a few percent from "grid" and from the same tetrahedra seen from the 4d sites)
+# "weights"-> the tetrahedra are placed exactly at every site and every voxel counts with the exact fraction of its
+#             volume inside the tetrahedra (no noise from voxels cut by a face, accurate on much coarser grids)
+OccupancyMethod="grid"
 
 # The structure file is only used initially. Take an initial POSCAR without
 # any displacements or, if not possible otherwise, the first frame of an XDATCAR.
 # (With too large displacements the declaration of the 4d/4a sites might be screwed up)
 Structure_file="POSCAR"
 
+# Time per stage, points/s and peak memory are written to Tetrahdral_Occupancies.report.json (see run_report.py).
+# With Profile=True the occupancy loop runs under cProfile -> Tetrahdral_Occupancies.report.prof
+Report=True
+Profile=False
+
+report = run_report.StartReport("Li_tetra_type.py", {"Li_density_file": Li_density_file, "OccupancyMethod": OccupancyMethod,
+                                                     "Structure_file": Structure_file}, profile=Profile)
 
 
 
@@ -28,140 +49,19 @@ Structure_file="POSCAR"
 #           S  on 4a site: ptype -> 12
 #           Br on 4a site: ptype -> 13
 
-# Sites that are usually occupied S in case of 0% disorder
-Dict_4d_or_4c = {
-"A1": [0.25, 0.0, 0.125],
-"A2": [0.75, 0.0, 0.125],
-"A3": [0.25, 0.5, 0.125],
-"A4": [0.75, 0.5, 0.125],
-
-"B1": [0.0, 0.25, 0.375],
-"B2": [0.5, 0.25, 0.375],
-"B3": [0.0, 0.75, 0.375],
-"B4": [0.5, 0.75, 0.375],
-
-"C1": [0.25, 0.0, 0.625],
-"C2": [0.75, 0.0, 0.625],
-"C3": [0.25, 0.5, 0.625],
-"C4": [0.75, 0.5, 0.625],
-
-"D1": [0.0, 0.25, 0.875],
-"D2": [0.5, 0.25, 0.875],
-"D3": [0.0, 0.75, 0.875],
-"D4": [0.5, 0.75, 0.875]
-}
-
-# Sites that are usually occupied Br in case of 0% disorder
-Dict_4a = {
-"0.00-1": [0.25, 0.25, 0.0],
-"0.00-2": [0.25, 0.75, 0.0],
-"0.00-3": [0.75, 0.25, 0.0],
-"0.00-4": [0.75, 0.75, 0.0],
-
-"0.25-1": [0.0, 0.0, 0.25],
-"0.25-2": [0.5, 0.0, 0.25],
-"0.25-3": [0.0, 0.5, 0.25],
-"0.25-4": [0.5, 0.5, 0.25],
-
-"0.50-1": [0.25, 0.25, 0.5],
-"0.50-2": [0.25, 0.75, 0.5],
-"0.50-3": [0.75, 0.25, 0.5],
-"0.50-4": [0.75, 0.75, 0.5],
-
-"0.75-1": [0.0, 0.0, 0.75],
-"0.75-2": [0.5, 0.0, 0.75],
-"0.75-3": [0.0, 0.5, 0.75],
-"0.75-4": [0.5, 0.5, 0.75]
-}
-
-# Load the simulation trajectory consisting of several frames.
-# Pipeline1 only used for the initial analysis of sites:
-pipeline1 = import_file(Structure_file)
-data = pipeline1.compute()
-SimBox=data.cell #used later to adapt Li density Box and to calculate the shifts
-ptype = data.particles_["Particle Type_"]
-
-# Store Atom IDs of relevant atoms
-Li_id = ptype.type_by_name('Li').id
-Br_id = ptype.type_by_name('Br').id
-try:
-    S_id = ptype.type_by_name('S2').id
-except KeyError:
-    S_id = ptype.type_by_name('S').id
-
-# Create Nearest Neighbor Finder
-N = 1
-nearest_finder = NearestNeighborFinder(N, data)
-
-# Change particle type of S/Br on 4d sites
-for coord in Dict_4d_or_4c.values():
-    x = coord[0] * data.cell[0][0]
-    y = coord[1] * data.cell[1][1]
-    z = coord[2] * data.cell[2][2]
-    # Use Neighborfinder find_at() function to find closest atom to hard-coded 4d/4c coords
-    closest_atom = [neigh.index for neigh in nearest_finder.find_at((x,y,z))][0]
-    # S on 4d site: ptype -> 10
-    if ptype[closest_atom] == S_id:
-        ptype[closest_atom] = 10
-    #Br on 4d site: ptype -> 11
-    elif ptype[closest_atom] == Br_id:
-        ptype[closest_atom] = 11
-    elif ptype[closest_atom] == Li_id:
-            print("Error! A Li was probably closer to the 4a site than the S or Br ion! check for id {}".format(closest_atom))
-
-# Change particle type of S/Br on 4a sites
-for coord in Dict_4a.values():
-    x = coord[0]*data.cell[0][0]
-    y = coord[1]*data.cell[1][1]
-    z = coord[2]*data.cell[2][2]
-    # Use Neighborfinder find_at() function to find closest atom to hard-coded 4d/4c coords
-    closest_atom = [neigh.index for neigh in nearest_finder.find_at((x,y,z))][0]
-    # S on 4a site: ptype -> 12
-    if ptype[closest_atom] == S_id:
-        ptype[closest_atom] = 12
-    #Br on 4a site: ptype -> 13
-    elif ptype[closest_atom] == Br_id:
-        ptype[closest_atom] = 13
-    elif ptype[closest_atom] == Li_id:
-            print("Error! A Li was probably closer to the 4a site than the S or Br ion! check for id {}".format(closest_atom))
-
-# Go through all atoms again and store their coordinates in the respective list
-S_on_4d_type_10  = []
-Br_on_4d_type_11 = []
-S_on_4a_type_12  = []
-Br_on_4a_type_13 = []
-for atom,Type in enumerate(data.particles["Particle Type"]):
-    if data.particles["Particle Type"][atom] == 10:
-        pos = [float(data.particles["Position"][atom][0]),
-               float(data.particles["Position"][atom][1]),
-               float(data.particles["Position"][atom][2])]
-        S_on_4d_type_10.append(pos)
-    if data.particles["Particle Type"][atom] == 11:
-        pos = [float(data.particles["Position"][atom][0]),
-               float(data.particles["Position"][atom][1]),
-               float(data.particles["Position"][atom][2])]
-        Br_on_4d_type_11.append(pos)
-    if data.particles["Particle Type"][atom] == 12:
-        pos = [float(data.particles["Position"][atom][0]),
-               float(data.particles["Position"][atom][1]),
-               float(data.particles["Position"][atom][2])]
-        S_on_4a_type_12.append(pos)
-    if data.particles["Particle Type"][atom] == 13:
-        pos = [float(data.particles["Position"][atom][0]),
-               float(data.particles["Position"][atom][1]),
-               float(data.particles["Position"][atom][2])]
-        Br_on_4a_type_13.append(pos)
-
-
-print("\nPositional analysis:")
-if (len(S_on_4d_type_10) == len(Br_on_4a_type_13)) and (len(S_on_4a_type_12) == len(Br_on_4d_type_11)):
-    print("  Number comparison: S_Br=Br_S and S_S=Br_Br, therefore stoichiometric compound assumed")
-    SiteDisorder = 100*len(S_on_4a_type_12)/(len(S_on_4a_type_12)+len(S_on_4d_type_10))
-    print("  Site-disorder: {:.2f}% \n".format(SiteDisorder))
+# The reference 4d/4a sites (Dict_4d_or_4c, Dict_4a) are defined in anion_sites.py. All sites are matched
+# to the closest atom in one vectorized minimum-image distance computation (no OVITO needed).
+with run_report.Stage(report, "classify"):
+    structure_header, structure_positions = xdatcar.ReadPOSCAR(Structure_file)
+    structure_species = anion_sites.SpeciesPerAtom(structure_header)
+    sites = anion_sites.ClassifyAnionSites(structure_header["cell"], structure_positions, structure_species)
+anion_sites.PrintPositionalAnalysis(sites)
 
-else:
-    print("  Br and S anion sublattices not equally occupied: Non-stoichiometric compound or with defects.\n")
-    SiteDisorder = -1
+S_on_4d_type_10  = sites["S_on_4d"].tolist()
+Br_on_4d_type_11 = sites["Br_on_4d"].tolist()
+S_on_4a_type_12  = sites["S_on_4a"].tolist()
+Br_on_4a_type_13 = sites["Br_on_4a"].tolist()
+SiteDisorder     = sites["SiteDisorder"]
 
 
 # Initial words: There are five different tetrahedral sites
@@ -178,533 +78,118 @@ else:
 #              into a list here.)
 #
 #           b) import Li_density
-#           c) Remove all points with zero density to keep it clean
-#           d) not needed anymore due to extended xyz format.
-#              (previously: affine transformation to increase the box and make it fit to the POSCAR + enable PBC)
+#           c) rasterize every tetrahedron type once as a voxel mask relative to a site
+#              (previously: affine transformation + wrapping of the whole density for every site)
 #
 #           for all the different sites:
-#           e) affine transformation to shift the site of interest into the center of the box + wrap density
-#           f) python modifier to select only density points within tetrahedra and sum them up
+#           d) shift the masks to the site of interest (periodic index shift) and sum up the density
 #
-#           g) collect results and export to file
-
-
-# a) define tetrahedra
-tetra_list_4d_type1 = np.array([[[7.2729001045, 7.2729000523, 10.2854474863],
-                                 [8.9527950216, 10.9093501045, 11.6690458064],
-                                 [5.5930056529, 10.9093501045, 11.6690458064],
-                                 [7.2729001045, 9.2294556529, 14.0445731902]],
-                                [[7.2729001045, 7.2729000523, 10.2854474863],
-                                 [8.9527950216, 3.63645, 11.6690458064],
-                                 [5.5930056529, 3.63645, 11.6690458064],
-                                 [7.2729001045, 5.3163444516, 14.0445731902]],
-                                [[7.2729001045, 7.2729000523, 10.2854474863],
-                                 [10.9093503895, 5.5930054843, 8.9018486725],
-                                 [10.9093503895, 8.9527942566, 8.9018486725],
-                                 [9.2294549924, 7.2729000523, 6.5263210624]],
-                                [[7.2729001045, 7.2729000523, 10.2854474863],
-                                 [3.6364500523, 5.5930054843, 8.9018486725],
-                                 [3.6364500523, 8.9527942566, 8.9018486725],
-                                 [5.3163442566, 7.2729000523, 6.5263210624]]])
-
-tetra_list_4d_type2 = np.array([[[7.2729001045, 7.2729000523, 10.2854474863],
-                                 [10.9093503895, 7.2729000523, 12.8568099817],
-                                 [8.9527950216, 10.9093501045, 11.6690458064],
-                                 [7.2729001045, 9.2294556529, 14.0445731902]],
-                                [[7.2729001045, 7.2729000523, 10.2854474863],
-                                 [10.9093503895, 7.2729000523, 12.8568099817],
-                                 [8.9527950216, 3.63645, 11.6690458064],
-                                 [7.2729001045, 5.3163444516, 14.0445731902]],
-                                [[7.2729001045, 7.2729000523, 10.2854474863],
-                                 [10.9093503895, 7.2729000523, 12.8568099817],
-                                 [10.9093503895, 5.5930054843, 8.9018486725],
-                                 [10.9093503895, 8.9527942566, 8.9018486725]],
-                                [[7.2729001045, 7.2729000523, 10.2854474863],
-                                 [3.6364500523, 7.2729000523, 12.8568099817],
-                                 [5.5930056529, 10.9093501045, 11.6690458064],
-                                 [7.2729001045, 9.2294556529, 14.0445731902]],
-                                [[7.2729001045, 7.2729000523, 10.2854474863],
-                                 [3.6364500523, 7.2729000523, 12.8568099817],
-                                 [5.5930056529, 3.63645, 11.6690458064],
-                                 [7.2729001045, 5.3163444516, 14.0445731902]],
-                                [[7.2729001045, 7.2729000523, 10.2854474863],
-                                 [3.6364500523, 7.2729000523, 12.8568099817],
-                                 [3.6364500523, 5.5930054843, 8.9018486725],
-                                 [3.6364500523, 8.9527942566, 8.9018486725]],
-                                [[7.2729001045, 7.2729000523, 10.2854474863],
-                                 [7.2729001045, 10.9093501045, 7.7140849909],
-                                 [10.9093503895, 8.9527942566, 8.9018486725],
-                                 [9.2294549924, 7.2729000523, 6.5263210624]],
-                                [[7.2729001045, 7.2729000523, 10.2854474863],
-                                 [7.2729001045, 10.9093501045, 7.7140849909],
-                                 [3.6364500523, 8.9527942566, 8.9018486725],
-                                 [5.3163442566, 7.2729000523, 6.5263210624]],
-                                [[7.2729001045, 7.2729000523, 10.2854474863],
-                                 [7.2729001045, 10.9093501045, 7.7140849909],
-                                 [8.9527950216, 10.9093501045, 11.6690458064],
-                                 [5.5930056529, 10.9093501045, 11.6690458064]],
-                                [[7.2729001045, 7.2729000523, 10.2854474863],
-                                 [7.2729001045, 3.63645, 7.7140849909],
-                                 [10.9093503895, 5.5930054843, 8.9018486725],
-                                 [9.2294549924, 7.2729000523, 6.5263210624]],
-                                [[7.2729001045, 7.2729000523, 10.2854474863],
-                                 [7.2729001045, 3.63645, 7.7140849909],
-                                 [3.6364500523, 5.5930054843, 8.9018486725],
-                                 [5.3163442566, 7.2729000523, 6.5263210624]],
-                                [[7.2729001045, 7.2729000523, 10.2854474863],
-                                 [7.2729001045, 3.63645, 7.7140849909],
-                                 [8.9527950216, 3.63645, 11.6690458064],
-                                 [5.5930056529, 3.63645, 11.6690458064]]])
-
-tetra_list_4a_type2 = np.array([[[10.9093503895, 7.2729001045, 7.7140924954],
-                                 [7.2729001045, 7.2729001045, 10.2854549908],
-                                 [9.2294549924, 10.9093503895, 9.0976910624],
-                                 [10.9093503895, 9.2294549924, 11.4732186725]],
-                                [[10.9093503895, 7.2729001045, 7.7140924954],
-                                 [7.2729001045, 7.2729001045, 10.2854549908],
-                                 [9.2294549924, 3.6364500523, 9.0976910624],
-                                 [10.9093503895, 5.3163442566, 11.4732186725]],
-                                [[3.6364500523, 7.2729001045, 7.7140924954],
-                                 [7.2729001045, 7.2729001045, 10.2854549908],
-                                 [5.3163442566, 10.9093503895, 9.0976910624],
-                                 [3.6364500523, 9.2294549924, 11.4732186725]],
-                                [[3.6364500523, 7.2729001045, 7.7140924954],
-                                 [7.2729001045, 7.2729001045, 10.2854549908],
-                                 [5.3163442566, 3.6364500523, 9.0976910624],
-                                 [3.6364500523, 5.3163442566, 11.4732186725]],
-                                [[10.9093503895, 7.2729001045, 7.7140924954],
-                                 [7.2729001045, 7.2729001045, 10.2854549908],
-                                 [7.2729001045, 8.9527950216, 6.3304936816],
-                                 [7.2729001045, 5.5930056529, 6.3304936816]],
-                                [[3.6364500523, 7.2729001045, 7.7140924954],
-                                 [7.2729001045, 7.2729001045, 10.2854549908],
-                                 [7.2729001045, 8.9527950216, 6.3304936816],
-                                 [7.2729001045, 5.5930056529, 6.3304936816]],
-                                [[7.2729001045, 10.9093503895, 12.8568174863],
-                                 [7.2729001045, 7.2729001045, 10.2854549908],
-                                 [10.9093503895, 9.2294549924, 11.4732186725],
-                                 [9.2294549924, 10.9093503895, 9.0976910624]],
-                                [[7.2729001045, 3.6364500523, 12.8568174863],
-                                 [7.2729001045, 7.2729001045, 10.2854549908],
-                                 [10.9093503895, 5.3163442566, 11.4732186725],
-                                 [9.2294549924, 3.6364500523, 9.0976910624]],
-                                [[7.2729001045, 10.9093503895, 12.8568174863],
-                                 [7.2729001045, 7.2729001045, 10.2854549908],
-                                 [3.6364500523, 9.2294549924, 11.4732186725],
-                                 [5.3163442566, 10.9093503895, 9.0976910624]],
-                                [[7.2729001045, 3.6364500523, 12.8568174863],
-                                 [7.2729001045, 7.2729001045, 10.2854549908],
-                                 [3.6364500523, 5.3163442566, 11.4732186725],
-                                 [5.3163442566, 3.6364500523, 9.0976910624]],
-                                [[7.2729001045, 10.9093503895, 12.8568174863],
-                                 [7.2729001045, 7.2729001045, 10.2854549908],
-                                 [8.9527950216, 7.2729001045, 14.2404158064],
-                                 [5.5930056529, 7.2729001045, 14.2404158064]],
-                                [[7.2729001045, 3.6364500523, 12.8568174863],
-                                 [7.2729001045, 7.2729001045, 10.2854549908],
-                                 [8.9527950216, 7.2729001045, 14.2404158064],
-                                 [5.5930056529, 7.2729001045, 14.2404158064]]])
-
-tetra_list_4d_type3 = np.array([[[5.3163442566, 7.2729000523, 16.8117717641],
-                                 [7.2729001045, 5.3163444516, 14.0445731902],
-                                 [7.2729001045, 9.2294556529, 14.0445731902],
-                                 [9.2294549924, 7.2729000523, 16.8117717641]]])
-
-tetra_list_4d_type4 = np.array([[[9.2294549924, 7.2729000523, 16.8117717641],
-                                 [10.9093503895, 7.2729000523, 12.8568099817],
-                                 [7.2729001045, 5.3163444516, 14.0445731902],
-                                 [7.2729001045, 9.2294556529, 14.0445731902]],
-                                [[5.3163442566, 7.2729000523, 16.8117717641],
-                                 [3.6364500523, 7.2729000523, 12.8568099817],
-                                 [7.2729001045, 5.3163444516, 14.0445731902],
-                                 [7.2729001045, 9.2294556529, 14.0445731902]],
-                                [[5.3163442566, 7.2729000523, 6.5263210624],
-                                 [7.2729001045, 10.9093501045, 7.7140849909],
-                                 [7.2729001045, 9.2294556529, 3.7591236816],
-                                 [9.2294549924, 7.2729000523, 6.5263210624]],
-                                [[5.3163442566, 7.2729000523, 6.5263210624],
-                                 [7.2729001045, 3.63645, 7.7140849909],
-                                 [7.2729001045, 5.3163444516, 3.7591236816],
-                                 [9.2294549924, 7.2729000523, 6.5263210624]]])
-
-tetra_list_4a_type4 = np.array([[[10.9093503895, 9.2294549924, 11.4732186725],
-                                 [7.2729001045, 7.2729001045, 10.2854549908],
-                                 [8.9527950216, 7.2729001045, 14.2404158064],
-                                 [10.9093503895, 5.3163442566, 11.4732186725]],
-                                [[3.6364500523, 5.3163442566, 11.4732186725],
-                                 [7.2729001045, 7.2729001045, 10.2854549908],
-                                 [5.5930056529, 7.2729001045, 14.2404158064],
-                                 [3.6364500523, 9.2294549924, 11.4732186725]],
-                                [[9.2294549924, 10.9093503895, 9.0976910624],
-                                 [7.2729001045, 7.2729001045, 10.2854549908],
-                                 [7.2729001045, 8.9527950216, 6.3304936816],
-                                 [5.3163442566, 10.9093503895, 9.0976910624]],
-                                [[5.3163442566, 3.6364500523, 9.0976910624],
-                                 [7.2729001045, 7.2729001045, 10.2854549908],
-                                 [7.2729001045, 5.5930056529, 6.3304936816],
-                                 [9.2294549924, 3.6364500523, 9.0976910624]]])
-
-tetra_list_4d_type5 = np.array([[[7.2729001045, 7.2729000523, 10.2854474863],
-                                 [10.9093503895, 7.2729000523, 12.8568099817],
-                                 [7.2729001045, 5.3163444516, 14.0445731902],
-                                 [7.2729001045, 9.2294556529, 14.0445731902]],
-                                [[7.2729001045, 7.2729000523, 10.2854474863],
-                                 [3.6364500523, 7.2729000523, 12.8568099817],
-                                 [7.2729001045, 5.3163444516, 14.0445731902],
-                                 [7.2729001045, 9.2294556529, 14.0445731902]],
-                                [[7.2729001045, 7.2729000523, 10.2854474863],
-                                 [7.2729001045, 10.9093501045, 7.7140849909],
-                                 [5.3163442566, 7.2729000523, 6.5263210624],
-                                 [9.2294549924, 7.2729000523, 6.5263210624]],
-                                [[7.2729001045, 7.2729000523, 10.2854474863],
-                                 [7.2729001045, 3.63645, 7.7140849909],
-                                 [5.3163442566, 7.2729000523, 6.5263210624],
-                                 [9.2294549924, 7.2729000523, 6.5263210624]],
-                                [[7.2729001045, 7.2729000523, 10.2854474863],
-                                 [10.9093503895, 7.2729000523, 12.8568099817],
-                                 [10.9093503895, 5.5930054843, 8.9018486725],
-                                 [8.9527950216, 3.63645, 11.6690458064]],
-                                [[7.2729001045, 7.2729000523, 10.2854474863],
-                                 [7.2729001045, 3.63645, 7.7140849909],
-                                 [8.9527950216, 3.63645, 11.6690458064],
-                                 [10.9093503895, 5.5930054843, 8.9018486725]],
-                                [[7.2729001045, 7.2729000523, 10.2854474863],
-                                 [10.9093503895, 7.2729000523, 12.8568099817],
-                                 [10.9093503895, 8.9527942566, 8.9018486725],
-                                 [8.9527950216, 10.9093501045, 11.6690458064]],
-                                [[7.2729001045, 7.2729000523, 10.2854474863],
-                                 [7.2729001045, 10.9093501045, 7.7140849909],
-                                 [8.9527950216, 10.9093501045, 11.6690458064],
-                                 [10.9093503895, 8.9527942566, 8.9018486725]],
-                                [[7.2729001045, 7.2729000523, 10.2854474863],
-                                 [3.6364500523, 7.2729000523, 12.8568099817],
-                                 [3.6364500523, 5.5930054843, 8.9018486725],
-                                 [5.5930056529, 3.63645, 11.6690458064]],
-                                [[7.2729001045, 7.2729000523, 10.2854474863],
-                                 [7.2729001045, 3.63645, 7.7140849909],
-                                 [5.5930056529, 3.63645, 11.6690458064],
-                                 [3.6364500523, 5.5930054843, 8.9018486725]],
-                                [[7.2729001045, 7.2729000523, 10.2854474863],
-                                 [3.6364500523, 7.2729000523, 12.8568099817],
-                                 [3.6364500523, 8.9527942566, 8.9018486725],
-                                 [5.5930056529, 10.9093501045, 11.6690458064]],
-                                [[7.2729001045, 7.2729000523, 10.2854474863],
-                                 [7.2729001045, 10.9093501045, 7.7140849909],
-                                 [5.5930056529, 10.9093501045, 11.6690458064],
-                                 [3.6364500523, 8.9527942566, 8.9018486725]]])
-
-tetra_list_4a_type5 = np.array([[[7.2729001045, 10.9093503895, 12.8568174863],
-                                 [7.2729001045, 7.2729001045, 10.2854549908],
-                                 [8.9527950216, 7.2729001045, 14.2404158064],
-                                 [10.9093503895, 9.2294549924, 11.4732186725]],
-                                [[7.2729001045, 10.9093503895, 12.8568174863],
-                                 [7.2729001045, 7.2729001045, 10.2854549908],
-                                 [5.5930056529, 7.2729001045, 14.2404158064],
-                                 [3.6364500523, 9.2294549924, 11.4732186725]],
-                                [[7.2729001045, 3.6364500523, 12.8568174863],
-                                 [7.2729001045, 7.2729001045, 10.2854549908],
-                                 [8.9527950216, 7.2729001045, 14.2404158064],
-                                 [10.9093503895, 5.3163442566, 11.4732186725]],
-                                [[7.2729001045, 3.6364500523, 12.8568174863],
-                                 [7.2729001045, 7.2729001045, 10.2854549908],
-                                 [5.5930056529, 7.2729001045, 14.2404158064],
-                                 [3.6364500523, 5.3163442566, 11.4732186725]],
-                                [[10.9093503895, 7.2729001045, 7.7140924954],
-                                 [7.2729001045, 7.2729001045, 10.2854549908],
-                                 [7.2729001045, 8.9527950216, 6.3304936816],
-                                 [9.2294549924, 10.9093503895, 9.0976910624]],
-                                [[3.6364500523, 7.2729001045, 7.7140924954],
-                                 [7.2729001045, 7.2729001045, 10.2854549908],
-                                 [7.2729001045, 8.9527950216, 6.3304936816],
-                                 [5.3163442566, 10.9093503895, 9.0976910624]],
-                                [[10.9093503895, 7.2729001045, 7.7140924954],
-                                 [7.2729001045, 7.2729001045, 10.2854549908],
-                                 [7.2729001045, 5.5930056529, 6.3304936816],
-                                 [9.2294549924, 3.6364500523, 9.0976910624]],
-                                [[3.6364500523, 7.2729001045, 7.7140924954],
-                                 [7.2729001045, 7.2729001045, 10.2854549908],
-                                 [7.2729001045, 5.5930056529, 6.3304936816],
-                                 [5.3163442566, 3.6364500523, 9.0976910624]],
-                                [[10.9093503895, 7.2729001045, 7.7140924954],
-                                 [7.2729001045, 7.2729001045, 10.2854549908],
-                                 [10.9093503895, 5.3163442566, 11.4732186725],
-                                 [10.9093503895, 9.2294549924, 11.4732186725]],
-                                [[3.6364500523, 7.2729001045, 7.7140924954],
-                                 [7.2729001045, 7.2729001045, 10.2854549908],
-                                 [3.6364500523, 5.3163442566, 11.4732186725],
-                                 [3.6364500523, 9.2294549924, 11.4732186725]],
-                                [[7.2729001045, 10.9093503895, 12.8568174863],
-                                 [7.2729001045, 7.2729001045, 10.2854549908],
-                                 [5.3163442566, 10.9093503895, 9.0976910624],
-                                 [9.2294549924, 10.9093503895, 9.0976910624]],
-                                [[7.2729001045, 3.6364500523, 12.8568174863],
-                                 [7.2729001045, 7.2729001045, 10.2854549908],
-                                 [5.3163442566, 3.6364500523, 9.0976910624],
-                                 [9.2294549924, 3.6364500523, 9.0976910624]]])
-
-
-
-def TranslationToCenterOfBox(target_box,pos):
-    """
-    Takes the target box and determines the translation matrix
-    for the affine transformation modifier
-    returns translation matrix
-    """
-    x_shift = target_box[0][0] / 2 - pos[0]
-    y_shift = target_box[1][1] / 2 - pos[1]
-    z_shift = target_box[2][2] / 2 - pos[2]
-    trans =[[1.0, 0.0, 0.0, x_shift],
-            [0.0, 1.0, 0.0, y_shift],
-            [0.0, 0.0, 1.0, z_shift]]
-    return trans
-
-#Tetrahedron and pointInside Taken from https://stackoverflow.com/a/60745339
-def Tetrahedron(vertices):
-    """
-    Given a list of the xyz coordinates of the vertices of a tetrahedron,
-    return tetrahedron coordinate system
-    """
-    origin, *rest = vertices
-    mat = (np.array(rest) - origin).T
-    tetra = np.linalg.inv(mat)
-    return tetra, origin
-
-
-def pointInside(point, tetra, origin):
-    """
-    Takes a single point or array of points, as well as tetra and origin objects returned by
-    the Tetrahedron function.
-    Returns a boolean or boolean array indicating whether the point is inside the tetrahedron.
-    """
-    newp = np.matmul(tetra, (point - origin).T).T
-    return np.all(newp >= 0, axis=-1) & np.all(newp <= 1, axis=-1) & (np.sum(newp, axis=-1) <= 1)
-
-
-def SelectDensityAndSumUp(frame: int, data: DataCollection, tetra_list):
-    """
-    Clears the selection first, then selects all points within the
-    specified tetrahedra and sums up their densities
-    returns summed density
-    """
-    # To be on the safe side: clear selection first
-    sel = data.particles_["Selection_"]
-    for i in range(len(sel)):
-        sel[i]=0
-
-    points = data.particles.positions
-
-    for tetra in tetra_list:
-        vertices = tetra
-        tetra, origin = Tetrahedron(vertices)
-        inTet = pointInside(points, tetra, origin)
-        sel[inTet] = 1
-
-        density = data.particles["Density"][data.particles["Selection"] == 1]
-
-    return np.sum(density)
+#           e) collect results and export to file
 
-# b) import Li density and do some checks.
-pipeline2=import_file(Li_density_file, columns =
-  ["Position.X", "Position.Y", "Position.Z", "Density"])
 
-data               = pipeline2.compute()
-N_bins             = len(data.particles["Density"])
-true_total_density = np.sum(data.particles["Density"])
+# a) The tetrahedra are taken from the library in tetrahedra.py. They are stored as fractional offsets from the
+#    site and are scaled to the actual cell of the density (cached per cell and grid shape).
+#    Their corners are moved to the anion/P positions of the structure file (averaged over the sites of the class,
+#    the library itself if the structure reproduces it, see tetrahedra.StructureTetrahedra).
+fractional, deviation = tetrahedra.StructureTetrahedra(structure_header["cell"], structure_positions, structure_species, sites)
+print("Tetrahedron corners deviate by up to {:.4f} A from the library".format(deviation))
+
+# b) import Li density and do some checks.
+#    Both formats are read natively: the binary grid is memory-mapped, archived extended xyz files
+#    are parsed in large chunks and the grid shape is inferred from the coordinates.
+#    The grid point coordinates are implied by the lattice and the grid shape.
+with run_report.Stage(report, "load_grid"):
+    if Li_density_file.endswith(".xyz"):
+        grid, density_cell = density_grid.ReadExtendedXYZ(Li_density_file)
+        deposition = "ngp"
+    elif Li_density_file.endswith(".sparse.npz"):
+        grid = density_grid.ReadSparseGrid(Li_density_file)
+        density_cell = grid["cell"]
+        deposition = grid["deposition"]
+    else:
+        grid, grid_header = density_grid.ReadDensityGrid(Li_density_file)
+        density_cell = grid_header["cell"]
+        deposition = grid_header["deposition"]
+    sparse_grid = isinstance(grid, dict)
+    grid_shape  = tuple(grid["shape"]) if sparse_grid else grid.shape
+
+    N_bins             = int(np.prod(grid_shape))
+    #   the sum touches every value, so a memory-mapped grid is actually read here
+    true_total_density = np.sum(grid["values"]) if sparse_grid else np.sum(grid)
+cell_volume        = float(abs(np.linalg.det(density_cell)))
 
 print("\nNumber of bins:  {}".format(N_bins))
 print("Total Density:   {:.3f}\n".format(true_total_density))
 
 
-if (data.cell.pbc[0] == True) and (data.cell.pbc[1] == True) and (data.cell.pbc[2] == True):
-    print("PBC are enabled. Continue...\n")
+# c) Which tetrahedron types are evaluated around which site (index 0..4 -> type 1..5):
+#    Type 3 is evaluated based on the 4d sites only (should be zero anyway) -> counts only for the total_density.
+#    Type 4 is not around the 4d site and type 1 not around the 4a site.
+types_4d = tetrahedra.TYPES_4D
+types_4a = tetrahedra.TYPES_4A
+
+if OccupancyMethod == "grid":
+    # tetrahedra scaled to the cell of the density and rasterized once (cached per cell and grid shape)
+    print("Rasterizing tetrahedra on the {}x{}x{} grid...".format(*grid_shape[::-1]))
+    with run_report.Stage(report, "tetrahedra"):
+        library = tetrahedra.TetrahedronLibrary(density_cell, grid_shape, fractional)
+elif OccupancyMethod == "points":
+    # tetrahedra scaled to the cell of the density + periodic cell list over the nonzero density points
+    with run_report.Stage(report, "tetrahedra"):
+        library = tetrahedra.TetrahedronLibrary(density_cell, fractional=fractional)
+        if not sparse_grid:
+            grid = density_grid.DenseToSparse(grid, density_cell)
+        nonzero        = grid["index"]
+        density_values = grid["values"]
+        cell_list      = tetrahedra.BuildCellList(density_grid.GridPointsAt(density_cell, grid_shape, nonzero), density_cell)
+    print("Cell list with {} nonzero density points".format(len(nonzero)))
+elif OccupancyMethod == "weights":
+    # the weight tables are computed for every sub-voxel position of the sites and cached (see tetrahedra.py)
+    voxel_origin = density_grid.VOXEL_ORIGIN[deposition]
+    print("Partial volume weights on the {}x{}x{} grid ({} deposition)".format(*grid_shape[::-1], deposition))
 else:
-    print("Ups! The PBC are not enabled. Make sure to use extended xyz format for the Li density file!\nAborting...")
+    print("Unknown OccupancyMethod '{}'. Use 'grid', 'points' or 'weights'.\nAborting...".format(OccupancyMethod))
     exit()
 
-
-# c) remove all points with 0 Li density to deal with less data
-pipeline2.modifiers.append(ExpressionSelectionModifier(expression = 'Density == 0'))
-pipeline2.modifiers.append(DeleteSelectedModifier())
-
-# Outdated because of extended xyz format:
-# d) affine transformation to increase (only) the box and make it fit to the POSCAR + enable PBC
-#pipeline2.modifiers.append(AffineTransformationModifier(
-#    relative_mode = False,
-#    operate_on = {'cell'},
-#    target_cell = SimBox))#SimBox taken from StructureFile above
-#pipeline2.modifiers.append(EnablePBC(data=data))
-
-# e) Setup affine transformation modifier to shift the density + enable Wrapping
-#    The shift itself will be specified in the for loop below based on the S/Br positions on 4d/4a
-affine_translation_density_mod = AffineTransformationModifier(
-    relative_mode = True,
-    operate_on = {'particles'})
-pipeline2.modifiers.append(affine_translation_density_mod)
-pipeline2.modifiers.append(WrapPeriodicImagesModifier())
-
-# f) python modifier to select only density points within tetrahedra and sum them up
+# d) sum up the density in the tetrahedra around all sites
 total_density         = [0, 0, 0, 0, 0] #for type 1 to type 5
-
-total_density_S_on_4d = [0, 0, float('nan'), float('nan'), 0]
-if S_on_4d_type_10: #only do the analysis if list is not empty
-    print("Started S on 4d...")
-    count = 1
-    for coordinate in S_on_4d_type_10:
-        print("   ...progress: Atom {:d} of {:d}".format(count,len(S_on_4d_type_10)))
-        # Shift the density to center of box
-        Translation = TranslationToCenterOfBox(target_box=SimBox,pos=coordinate)
-        affine_translation_density_mod.transformation = Translation
-        # Execute the pipeline
-        data = pipeline2.compute()
-        data.particles_.create_property("Selection")
-        # Does the actual analyis. Determines density:
-
-        ### S on 4d type 1:
-        dens = SelectDensityAndSumUp(frame=0, data=data, tetra_list=tetra_list_4d_type1)
-        total_density_S_on_4d[0] = total_density_S_on_4d[0] + dens
-        total_density[0] = total_density[0] + dens
-
-        ### S on 4d type 2 (needs to analyzed based on S and Br as well as based from 4d and 4a):
-        dens = SelectDensityAndSumUp(frame=0, data=data, tetra_list=tetra_list_4d_type2)
-        total_density_S_on_4d[1] = total_density_S_on_4d[1] + dens
-        total_density[1] = total_density[1] + dens
-
-        ### S on 4d type 3 (should be zero anyway. No need to look at it based on 4a sites)
-        dens = SelectDensityAndSumUp(frame=0, data=data, tetra_list=tetra_list_4d_type3)
-        #total_density_S_on_4d[2] = total_density_S_on_4d[2] + dens
-        total_density[2] = total_density[2] + dens
-
-        ### type 4 is not around the 4d site. No need to evaluate it here for the total_density_S_on_4d, but needed for the total_density
-        #dens = SelectDensityAndSumUp(frame=0, data=data, tetra_list=tetra_list_4d_type4)
-        #total_density_S_on_4d[3] = total_density_S_on_4d[3] + dens
-        #total_density[3] = total_density[3] + dens
-
-        ### S on 4d type 5 (needs to analyzed based on S and Br as well as based from 4d and 4a):
-        dens = SelectDensityAndSumUp(frame=0, data=data, tetra_list=tetra_list_4d_type5)
-        total_density_S_on_4d[4] = total_density_S_on_4d[4] + dens
-        total_density[4] = total_density[4] + dens
-
-        count = count + 1
-
+total_density_S_on_4d  = [0, 0, float('nan'), float('nan'), 0]
 total_density_Br_on_4d = [0, 0, float('nan'), float('nan'), 0]
-if Br_on_4d_type_11: #only do the analysis if list is not empty
-    print("Started Br on 4d...")
-    count = 1
-    for coordinate in Br_on_4d_type_11:
-        print("   ...progress: Atom {:d} of {:d}".format(count,len(Br_on_4d_type_11)))
-        # Shift the density to center of box
-        Translation = TranslationToCenterOfBox(target_box=SimBox,pos=coordinate)
-        affine_translation_density_mod.transformation = Translation
-        # Execute the pipeline
-        data = pipeline2.compute()
-        data.particles_.create_property("Selection")
-        # Does the actual analyis. Determines density:
-
-        ### Br on 4d type 1:
-        dens = SelectDensityAndSumUp(frame=0, data=data, tetra_list=tetra_list_4d_type1)
-        total_density_Br_on_4d[0] = total_density_Br_on_4d[0] + dens
-        total_density[0] = total_density[0] + dens
-
-        ### Br on 4d type 2 (needs to analyzed based on S and Br as well as based from 4d and 4a):
-        dens = SelectDensityAndSumUp(frame=0, data=data, tetra_list=tetra_list_4d_type2)
-        total_density_Br_on_4d[1] = total_density_Br_on_4d[1] + dens
-        total_density[1] = total_density[1] + dens
-
-        ### Br on 4d type 3 (should be zero anyway. No need to look at it based on 4a sites)
-        dens = SelectDensityAndSumUp(frame=0, data=data, tetra_list=tetra_list_4d_type3)
-        #total_density_Br_on_4d[2] = total_density_Br_on_4d[2] + dens
-        total_density[2] = total_density[2] + dens
-
-        ### type 4 is not around the 4d site. No need to evaluate it here for the total_density_Br_on_4d, but needed for the total_density
-        #dens = SelectDensityAndSumUp(frame=0, data=data, tetra_list=tetra_list_4d_type4)
-        #total_density_Br_on_4d[3] = total_density_Br_on_4d[3] + dens
-        #total_density[3] = total_density[3] + dens
-
-        ### Br on 4d type 5 (needs to analyzed based on S and Br as well as based from 4d and 4a):
-        dens = SelectDensityAndSumUp(frame=0, data=data, tetra_list=tetra_list_4d_type5)
-        total_density_Br_on_4d[4] = total_density_Br_on_4d[4] + dens
-        total_density[4] = total_density[4] + dens
-
-        count = count + 1
-
-total_density_S_on_4a = [float('nan'), 0, float('nan'), 0, 0]
-if S_on_4a_type_12: #only do the analysis if list is not empty
-    print("Started S on 4a...")
-    count = 1
-    for coordinate in S_on_4a_type_12:
-        print("   ...progress: Atom {:d} of {:d}".format(count,len(S_on_4a_type_12)))
-        # Shift the density to center of box
-        Translation = TranslationToCenterOfBox(target_box=SimBox,pos=coordinate)
-        affine_translation_density_mod.transformation = Translation
-        # Execute the pipeline
-        data = pipeline2.compute()
-        data.particles_.create_property("Selection")
-        # Does the actual analyis. Determines density:
-
-        ### No type 1 site around the 4a site
-        #dens = SelectDensityAndSumUp(frame=0, data=data, tetra_list=tetra_list_4a_type1)
-        #total_density_S_on_4a[0] = total_density_Br_on_4d[0] + dens
-        #total_density[0] = total_density[0] + dens
-
-        ### Type 2 sites (around 4a and 4d sites)
-        dens = SelectDensityAndSumUp(frame=0, data=data, tetra_list=tetra_list_4a_type2)
-        total_density_S_on_4a[1] = total_density_S_on_4a[1] + dens
-        total_density[1] = total_density[1] + dens
-
-        ### Type 3 already evaluated based on the 4d sites
-
-        ### Type 4 sites (only around 4a sites):
-        dens = SelectDensityAndSumUp(frame=0, data=data, tetra_list=tetra_list_4a_type4)
-        total_density_S_on_4a[3] = total_density_S_on_4a[3] + dens
-        total_density[3] = total_density[3] + dens
-
-        ### Type 5 site (around 4a and 4d sites)
-        dens = SelectDensityAndSumUp(frame=0, data=data, tetra_list=tetra_list_4a_type5)
-        total_density_S_on_4a[4] = total_density_S_on_4a[4] + dens
-        total_density[4] = total_density[4] + dens
-
-        count = count + 1
-
+total_density_S_on_4a  = [float('nan'), 0, float('nan'), 0, 0]
 total_density_Br_on_4a = [float('nan'), 0, float('nan'), 0, 0]
-if Br_on_4a_type_13: #only do the analysis if list is not empty
-    print("Started Br on 4a...")
-    count = 1
-    for coordinate in Br_on_4a_type_13:
-        print("   ...progress: Atom {:d} of {:d}".format(count,len(Br_on_4a_type_13)))
-        # Shift the density to center of box
-        Translation = TranslationToCenterOfBox(target_box=SimBox,pos=coordinate)
-        affine_translation_density_mod.transformation = Translation
-        # Execute the pipeline
-        data = pipeline2.compute()
-        data.particles_.create_property("Selection")
-        # Does the actual analyis. Determines density:
-
-        ### No type 1 site around the 4a site
-        # dens = SelectDensityAndSumUp(frame=0, data=data, tetra_list=tetra_list_4a_type1)
-        # total_density_S_on_4a[0] = total_density_Br_on_4d[0] + dens
-        # total_density[0] = total_density[0] + dens
-
-        ### Type 2 sites (around 4a and 4d sites)
-        dens = SelectDensityAndSumUp(frame=0, data=data, tetra_list=tetra_list_4a_type2)
-        total_density_Br_on_4a[1] = total_density_Br_on_4a[1] + dens
-        total_density[1] = total_density[1] + dens
-
-        ### Type 3 already evaluated based on the 4d sites
-
-        ### Type 4 sites (only around 4a sites):
-        dens = SelectDensityAndSumUp(frame=0, data=data, tetra_list=tetra_list_4a_type4)
-        total_density_Br_on_4a[3] = total_density_Br_on_4a[3] + dens
-        total_density[3] = total_density[3] + dens
-
-        ### Type 5 site (around 4a and 4d sites)
-        dens = SelectDensityAndSumUp(frame=0, data=data, tetra_list=tetra_list_4a_type5)
-        total_density_Br_on_4a[4] = total_density_Br_on_4a[4] + dens
-        total_density[4] = total_density[4] + dens
-
-        count = count + 1
-        
-
-# g) Collect results and export
+
+for label, coordinates, site_types, site_density in (("S on 4d",  S_on_4d_type_10,  types_4d, total_density_S_on_4d),
+                                                     ("Br on 4d", Br_on_4d_type_11, types_4d, total_density_Br_on_4d),
+                                                     ("S on 4a",  S_on_4a_type_12,  types_4a, total_density_S_on_4a),
+                                                     ("Br on 4a", Br_on_4a_type_13, types_4a, total_density_Br_on_4a)):
+    if not coordinates: #only do the analysis if list is not empty
+        continue
+    print("Started {} ({} atoms)...".format(label, len(coordinates)))
+    run_report.Count(report, "sites", len(coordinates))
+    with run_report.Stage(report, "occupancy", profile=True):
+        if OccupancyMethod == "grid":
+            site_voxels = tetrahedra.SiteVoxels(coordinates, density_cell, grid_shape)
+        for Type, name in enumerate(site_types):
+            if name is None:
+                continue
+            if OccupancyMethod == "grid":
+                dens = tetrahedra.SumMaskAroundSites(grid, site_voxels, library["masks"][name])
+                # every site reads all voxels of the mask
+                run_report.Count(report, "points", len(coordinates) * len(library["masks"][name]))
+            elif OccupancyMethod == "weights":
+                dens = tetrahedra.SumWeightsAroundSites(grid, coordinates, density_cell, name, voxel_origin, fractional)
+            else:
+                dens = tetrahedra.SumDensityAroundSitesPoints(cell_list, density_values, library["relative"][name], coordinates)
+                run_report.Count(report, "tetrahedra", len(coordinates) * len(library["relative"][name]))
+            if not np.isnan(site_density[Type]):
+                site_density[Type] = site_density[Type] + dens
+            total_density[Type] = total_density[Type] + dens
+run_report.Rate(report, "sites", "occupancy")
+run_report.Rate(report, "points", "occupancy")
+run_report.Rate(report, "tetrahedra", "occupancy")
+
+
+# e) Collect results and export
 
 #Evaluaion of the average numerical density. Needed for a more appropriate normalization
 #Type1 only around 4d; Type2 both around 4a and 4d; Type3 is zero anyway; Type4 only around 4a; Type5 around both
@@ -716,150 +201,157 @@ print("of the true Total Density = {:.2f} (arbitrary units, not normalized)\n".f
 n = numerical_density
 t = total_density
 
-with open("Tetrahdral_Occupancies_Percentages.txt", "w") as f:
-    f.write("Site\tType1\tType2\tType3\tType4\tType5\t#So to say two different 'perspectives' (from 4a and 4d sites)\n")
-
-    d1 = total_density_S_on_4d
-    f.write("S_4d\t{:.3f}\t{:.3f}\t{}\t{}\t{:.3f}\n".format(100*d1[0]/n,100*d1[1]/n,".",".",100*d1[4]/n))
+with run_report.Stage(report, "write"):
+    with open("Tetrahdral_Occupancies_Percentages.txt", "w") as f:
+        f.write("Site\tType1\tType2\tType3\tType4\tType5\t#So to say two different 'perspectives' (from 4a and 4d sites)\n")
+
+        d1 = total_density_S_on_4d
+        f.write("S_4d\t{:.3f}\t{:.3f}\t{}\t{}\t{:.3f}\n".format(100*d1[0]/n,100*d1[1]/n,".",".",100*d1[4]/n))
+
+        d2 = total_density_Br_on_4d
+        f.write("Br_4d\t{:.3f}\t{:.3f}\t{}\t{}\t{:.3f}\n".format(100*d2[0]/n,100*d2[1]/n,".",".",100*d2[4]/n))
+
+        d3 = total_density_S_on_4a
+        f.write("S_4a\t{}\t{:.3f}\t{}\t{:.3f}\t{:.3f}\n".format(".",100*d3[1]/n,".",100*d3[3]/n,100*d3[4]/n))
+
+        d4 = total_density_Br_on_4a
+        f.write("Br_4a\t{}\t{:.3f}\t{}\t{:.3f}\t{:.3f}\n".format(".",100*d4[1]/n,".",100*d4[3]/n,100*d4[4]/n))
+
+        f.write("Total\t{:.3f}\t{:.3f}\t{:.3f}\t{:.3f}\t{:.3f}\n".format(100*t[0]/n, 100*t[1]/2/n, 100*t[2]/n, 100*t[3]/n, 100*t[4]/2/n))
+
 
-    d2 = total_density_Br_on_4d
-    f.write("Br_4d\t{:.3f}\t{:.3f}\t{}\t{}\t{:.3f}\n".format(100*d2[0]/n,100*d2[1]/n,".",".",100*d2[4]/n))
+    with open("Tetrahdral_Occupancies_Percentages_reversed.txt", "w") as f:
+        f.write("Type\tS_4d\tBr_4d\tS_4a\tBr_4a\tTotal\t#So to say two different 'perspectives' (from 4a and 4d sites)\n")
 
-    d3 = total_density_S_on_4a
-    f.write("S_4a\t{}\t{:.3f}\t{}\t{:.3f}\t{:.3f}\n".format(".",100*d3[1]/n,".",100*d3[3]/n,100*d3[4]/n))
+        dummy_types=[1,2,3,4,5]
+        for Type,i,j,k,l,m in zip(dummy_types,total_density_S_on_4d,total_density_Br_on_4d,total_density_S_on_4a,total_density_Br_on_4a,t):
+            f.write("Type{:d}\t".format(Type))
 
-    d4 = total_density_Br_on_4a
-    f.write("Br_4a\t{}\t{:.3f}\t{}\t{:.3f}\t{:.3f}\n".format(".",100*d4[1]/n,".",100*d4[3]/n,100*d4[4]/n))
+            if i >= 0.0:
+                f.write("{:.3f}\t".format(100*i/n))
+            else:
+                f.write(".\t")
 
-    f.write("Total\t{:.3f}\t{:.3f}\t{:.3f}\t{:.3f}\t{:.3f}\n".format(100*t[0]/n, 100*t[1]/2/n, 100*t[2]/n, 100*t[3]/n, 100*t[4]/2/n))
+            if j >= 0.0:
+                f.write("{:.3f}\t".format(100*j/n))
+            else:
+                f.write(".\t")
 
+            if k >= 0.0:
+                f.write("{:.3f}\t".format(100*k/n))
+            else:
+                f.write(".\t")
 
-with open("Tetrahdral_Occupancies_Percentages_reversed.txt", "w") as f:
-    f.write("Type\tS_4d\tBr_4d\tS_4a\tBr_4a\tTotal\t#So to say two different 'perspectives' (from 4a and 4d sites)\n")
+            if l >= 0.0:
+                f.write("{:.3f}\t".format(100*l/n))
+            else:
+                f.write(".\t")
 
-    dummy_types=[1,2,3,4,5]
-    for Type,i,j,k,l,m in zip(dummy_types,total_density_S_on_4d,total_density_Br_on_4d,total_density_S_on_4a,total_density_Br_on_4a,t):
-        f.write("Type{:d}\t".format(Type))
+            if   Type == 1:
+                f.write("{:.3f}\n".format(100*m/n))
+            elif Type == 2:
+                f.write("{:.3f}\n".format(100*m/2/n))
+            elif Type == 3:
+                f.write("{:.3f}\n".format(100*m/n))
+            elif Type == 4:
+                f.write("{:.3f}\n".format(100*m/n))
+            elif Type == 5:
+                f.write("{:.3f}\n".format(100*m/2/n))
 
-        if i >= 0.0:
-            f.write("{:.3f}\t".format(100*i/n))
-        else:
-            f.write(".\t")
+    ###### Normalization is done per site.
+    # E.g. A value of 2.3 for type2 Li around S_4d means that on average 2.4 Li are distributed on the
+    # type2 tetrahedral sites around the S_4d sites.
 
-        if j >= 0.0:
-            f.write("{:.3f}\t".format(100*j/n))
-        else:
-            f.write(".\t")
 
-        if k >= 0.0:
-            f.write("{:.3f}\t".format(100*k/n))
-        else:
-            f.write(".\t")
 
-        if l >= 0.0:
-            f.write("{:.3f}\t".format(100*l/n))
-        else:
-            f.write(".\t")
+    # Case 1: Standard Site-Disorder, i.e. for every S_Br there is a Br_S
+    if not (SiteDisorder == -1):
+        try:
+            Norm1 = cell_volume/N_bins/len(S_on_4d_type_10)
+            Norm4 = Norm1
+        except ZeroDivisionError:
+            Norm1 = 0.0
+            Norm4 = 0.0
 
-        if   Type == 1:
-            f.write("{:.3f}\n".format(100*m/n))
-        elif Type == 2:
-            f.write("{:.3f}\n".format(100*m/2/n))
-        elif Type == 3:
-            f.write("{:.3f}\n".format(100*m/n))
-        elif Type == 4:
-            f.write("{:.3f}\n".format(100*m/n))
-        elif Type == 5:
-            f.write("{:.3f}\n".format(100*m/2/n))
+        try:
+            Norm2 = cell_volume/N_bins/len(S_on_4a_type_12)
+            Norm3 = Norm2
+        except ZeroDivisionError:
+            Norm2 = 0.0
+            Norm3 = 0.0
 
-###### Normalization is done per site.
-# E.g. A value of 2.3 for type2 Li around S_4d means that on average 2.4 Li are distributed on the
-# type2 tetrahedral sites around the S_4d sites.
+    # Case 2: No Standard Site-Disorder (i.e. defective systems) 
+    if (SiteDisorder == -1):
+        try:
+            Norm1 = cell_volume/N_bins/len(S_on_4d_type_10)
+        except ZeroDivisionError:
+            Norm1 = 0.0
 
+        try:
+            Norm2 = cell_volume/N_bins/len(Br_on_4d_type_11)
+        except ZeroDivisionError:
+            Norm2 = 0.0
 
+        try:
+            Norm3 = cell_volume/N_bins/len(S_on_4a_type_12)
+        except ZeroDivisionError:
+            Norm3 = 0.0
 
-# Case 1: Standard Site-Disorder, i.e. for every S_Br there is a Br_S
-if not (SiteDisorder == -1):
-    try:
-        Norm1 = data.cell.volume/N_bins/len(S_on_4d_type_10)
-        Norm4 = Norm1
-    except ZeroDivisionError:
-        Norm1 = 0.0
-        Norm4 = 0.0
+        try:
+            Norm4 = cell_volume/N_bins/len(Br_on_4a_type_13)
+        except ZeroDivisionError:
+            Norm4 = 0.0
 
-    try:
-        Norm2 = data.cell.volume/N_bins/len(S_on_4a_type_12)
-        Norm3 = Norm2
-    except ZeroDivisionError:
-        Norm2 = 0.0
-        Norm3 = 0.0
 
-# Case 2: No Standard Site-Disorder (i.e. defective systems) 
-if (SiteDisorder == -1):
-    try:
-        Norm1 = data.cell.volume/N_bins/len(S_on_4d_type_10)
-    except ZeroDivisionError:
-        Norm1 = 0.0
+    with open("Tetrahdral_Occupancies_Absolute_per_site.txt", "w") as f:
+        f.write("Site\tType1\tType2\tType3\tType4\tType5\t#So to say two different 'perspectives' (from 4a and 4d sites)\n")
 
-    try:
-        Norm2 = data.cell.volume/N_bins/len(Br_on_4d_type_11)
-    except ZeroDivisionError:
-        Norm2 = 0.0
+        d1 = total_density_S_on_4d
+        f.write("S_4d\t{:.3f}\t{:.3f}\t{}\t{}\t{:.3f}\n".format(d1[0]*Norm1,d1[1]*Norm1,".",".",d1[4]*Norm1))
 
-    try:
-        Norm3 = data.cell.volume/N_bins/len(S_on_4a_type_12)
-    except ZeroDivisionError:
-        Norm3 = 0.0
+        d2 = total_density_Br_on_4d
+        f.write("Br_4d\t{:.3f}\t{:.3f}\t{}\t{}\t{:.3f}\n".format(d2[0]*Norm2,d2[1]*Norm2,".",".",d2[4]*Norm2))
 
-    try:
-        Norm4 = data.cell.volume/N_bins/len(Br_on_4a_type_13)
-    except ZeroDivisionError:
-        Norm4 = 0.0
+        d3 = total_density_S_on_4a
+        f.write("S_4a\t{}\t{:.3f}\t{}\t{:.3f}\t{:.3f}\n".format(".",d3[1]*Norm3,".",d3[3]*Norm3,d3[4]*Norm3))
 
+        d4 = total_density_Br_on_4a
+        f.write("Br_4a\t{}\t{:.3f}\t{}\t{:.3f}\t{:.3f}\n".format(".",d4[1]*Norm4,".",d4[3]*Norm4,d4[4]*Norm4))
 
-with open("Tetrahdral_Occupancies_Absolute_per_site.txt", "w") as f:
-    f.write("Site\tType1\tType2\tType3\tType4\tType5\t#So to say two different 'perspectives' (from 4a and 4d sites)\n")
 
-    d1 = total_density_S_on_4d
-    f.write("S_4d\t{:.3f}\t{:.3f}\t{}\t{}\t{:.3f}\n".format(d1[0]*Norm1,d1[1]*Norm1,".",".",d1[4]*Norm1))
 
-    d2 = total_density_Br_on_4d
-    f.write("Br_4d\t{:.3f}\t{:.3f}\t{}\t{}\t{:.3f}\n".format(d2[0]*Norm2,d2[1]*Norm2,".",".",d2[4]*Norm2))
 
-    d3 = total_density_S_on_4a
-    f.write("S_4a\t{}\t{:.3f}\t{}\t{:.3f}\t{:.3f}\n".format(".",d3[1]*Norm3,".",d3[3]*Norm3,d3[4]*Norm3))
+    with open("Tetrahdral_Occupancies_Absolute_per_site_reversed.txt", "w") as f:
+        f.write("Type\tS_4d\tBr_4d\tS_4a\tBr_4a\t#So to say two different 'perspectives' (from 4a and 4d sites)\n")
+
+        dummy_types=[1,2,3,4,5]
+        for Type,i,j,k,l in zip(dummy_types,total_density_S_on_4d,total_density_Br_on_4d,total_density_S_on_4a,total_density_Br_on_4a):
+            f.write("Type{:d}\t".format(Type))
+
+            if i >= 0.0:
+                f.write("{:.3f}\t".format(i*Norm1))
+            else:
+                f.write(".\t")
 
-    d4 = total_density_Br_on_4a
-    f.write("Br_4a\t{}\t{:.3f}\t{}\t{:.3f}\t{:.3f}\n".format(".",d4[1]*Norm4,".",d4[3]*Norm4,d4[4]*Norm4))
+            if j >= 0.0:
+                f.write("{:.3f}\t".format(j*Norm2))
+            else:
+                f.write(".\t")
 
+            if k >= 0.0:
+                f.write("{:.3f}\t".format(k*Norm3))
+            else:
+                f.write(".\t")
 
+            if l >= 0.0:
+                f.write("{:.3f}\t".format(l*Norm4))
+            else:
+                f.write(".\t")
 
+            f.write("\n")
 
-with open("Tetrahdral_Occupancies_Absolute_per_site_reversed.txt", "w") as f:
-    f.write("Type\tS_4d\tBr_4d\tS_4a\tBr_4a\t#So to say two different 'perspectives' (from 4a and 4d sites)\n")
-
-    dummy_types=[1,2,3,4,5]
-    for Type,i,j,k,l in zip(dummy_types,total_density_S_on_4d,total_density_Br_on_4d,total_density_S_on_4a,total_density_Br_on_4a):
-        f.write("Type{:d}\t".format(Type))
-
-        if i >= 0.0:
-            f.write("{:.3f}\t".format(i*Norm1))
-        else:
-            f.write(".\t")
-
-        if j >= 0.0:
-            f.write("{:.3f}\t".format(j*Norm2))
-        else:
-            f.write(".\t")
-
-        if k >= 0.0:
-            f.write("{:.3f}\t".format(k*Norm3))
-        else:
-            f.write(".\t")
-
-        if l >= 0.0:
-            f.write("{:.3f}\t".format(l*Norm4))
-        else:
-            f.write(".\t")
 
-        f.write("\n")
+if Report or Profile:
+    report = run_report.FinishReport(report, "Tetrahdral_Occupancies.report.json")
+    run_report.PrintReport(report)
+    print("Writing Tetrahdral_Occupancies.report.json")
@@ -0,0 +1,205 @@
+import os
+import sys
+import numpy as np
+import xdatcar
+
+# Classification of the anions (S/Br) onto the 4d and 4a sites of the argyrodite without OVITO.
+#
+# All 32 reference sites below are matched to all atoms of a structure in one minimum-image
+# distance computation (32 x N_atoms distances). The closest atom of every site decides
+# the site type:
+#   S  on 4d site  (ptype 10 in the OVITO version)
+#   Br on 4d site  (ptype 11)
+#   S  on 4a site  (ptype 12)
+#   Br on 4a site  (ptype 13)
+# The reference sites are fractional coordinates, so the classification works for every cell size.
+
+# Sites that are usually occupied S in case of 0% disorder
+Dict_4d_or_4c = {
+"A1": [0.25, 0.0, 0.125],
+"A2": [0.75, 0.0, 0.125],
+"A3": [0.25, 0.5, 0.125],
+"A4": [0.75, 0.5, 0.125],
+
+"B1": [0.0, 0.25, 0.375],
+"B2": [0.5, 0.25, 0.375],
+"B3": [0.0, 0.75, 0.375],
+"B4": [0.5, 0.75, 0.375],
+
+"C1": [0.25, 0.0, 0.625],
+"C2": [0.75, 0.0, 0.625],
+"C3": [0.25, 0.5, 0.625],
+"C4": [0.75, 0.5, 0.625],
+
+"D1": [0.0, 0.25, 0.875],
+"D2": [0.5, 0.25, 0.875],
+"D3": [0.0, 0.75, 0.875],
+"D4": [0.5, 0.75, 0.875]
+}
+
+# Sites that are usually occupied Br in case of 0% disorder
+Dict_4a = {
+"0.00-1": [0.25, 0.25, 0.0],
+"0.00-2": [0.25, 0.75, 0.0],
+"0.00-3": [0.75, 0.25, 0.0],
+"0.00-4": [0.75, 0.75, 0.0],
+
+"0.25-1": [0.0, 0.0, 0.25],
+"0.25-2": [0.5, 0.0, 0.25],
+"0.25-3": [0.0, 0.5, 0.25],
+"0.25-4": [0.5, 0.5, 0.25],
+
+"0.50-1": [0.25, 0.25, 0.5],
+"0.50-2": [0.25, 0.75, 0.5],
+"0.50-3": [0.75, 0.25, 0.5],
+"0.50-4": [0.75, 0.75, 0.5],
+
+"0.75-1": [0.0, 0.0, 0.75],
+"0.75-2": [0.5, 0.0, 0.75],
+"0.75-3": [0.0, 0.5, 0.75],
+"0.75-4": [0.5, 0.5, 0.75]
+}
+
+REFERENCE_SITES = np.array(list(Dict_4d_or_4c.values()) + list(Dict_4a.values()), dtype=np.float64)
+SITE_NAMES      = list(Dict_4d_or_4c.keys()) + list(Dict_4a.keys())
+SITE_IS_4D      = np.arange(len(REFERENCE_SITES)) < len(Dict_4d_or_4c)
+
+# OVITO names the S of the PS4 units 'S2' in some structure files
+SULFUR_NAMES  = ("S", "S2")
+BROMINE_NAMES = ("Br",)
+
+# Sites whose closest atom is further away than this (in Angstrom) are reported
+DEFAULT_TOLERANCE = 1.0
+
+
+def SpeciesPerAtom(header):
+    """
+    Takes a header as returned by xdatcar.ReadHeader
+    returns array with the species name of every atom
+    """
+    if header["species"] is None:
+        raise ValueError("Header has no species line (VASP 4 format), cannot identify S and Br")
+    return np.repeat(np.array(header["species"]), header["counts"])
+
+
+def ClassifyAnionSites(cell, positions, species, tolerance=DEFAULT_TOLERANCE):
+    """
+    Takes the cell (rows a, b, c), fractional positions of one structure (POSCAR or any frame
+    of an XDATCAR) and the species name of every atom
+    returns dictionary with
+      S_on_4d, Br_on_4d, S_on_4a, Br_on_4a -> (n, 3) Cartesian positions of the anions on these sites
+      atoms                                -> dictionary with the atom indices of the same four classes
+      SiteDisorder                         -> percentage of S on 4a sites (-1 if not stoichiometric)
+      report                               -> tolerance report (see below)
+    """
+    cell = np.asarray(cell, dtype=np.float64)
+    positions = np.asarray(positions, dtype=np.float64)
+    species = np.asarray(species)
+
+    # Minimum image in fractional coordinates (exact for the orthorhombic/tetragonal argyrodite cells)
+    delta = positions[None, :, :] - REFERENCE_SITES[:, None, :]
+    delta -= np.round(delta)
+    distances = np.linalg.norm(delta @ cell, axis=2)
+
+    closest  = np.argmin(distances, axis=1)
+    distance = distances[np.arange(len(closest)), closest]
+    is_S  = np.isin(species[closest], SULFUR_NAMES)
+    is_Br = np.isin(species[closest], BROMINE_NAMES)
+
+    # Atom indices in ascending order (same order as the loop over all particles in the OVITO version)
+    atoms = {"S_on_4d":  np.unique(closest[SITE_IS_4D & is_S]),
+             "Br_on_4d": np.unique(closest[SITE_IS_4D & is_Br]),
+             "S_on_4a":  np.unique(closest[~SITE_IS_4D & is_S]),
+             "Br_on_4a": np.unique(closest[~SITE_IS_4D & is_Br])}
+
+    result = {key: positions[index] @ cell for key, index in atoms.items()}
+    result["atoms"] = atoms
+
+    N_S_4d, N_Br_4d = len(atoms["S_on_4d"]), len(atoms["Br_on_4d"])
+    N_S_4a, N_Br_4a = len(atoms["S_on_4a"]), len(atoms["Br_on_4a"])
+    if N_S_4d == N_Br_4a and N_S_4a == N_Br_4d and N_S_4a + N_S_4d > 0:
+        result["SiteDisorder"] = 100 * N_S_4a / (N_S_4a + N_S_4d)
+    else:
+        result["SiteDisorder"] = -1
+
+    # Tolerance report: distance of every site to its closest atom and everything suspicious
+    matched, matches = np.unique(closest, return_counts=True)
+    result["report"] = {"site": SITE_NAMES,
+                        "atom": closest,
+                        "species": species[closest],
+                        "distance": distance,
+                        "max_distance": float(distance.max()),
+                        "tolerance": tolerance,
+                        "outside_tolerance": [SITE_NAMES[i] for i in np.flatnonzero(distance > tolerance)],
+                        "not_anion": [SITE_NAMES[i] for i in np.flatnonzero(~(is_S | is_Br))],
+                        "shared_atoms": matched[matches > 1]}
+    return result
+
+
+def ClassifyPOSCAR(filename, tolerance=DEFAULT_TOLERANCE):
+    """
+    Takes a POSCAR/CONTCAR
+    returns the classification as from ClassifyAnionSites
+    """
+    header, positions = xdatcar.ReadPOSCAR(filename)
+    return ClassifyAnionSites(header["cell"], positions, SpeciesPerAtom(header), tolerance)
+
+
+def ClassifyDirectory(path, structure_file="POSCAR", tolerance=DEFAULT_TOLERANCE):
+    """
+    Takes a directory and walks through it (recursively) looking for structure files named structure_file
+    returns dictionary {path of the structure file: classification} sorted by path.
+    Files that cannot be read are reported and skipped.
+    """
+    results = {}
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        if structure_file not in files:
+            continue
+        filename = os.path.join(root, structure_file)
+        try:
+            results[filename] = ClassifyPOSCAR(filename, tolerance)
+        except (ValueError, IndexError, OSError) as error:
+            print("Warning: skipping {} ({})".format(filename, error))
+    return results
+
+
+def PrintPositionalAnalysis(result):
+    """
+    Takes the classification of ClassifyAnionSites
+    prints the positional analysis (same text as the OVITO version) and the problems of the tolerance report
+    """
+    report = result["report"]
+    for site in report["not_anion"]:
+        i = report["site"].index(site)
+        print("Error! A {} was probably closer to the {} site than the S or Br ion! check for id {}".format(
+              report["species"][i], "4d" if SITE_IS_4D[i] else "4a", report["atom"][i]))
+    for site in report["outside_tolerance"]:
+        i = report["site"].index(site)
+        print("Warning: closest atom to site {} is {:.3f} A away (tolerance {} A)".format(
+              site, report["distance"][i], report["tolerance"]))
+    for atom in report["shared_atoms"]:
+        print("Warning: atom {} is the closest atom of more than one site".format(atom))
+
+    print("\nPositional analysis:")
+    if result["SiteDisorder"] != -1:
+        print("  Number comparison: S_Br=Br_S and S_S=Br_Br, therefore stoichiometric compound assumed")
+        print("  Site-disorder: {:.2f}% \n".format(result["SiteDisorder"]))
+    else:
+        print("  Br and S anion sublattices not equally occupied: Non-stoichiometric compound or with defects.\n")
+
+
+# Screening of many structures:  python anion_sites.py data/  (directories and/or single POSCARs)
+if __name__ == "__main__":
+    print("{:60s} {:>5s} {:>5s} {:>5s} {:>5s} {:>9s} {:>8s}".format("structure", "S_4d", "Br_4d", "S_4a", "Br_4a", "disorder", "max_d/A"))
+    for arg in sys.argv[1:] or ["."]:
+        if os.path.isdir(arg):
+            results = ClassifyDirectory(arg)
+        else:
+            results = {arg: ClassifyPOSCAR(arg)}
+        for filename, result in results.items():
+            N = [len(result["atoms"][key]) for key in ("S_on_4d", "Br_on_4d", "S_on_4a", "Br_on_4a")]
+            problems = len(result["report"]["outside_tolerance"]) + len(result["report"]["not_anion"]) + len(result["report"]["shared_atoms"])
+            print("{:60s} {:5d} {:5d} {:5d} {:5d} {:9.2f} {:8.3f}{}".format(
+                  filename, *N, result["SiteDisorder"], result["report"]["max_distance"],
+                  "  <- check" if problems else ""))
@@ -0,0 +1,222 @@
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import xdatcar
+
+# Batch processing of all ensembles below data/ (or any other root directory).
+#
+# Every directory that contains a POSCAR is an ensemble (data/ordered/Ensemble1, data/6.25%disorder/01, ...).
+# For every ensemble the two stages are run in the ensemble directory, exactly as if the scripts had been
+# copied there and started by hand:
+#   density   -> Li_density_ovito3.py  (XDATCAR or compressed XDATCAR.gz/.xz/.bz2/.zst -> Li_density.npy/.npz)
+#   occupancy -> Li_tetra_type.py      (POSCAR + Li_density.npy/.npz -> Tetrahdral_Occupancies_*.txt)
+# The ensembles are distributed over a process pool, the stages of one ensemble run one after the other.
+#
+# Caching:
+#   Every stage gets a key, the SHA-256 of the content of its input files, of the script (which holds the
+#   parameters) and of the modules it uses, plus its command line arguments. After a successful run the key is
+#   stored in <ensemble>/.batch_cache.json; as long as the key and the outputs are unchanged the stage is skipped.
+#   Since the occupancy stage hashes the density it reads, changing a parameter of Li_tetra_type.py only reruns
+#   the occupancy stage, while changing Li_density_ovito3.py reruns both (and the occupancy only if the density changed).
+#   Content hashes of large files (XDATCAR) are remembered per size and modification time so they are computed once.
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_FILE = ".batch_cache.json"
+
+# name, script, arguments, input files (in the ensemble directory), modules (next to the script), output files
+STAGES = [
+    {"name": "density",
+     "script": "Li_density_ovito3.py",
+     "arguments": ["--format", "npy"],
+     "inputs": ["XDATCAR"],
+     "modules": ["xdatcar.py", "density_grid.py", "anion_sites.py", "run_report.py"],
+     "outputs": ["Li_density.npy", "Li_density.npz"]},
+    {"name": "occupancy",
+     "script": "Li_tetra_type.py",
+     "arguments": [],
+     "inputs": ["POSCAR", "Li_density.npy", "Li_density.npz"],
+     "modules": ["anion_sites.py", "xdatcar.py", "density_grid.py", "tetrahedra.py", "run_report.py"],
+     "outputs": ["Tetrahdral_Occupancies_Percentages.txt",
+                 "Tetrahdral_Occupancies_Percentages_reversed.txt",
+                 "Tetrahdral_Occupancies_Absolute_per_site.txt",
+                 "Tetrahdral_Occupancies_Absolute_per_site_reversed.txt"]},
+]
+STAGE_NAMES = [stage["name"] for stage in STAGES]
+
+
+def FindEnsembles(root):
+    """
+    Takes a root directory (e.g. data/)
+    returns sorted list of all directories below root that contain a POSCAR
+    """
+    ensembles = []
+    for directory, dirs, files in os.walk(root):
+        dirs.sort()
+        if "POSCAR" in files:
+            ensembles.append(directory)
+    return ensembles
+
+
+def LoadCache(directory):
+    """
+    returns the cache of an ensemble directory as dictionary {"stages": {...}, "files": {...}}
+    """
+    try:
+        with open(os.path.join(directory, CACHE_FILE)) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        cache = {}
+    cache.setdefault("stages", {})
+    cache.setdefault("files", {})
+    return cache
+
+
+def SaveCache(directory, cache):
+    """
+    Writes the cache of an ensemble directory (replaced atomically, so an interrupted run never leaves a broken cache)
+    """
+    filename = os.path.join(directory, CACHE_FILE)
+    with open(filename + ".tmp", "w") as f:
+        json.dump(cache, f, indent=1, sort_keys=True)
+    os.replace(filename + ".tmp", filename)
+
+
+def FileHash(filename, memo=None, chunk_size=16*1024*1024):
+    """
+    Takes a file and optionally a memo dictionary {filename: [size, mtime_ns, hash]}
+    returns the SHA-256 of the file content (taken from the memo if size and modification time are unchanged)
+    """
+    stat = os.stat(filename)
+    key = os.path.abspath(filename)
+    if memo is not None and key in memo and memo[key][:2] == [stat.st_size, stat.st_mtime_ns]:
+        return memo[key][2]
+
+    sha = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha.update(chunk)
+    digest = sha.hexdigest()
+    if memo is not None:
+        memo[key] = [stat.st_size, stat.st_mtime_ns, digest]
+    return digest
+
+
+def StageKey(stage, directory, memo=None):
+    """
+    Takes a stage of STAGES and an ensemble directory
+    returns the content hash of everything the stage depends on, or None if an input file is missing
+    """
+    sha = hashlib.sha256()
+    sha.update(json.dumps([stage["name"], stage["script"], stage["arguments"]]).encode())
+    for name in [stage["script"]] + stage["modules"]:
+        sha.update(FileHash(os.path.join(SCRIPT_DIR, name), memo).encode())
+    for name in stage["inputs"]:
+        filenames = [os.path.join(directory, name)]
+        if name == "XDATCAR":
+            filenames = [xdatcar.FindTrajectory(filenames[0])]     # or XDATCAR.gz, .xz, ... (read on the fly)
+            if xdatcar.IsStore(filenames[0]):
+                # the store is read as coordinates (.traj.npy) plus cells and species (.traj.npz)
+                filenames.append(xdatcar.StoreHeaderFile(filenames[0]))
+        for filename in filenames:
+            if not os.path.exists(filename):
+                return None
+            sha.update(os.path.basename(filename).encode())
+            sha.update(FileHash(filename, memo).encode())
+    return sha.hexdigest()
+
+
+def RunStage(stage, directory, workers=1):
+    """
+    Runs the script of a stage inside the ensemble directory, output goes to <stage>.log
+    returns True if the script finished successfully
+    """
+    arguments = list(stage["arguments"])
+    if stage["name"] == "density":
+        arguments += ["--workers", str(workers)]
+    with open(os.path.join(directory, stage["name"] + ".log"), "w") as log:
+        process = subprocess.run([sys.executable, os.path.join(SCRIPT_DIR, stage["script"])] + arguments,
+                                 cwd=directory, stdout=log, stderr=subprocess.STDOUT)
+    return process.returncode == 0
+
+
+def _RunEnsemble(job):
+    """
+    Takes (directory, stage names, force, workers per density run)
+    returns (directory, {stage name: status}) with status "done", "cached", "failed" or "missing input"
+    """
+    directory, stages, force, workers = job
+    cache = LoadCache(directory)
+    status = {}
+
+    for stage in STAGES:
+        if stage["name"] not in stages:
+            continue
+        key = StageKey(stage, directory, cache["files"])
+        if key is None:
+            status[stage["name"]] = "missing input"
+            continue
+
+        outputs_exist = all(os.path.exists(os.path.join(directory, name)) for name in stage["outputs"])
+        if not force and outputs_exist and cache["stages"].get(stage["name"]) == key:
+            status[stage["name"]] = "cached"
+            continue
+
+        print("{}: running {}".format(directory, stage["name"]), flush=True)
+        if RunStage(stage, directory, workers):
+            status[stage["name"]] = "done"
+            cache["stages"][stage["name"]] = key
+        else:
+            status[stage["name"]] = "failed"
+            cache["stages"].pop(stage["name"], None)
+            SaveCache(directory, cache)
+            break       # later stages would use outdated or missing results
+        SaveCache(directory, cache)
+
+    SaveCache(directory, cache)
+    return directory, status
+
+
+def RunBatch(root, stages=STAGE_NAMES, jobs=1, force=False, workers=1):
+    """
+    Takes the root directory, the stages to run, the number of ensembles processed in parallel (jobs),
+    force (ignore the cache) and the number of worker processes of every density run
+    returns dictionary {ensemble directory: {stage name: status}}
+    """
+    ensembles = FindEnsembles(root)
+    print("Found {} ensembles below {}".format(len(ensembles), root))
+    job_list = [(directory, list(stages), force, workers) for directory in ensembles]
+
+    if jobs > 1:
+        with multiprocessing.Pool(jobs) as pool:
+            results = dict(pool.imap_unordered(_RunEnsemble, job_list))
+    else:
+        results = dict(_RunEnsemble(job) for job in job_list)
+    return {directory: results[directory] for directory in ensembles}
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Run density generation and tetrahedral occupancy for all ensembles")
+    parser.add_argument("root", nargs="?", default=os.path.join(SCRIPT_DIR, "data"), help="directory to search for ensembles (default: data/)")
+    parser.add_argument("--jobs", type=int, default=1, help="number of ensembles processed in parallel (default: 1)")
+    parser.add_argument("--workers", type=int, default=1, help="worker processes of every density run (default: 1)")
+    parser.add_argument("--stages", default=",".join(STAGE_NAMES), help="comma separated stages to run (default: {})".format(",".join(STAGE_NAMES)))
+    parser.add_argument("--force", action="store_true", help="rerun all stages even if their inputs did not change")
+    args = parser.parse_args()
+
+    stages = args.stages.split(",")
+    for name in stages:
+        if name not in STAGE_NAMES:
+            parser.error("unknown stage '{}' (choose from {})".format(name, ", ".join(STAGE_NAMES)))
+
+    results = RunBatch(args.root, stages, args.jobs, args.force, args.workers)
+
+    print("\n{:50s}".format("ensemble") + "".join("{:>15s}".format(name) for name in stages))
+    for directory, status in results.items():
+        print("{:50s}".format(directory) + "".join("{:>15s}".format(status.get(name, "-")) for name in stages))
+    if any("failed" in status.values() for status in results.values()):
+        sys.exit(1)
@@ -0,0 +1,279 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import numpy as np
+import anion_sites
+import density_grid
+import tetrahedra
+import xdatcar
+
+# Benchmark suite with synthetic argyrodite trajectories.
+#
+# A synthetic XDATCAR is generated from one of the bundled POSCARs (Li6PS5Br supercell): every frame holds the
+# POSCAR positions plus Gaussian displacements (larger for Li), with a fixed random seed, so every run of the suite
+# works on exactly the same data. The density grid is binned from this trajectory.
+#
+# Timed stages (best of --repeat runs):
+#   parse      -> building the frame index and streaming all frames (frames/s), converting to the binary store and
+#                 streaming all frames from it (see xdatcar.py)
+#   binning    -> BinTrajectory, dense and sparse, and dense from the binary store (frames/s)
+#   io         -> writing/reading the binary, sparse and extended xyz density files (s, MB/s)
+#   occupancy  -> site classification, rasterizing the tetrahedron masks and summing the density around all sites
+#                 with the grid, the points and the weights method (ms per site)
+# Results are written as JSON together with the parameters, the git revision and the versions of Python/NumPy.
+# With --compare old.json the timings are compared to an earlier run (e.g. of another version).
+
+DEFAULT_STRUCTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "ordered", "Ensemble1", "POSCAR")
+
+
+def WriteSyntheticXDATCAR(structure, filename, N_frames, amplitude=0.3, li_amplitude=0.8, seed=0):
+    """
+    Takes a POSCAR and writes an XDATCAR with N_frames frames: POSCAR positions plus Gaussian
+    displacements with the given standard deviation in Angstrom (li_amplitude for Li)
+    returns the header of the POSCAR
+    """
+    header, positions = xdatcar.ReadPOSCAR(structure)
+    rng = np.random.default_rng(seed)
+    species = np.repeat(header["species"], header["counts"])
+    sigma = np.where(species == "Li", li_amplitude, amplitude)[:, None]
+    inv_cell = np.linalg.inv(header["cell"])
+
+    with open(filename, "w") as f:
+        f.write("{}\n{:19.14f}\n".format(header["comment"], 1.0))
+        for vector in header["cell"]:
+            f.write(" {:11.6f} {:11.6f} {:11.6f}\n".format(*vector))
+        f.write("".join("{:>5s}".format(name) for name in header["species"]) + "\n")
+        f.write("".join("{:5d}".format(n) for n in header["counts"]) + "\n")
+        for frame in range(N_frames):
+            frac = positions + (rng.normal(size=positions.shape) * sigma) @ inv_cell
+            frac -= np.floor(frac)
+            f.write("Direct configuration={:6d}\n".format(frame + 1))
+            f.write("".join("  {:.8f}  {:.8f}  {:.8f}\n".format(*r) for r in frac))
+    return header
+
+
+def _Best(function, repeat):
+    """
+    Calls function repeat times
+    returns (shortest run time in s, result of the last call)
+    """
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        tic = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - tic)
+    return best, result
+
+
+def _FileSize(*filenames):
+    """
+    returns summed size of files in MB
+    """
+    return sum(os.path.getsize(f) for f in filenames) / 1024**2
+
+
+def BenchmarkParse(filename, N_frames, repeat):
+    """
+    returns timings of building the frame index and streaming the frames (indexed and sequential)
+    """
+    def build():
+        if os.path.exists(filename + xdatcar.INDEX_SUFFIX):
+            os.remove(filename + xdatcar.INDEX_SUFFIX)
+        return xdatcar.LoadIndex(filename)
+
+    def stream(use_index):
+        return sum(1 for _ in xdatcar.IterateFrames(filename, use_index=use_index))
+
+    t_index, _ = _Best(build, repeat)
+    t_indexed, _ = _Best(lambda: stream(True), repeat)
+    t_sequential, _ = _Best(lambda: stream(False), repeat)
+    t_convert, store = _Best(lambda: xdatcar.ConvertToStore(filename), repeat)
+    t_store, _ = _Best(lambda: sum(1 for _ in xdatcar.IterateFrames(store)), repeat)
+    size = _FileSize(filename)
+    return {"xdatcar_MB": size,
+            "index_s": t_index, "index_MB_per_s": size / t_index,
+            "stream_indexed_s": t_indexed, "stream_indexed_frames_per_s": N_frames / t_indexed,
+            "stream_sequential_s": t_sequential, "stream_sequential_frames_per_s": N_frames / t_sequential,
+            "store_MB": _FileSize(store, xdatcar.StoreHeaderFile(store)), "store_convert_s": t_convert,
+            "stream_store_s": t_store, "stream_store_frames_per_s": N_frames / t_store}
+
+
+def BenchmarkBinning(filename, N_frames, atoms, shape, workers, repeat):
+    """
+    returns timings of dense and sparse binning of all frames, and the dense hit counts, cell and volumes
+    """
+    t_dense, binned = _Best(lambda: density_grid.BinTrajectory(filename, 0, N_frames, atoms, shape, workers=workers), repeat)
+    t_sparse, _ = _Best(lambda: density_grid.BinTrajectory(filename, 0, N_frames, atoms, shape, workers=workers, sparse=True), repeat)
+    store = xdatcar.StoreFile(filename)
+    t_store, _ = _Best(lambda: density_grid.BinTrajectory(store, 0, N_frames, atoms, shape, workers=workers), repeat)
+    return {"dense_s": t_dense, "dense_frames_per_s": N_frames / t_dense,
+            "sparse_s": t_sparse, "sparse_frames_per_s": N_frames / t_sparse,
+            "dense_store_s": t_store, "dense_store_frames_per_s": N_frames / t_store}, binned
+
+
+def BenchmarkIO(directory, grid, cell, N_frames, repeat, xyz=True):
+    """
+    returns timings of writing and reading the density in the binary, sparse and (optionally) extended xyz format
+    """
+    base = os.path.join(directory, "Li_density")
+    sparse = density_grid.DenseToSparse(grid, cell, N_frames)
+    results = {}
+
+    t_write, _ = _Best(lambda: density_grid.WriteDensityGrid(base, grid, cell, N_frames, "Li"), repeat)
+    t_read, _ = _Best(lambda: float(np.sum(density_grid.ReadDensityGrid(base)[0])), repeat)
+    size = _FileSize(base + ".npy", base + ".npz")
+    results.update(npy_MB=size, npy_write_s=t_write, npy_read_s=t_read, npy_read_MB_per_s=size / t_read)
+
+    t_write, _ = _Best(lambda: density_grid.WriteSparseGrid(base, sparse), repeat)
+    t_read, _ = _Best(lambda: density_grid.ReadSparseGrid(base + ".sparse.npz"), repeat)
+    results.update(sparse_MB=_FileSize(base + ".sparse.npz"), sparse_write_s=t_write, sparse_read_s=t_read)
+
+    if xyz:
+        t_write, _ = _Best(lambda: density_grid.WriteExtendedXYZ(base + ".xyz", grid, cell), 1)
+        t_read, _ = _Best(lambda: density_grid.ReadExtendedXYZ(base + ".xyz"), 1)
+        size = _FileSize(base + ".xyz")
+        results.update(xyz_MB=size, xyz_write_s=t_write, xyz_read_s=t_read, xyz_read_MB_per_s=size / t_read)
+    return results
+
+
+def BenchmarkOccupancy(structure, grid, cell, repeat):
+    """
+    returns timings of the site classification, the rasterization of the tetrahedron masks and of summing
+    the density around all sites with the grid, the points and the weights method (ms per site and tetrahedron type).
+    The weights are timed with empty weight tables (weights_tables_s, incl. computing them) and with cached tables.
+    """
+    shape = grid.shape
+    t_classify, sites = _Best(lambda: anion_sites.ClassifyPOSCAR(structure), repeat)
+
+    def rasterize():
+        return {name: tetrahedra.RasterizeTetrahedra(frac @ cell, np.zeros(3), cell, shape)
+                for name, frac in tetrahedra.TETRA_FRACTIONAL.items()}
+    t_rasterize, _ = _Best(rasterize, repeat)
+    library = tetrahedra.TetrahedronLibrary(cell, shape)
+
+    jobs = [(sites[key], name) for key, types in (("S_on_4d", tetrahedra.TYPES_4D), ("Br_on_4d", tetrahedra.TYPES_4D),
+                                                  ("S_on_4a", tetrahedra.TYPES_4A), ("Br_on_4a", tetrahedra.TYPES_4A))
+            for name in types if name is not None and len(sites[key])]
+    N_evaluations = sum(len(coordinates) for coordinates, _ in jobs)
+
+    def grid_method():
+        return sum(tetrahedra.SumMaskAroundSites(grid, tetrahedra.SiteVoxels(coordinates, cell, shape), library["masks"][name])
+                   for coordinates, name in jobs)
+
+    sparse = density_grid.DenseToSparse(grid, cell)
+    cell_list = tetrahedra.BuildCellList(density_grid.GridPointsAt(cell, shape, sparse["index"]), cell)
+
+    def points_method():
+        return sum(tetrahedra.SumDensityAroundSitesPoints(cell_list, sparse["values"], library["relative"][name], coordinates)
+                   for coordinates, name in jobs)
+
+    def weights_method():
+        return sum(tetrahedra.SumWeightsAroundSites(grid, coordinates, cell, name, density_grid.VOXEL_ORIGIN["ngp"])
+                   for coordinates, name in jobs)
+
+    def weights_tables():
+        tetrahedra._WEIGHT_CACHE.clear()
+        return weights_method()
+
+    t_grid, _ = _Best(grid_method, repeat)
+    t_points, _ = _Best(points_method, repeat)
+    t_tables, _ = _Best(weights_tables, repeat)
+    t_weights, _ = _Best(weights_method, repeat)
+    return {"classify_s": t_classify, "rasterize_s": t_rasterize,
+            "site_evaluations": N_evaluations,
+            "grid_s": t_grid, "grid_ms_per_site": 1000 * t_grid / N_evaluations,
+            "points_s": t_points, "points_ms_per_site": 1000 * t_points / N_evaluations,
+            "weights_tables_s": t_tables,
+            "weights_s": t_weights, "weights_ms_per_site": 1000 * t_weights / N_evaluations}
+
+
+def GitRevision():
+    """
+    returns the git revision of the scripts (or "unknown")
+    """
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def RunBenchmarks(structure, N_frames, shape, workers=1, repeat=3, xyz=True, directory=None):
+    """
+    Runs all benchmarks on a synthetic trajectory of N_frames frames and a grid of shape (bins_z, bins_y, bins_x)
+    returns dictionary with environment, parameters and results
+    """
+    with tempfile.TemporaryDirectory(dir=directory) as workdir:
+        filename = os.path.join(workdir, "XDATCAR")
+        print("Writing synthetic XDATCAR with {} frames".format(N_frames))
+        header = WriteSyntheticXDATCAR(structure, filename, N_frames)
+        atoms = xdatcar.SpeciesSlice(header, "Li")
+
+        results = {}
+        print("Benchmarking parsing...")
+        results["parse"] = BenchmarkParse(filename, N_frames, repeat)
+        print("Benchmarking binning...")
+        results["binning"], (counts, cell, volumes) = BenchmarkBinning(filename, N_frames, atoms, shape, workers, repeat)
+        grid = density_grid.CountsToDensity(counts, volumes, shape)
+        print("Benchmarking density file I/O...")
+        results["io"] = BenchmarkIO(workdir, grid, cell, N_frames, repeat, xyz)
+        print("Benchmarking tetrahedral occupancy...")
+        results["occupancy"] = BenchmarkOccupancy(structure, grid, cell, repeat)
+
+    return {"revision": GitRevision(),
+            "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.platform(),
+            "cpus": os.cpu_count(),
+            "parameters": {"structure": os.path.relpath(structure), "frames": N_frames,
+                           "shape": list(shape), "workers": workers, "repeat": repeat},
+            "results": results}
+
+
+def CompareBenchmarks(new, old):
+    """
+    Prints the ratio new/old of all timings (in s) of two benchmark results. Values > 1 mean slower.
+    """
+    print("\nComparison with revision {} ({}):".format(old["revision"], old["date"]))
+    if old["parameters"] != new["parameters"]:
+        print("  Warning: parameters differ: {} vs {}".format(old["parameters"], new["parameters"]))
+    for stage, values in new["results"].items():
+        for key, value in values.items():
+            if key.endswith("_s") and not key.endswith("_per_s") and key in old["results"].get(stage, {}):
+                ratio = value / old["results"][stage][key]
+                print("  {:10s} {:28s} {:9.4f} s   x{:5.2f}{}".format(stage, key, value, ratio, "  <- slower" if ratio > 1.2 else ""))
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Benchmarks with synthetic argyrodite trajectories")
+    parser.add_argument("--structure", default=DEFAULT_STRUCTURE, help="POSCAR the synthetic trajectory is built from")
+    parser.add_argument("--frames", type=int, default=2000, help="number of synthetic frames (default: 2000)")
+    parser.add_argument("--grid", type=int, nargs=3, default=(96, 96, 128), metavar=("BINS_X", "BINS_Y", "BINS_Z"),
+                        help="density grid (default: 96 96 128)")
+    parser.add_argument("--workers", type=int, default=1, help="worker processes for binning (default: 1)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per benchmark, the fastest counts (default: 3)")
+    parser.add_argument("--no-xyz", dest="xyz", action="store_false", help="skip the (slow) extended xyz I/O")
+    parser.add_argument("--workdir", default=None, help="directory for the temporary files (default: system temp)")
+    parser.add_argument("--output", default="benchmark.json", help="result file (default: benchmark.json)")
+    parser.add_argument("--compare", default=None, help="earlier result file to compare with")
+    args = parser.parse_args()
+
+    bins_x, bins_y, bins_z = args.grid
+    report = RunBenchmarks(args.structure, args.frames, (bins_z, bins_y, bins_x), args.workers, args.repeat, args.xyz, args.workdir)
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=1)
+    print("\nResults ({}) written to {}".format(report["revision"], args.output))
+    for stage, values in report["results"].items():
+        for key, value in values.items():
+            print("  {:10s} {:32s} {:12.4f}".format(stage, key, value))
+
+    if args.compare:
+        with open(args.compare) as f:
+            CompareBenchmarks(report, json.load(f))
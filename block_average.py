@@ -0,0 +1,133 @@
+import numpy as np
+
+# Streaming statistics for time series of correlated MD observables (e.g. occupancies per frame).
+#
+# Frames are added one by one to an accumulator (dictionary) with O(max_blocks) memory:
+#   - running mean and sum of squared deviations (Welford) -> naive standard error (assumes uncorrelated frames)
+#   - block means: the frames are averaged in blocks of block_size frames. When max_blocks blocks are filled,
+#     neighbouring blocks are merged and block_size is doubled, so the memory stays bounded for any trajectory length.
+# At the end the block means are analysed with the blocking method of Flyvbjerg and Petersen
+# (J. Chem. Phys. 91, 461 (1989)): blocks are repeatedly averaged pairwise and the standard error of the mean is
+# computed at every level. For correlated data it grows until the blocks are longer than the correlation time
+# and then stays on a plateau, which is the autocorrelation-corrected error.
+
+MIN_BLOCKS = 8      # levels with fewer blocks are not used for the error estimate
+
+
+def BlockAccumulator(N_columns, max_blocks=1024):
+    """
+    Takes the number of observables per frame and the maximum number of stored blocks (even number)
+    returns an empty accumulator (dictionary)
+    """
+    return {"n": 0,
+            "mean": np.zeros(N_columns),
+            "m2": np.zeros(N_columns),
+            "block_size": 1,
+            "max_blocks": max_blocks,
+            "blocks": [],
+            "current": np.zeros(N_columns),
+            "current_n": 0}
+
+
+def _HalveBlocks(blocks):
+    """
+    returns the list of block means averaged pairwise (an odd last block is dropped)
+    """
+    return [(blocks[i] + blocks[i + 1]) / 2 for i in range(0, len(blocks) - 1, 2)]
+
+
+def AddFrame(accumulator, values):
+    """
+    Adds the observables of one frame to the accumulator (in place)
+    """
+    values = np.asarray(values, dtype=np.float64)
+    accumulator["n"] += 1
+    delta = values - accumulator["mean"]
+    accumulator["mean"] += delta / accumulator["n"]
+    accumulator["m2"] += delta * (values - accumulator["mean"])
+
+    accumulator["current"] += values
+    accumulator["current_n"] += 1
+    if accumulator["current_n"] == accumulator["block_size"]:
+        accumulator["blocks"].append(accumulator["current"] / accumulator["block_size"])
+        accumulator["current"] = np.zeros_like(accumulator["current"])
+        accumulator["current_n"] = 0
+        if len(accumulator["blocks"]) == accumulator["max_blocks"]:
+            accumulator["blocks"] = _HalveBlocks(accumulator["blocks"])
+            accumulator["block_size"] *= 2
+
+
+def MergeAccumulators(accumulators):
+    """
+    Takes accumulators of consecutive parts of a trajectory (e.g. the shards of a parallel run), in order
+    returns one accumulator for the whole trajectory. Welford sums are combined exactly (Chan et al.),
+    blocks are brought to the largest block size; unfinished blocks at the shard boundaries are not used for blocking.
+    """
+    accumulators = [a for a in accumulators if a["n"] > 0]
+    if not accumulators:
+        raise ValueError("No frames to merge")
+    merged = dict(accumulators[0], mean=accumulators[0]["mean"].copy(), m2=accumulators[0]["m2"].copy())
+    for other in accumulators[1:]:
+        n = merged["n"] + other["n"]
+        delta = other["mean"] - merged["mean"]
+        merged["m2"] = merged["m2"] + other["m2"] + delta**2 * merged["n"] * other["n"] / n
+        merged["mean"] = merged["mean"] + delta * other["n"] / n
+        merged["n"] = n
+
+    block_size = max(a["block_size"] for a in accumulators)
+    blocks = []
+    for a in accumulators:
+        shard_blocks, size = list(a["blocks"]), a["block_size"]
+        while size < block_size:
+            shard_blocks, size = _HalveBlocks(shard_blocks), size * 2
+        blocks += shard_blocks
+    while len(blocks) >= merged["max_blocks"]:
+        blocks, block_size = _HalveBlocks(blocks), block_size * 2
+
+    merged.update(blocks=blocks, block_size=block_size, current=np.zeros_like(merged["mean"]), current_n=0)
+    return merged
+
+
+def BlockingAnalysis(accumulator):
+    """
+    Flyvbjerg-Petersen blocking of the stored block means
+    returns dictionary with
+      mean            -> mean over all frames
+      naive_error     -> standard error assuming uncorrelated frames
+      error           -> autocorrelation-corrected standard error (plateau of the blocking curve)
+      inefficiency    -> statistical inefficiency (error/naive_error)^2, i.e. ~ number of frames per independent sample
+      converged       -> False for columns where no plateau was reached (error is then a lower bound)
+      levels          -> (block length in frames, standard error per column, its uncertainty) for every level
+    """
+    n = accumulator["n"]
+    mean = accumulator["mean"].copy()
+    naive = np.sqrt(accumulator["m2"] / (n - 1) / n) if n > 1 else np.full_like(mean, np.nan)
+
+    levels = []
+    blocks, size = np.array(accumulator["blocks"]), accumulator["block_size"]
+    if size == 1 and len(blocks):
+        levels.append((1, naive, naive / np.sqrt(2 * (n - 1))))
+        blocks, size = np.array(_HalveBlocks(list(blocks))), 2
+    while len(blocks) >= MIN_BLOCKS:
+        B = len(blocks)
+        error = np.sqrt(np.var(blocks, axis=0, ddof=1) / B)
+        levels.append((size, error, error / np.sqrt(2 * (B - 1))))
+        blocks, size = np.array(_HalveBlocks(list(blocks))), size * 2
+
+    # Plateau: first level from which on the error does not grow by more than its own uncertainty anymore
+    error = naive.copy()
+    converged = np.zeros(len(mean), dtype=bool)
+    for column in range(len(mean)):
+        for k in range(len(levels) - 1):
+            if levels[k + 1][1][column] - levels[k][1][column] <= levels[k][2][column]:
+                error[column] = levels[k][1][column]
+                converged[column] = True
+                break
+        else:
+            if levels:
+                error[column] = max(level[1][column] for level in levels)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        inefficiency = np.where(naive > 0, (error / naive)**2, 1.0)
+    return {"mean": mean, "naive_error": naive, "error": error,
+            "inefficiency": inefficiency, "converged": converged, "levels": levels}
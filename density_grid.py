@@ -0,0 +1,707 @@
+import itertools
+import math
+import multiprocessing
+import os
+import re
+import sys
+import numpy as np
+import xdatcar
+
+# Histogram binning engine for time-averaged densities on a regular grid.
+#
+# Grid convention (same as Li_density.xyz):
+#   shape = (bins_z, bins_y, bins_x), x runs fastest in the flattened array
+#   voxel (x, y, z) covers the fractional range [x/bins_x, (x+1)/bins_x) etc.
+#
+# Counts are accumulated as integer hits (uint32) with one bincount per batch of frames.
+# Conversion to a density (hits per frame and per Angstrom^3) is done only once at the end.
+# Optionally the positions are spread over the neighbouring grid points with a kernel instead (see below),
+# the hits are then float64 weights.
+
+
+def FlatVoxelIndices(fractional, shape):
+    """
+    Takes an (N, 3) array of fractional coordinates and the grid shape (bins_z, bins_y, bins_x)
+    returns the flat voxel index of every position (positions are wrapped into the cell)
+    """
+    bins_z, bins_y, bins_x = shape
+    fractional = fractional - np.floor(fractional)
+    # minimum() guards against x = 1.0 after wrapping tiny negative numbers
+    ix = np.minimum((fractional[:, 0] * bins_x).astype(np.int64), bins_x - 1)
+    iy = np.minimum((fractional[:, 1] * bins_y).astype(np.int64), bins_y - 1)
+    iz = np.minimum((fractional[:, 2] * bins_z).astype(np.int64), bins_z - 1)
+    return (iz * bins_y + iy) * bins_x + ix
+
+
+def _AtomGroups(atoms):
+    """
+    returns atoms as list of atom selections (atoms itself if it already is a list of slices/index arrays)
+    """
+    if isinstance(atoms, list) and atoms and not np.isscalar(atoms[0]):
+        return atoms
+    return [atoms]
+
+
+def GroupVoxelIndices(fractional, atoms, shape):
+    """
+    Takes the fractional coordinates of all atoms, one atom selection (slice or index array) or a list
+    of them and the grid shape.
+    With several selections the grids are stacked: the indices of selection g are shifted by g*N_voxels,
+    so all species (or site classes) of a frame are binned with the same bincount.
+    returns flat voxel indices
+    """
+    groups = _AtomGroups(atoms)
+    if len(groups) == 1:
+        return FlatVoxelIndices(fractional[groups[0]], shape)
+    N_voxels = int(np.prod(shape))
+    return np.concatenate([FlatVoxelIndices(fractional[group], shape) + g * N_voxels for g, group in enumerate(groups)])
+
+
+### Kernel deposition ################################################################################################
+#
+# By default every position is counted in the one voxel it falls into ("ngp"). On coarse grids the voxels straddle
+# the tetrahedron faces, so a position is attributed to a tetrahedron or not depending on where its voxel happens to
+# lie. Instead, every position can be spread over the grid points around it with a periodic kernel:
+#   cic      -> cloud in cell: trilinear weights on the 8 grid points around the position
+#   gaussian -> Gaussian with standard deviation sigma (Angstrom, Cartesian distance in the cell of the frame)
+#               on all grid points within cutoff*sigma, normalized to 1 per position
+# The weights are put on the grid points x*a/bins_x + y*b/bins_y + z*c/bins_z, where Li_tetra_type.py evaluates
+# the density (ngp counts the voxel [x, x+1)/bins_x at grid point x, i.e. half a voxel off). Every position still
+# contributes exactly one atom. grid_convergence.py compares the occupancies of the kernels over the grid size.
+
+KERNELS = ("ngp", "cic", "gaussian")
+# Start of the volume a grid point stands for, in grid steps: hits counted per voxel belong to [x, x+1) / bins_x,
+# kernel weights to [x-1/2, x+1/2) / bins_x (used by the partial volume weights in tetrahedra.py)
+VOXEL_ORIGIN = {"ngp": 0.0, "cic": -0.5, "gaussian": -0.5}
+MAX_DEPOSITS = 4*1024*1024     # weights collected per bincount with a kernel (bounds the memory of a batch)
+
+
+def DepositionKernel(name="ngp", sigma=0.15, cutoff=3.0):
+    """
+    Takes the kernel name (KERNELS) and for the Gaussian its standard deviation and cutoff (in sigma)
+    returns the kernel as dictionary, None for ngp (plain counting)
+    """
+    if name not in KERNELS:
+        raise ValueError("Unknown deposition kernel '{}', use one of {}".format(name, ", ".join(KERNELS)))
+    if name == "ngp":
+        return None
+    if name == "gaussian" and sigma <= 0:
+        raise ValueError("The Gaussian kernel needs sigma > 0, got {}".format(sigma))
+    return {"name": name, "sigma": float(sigma), "cutoff": float(cutoff)}
+
+
+def KernelWeights(fractional, shape, kernel, cell):
+    """
+    Takes an (N, 3) array of fractional coordinates, the grid shape, a kernel (DepositionKernel) and the cell
+    returns (N, K) flat grid point indices and (N, K) weights (every row sums to 1)
+    """
+    bins = np.array(shape[::-1])                                   # (bins_x, bins_y, bins_z)
+    fractional = fractional - np.floor(fractional)
+    u = fractional * bins
+    if kernel["name"] == "cic":
+        base = np.floor(u).astype(np.int64)
+        offsets = np.array(list(itertools.product((0, 1), repeat=3)))
+        t = (u - base)[:, None, :]
+        weights = np.prod(np.where(offsets[None, :, :] == 1, t, 1 - t), axis=-1)
+    else:
+        base = np.rint(u).astype(np.int64)
+        # stencil half width per axis in grid points: cutoff divided by the grid spacing normal to the lattice planes
+        spacing = 1 / np.linalg.norm(np.linalg.inv(cell), axis=0) / bins
+        cutoff = kernel["cutoff"] * kernel["sigma"]
+        radius = np.ceil(cutoff / spacing).astype(int)
+        offsets = np.stack(np.meshgrid(*[np.arange(-r, r + 1) for r in radius], indexing="ij"), axis=-1).reshape(-1, 3)
+        distance2 = np.sum((((base[:, None, :] + offsets[None, :, :]) / bins - fractional[:, None, :]) @ cell)**2, axis=-1)
+        weights = np.where(distance2 <= cutoff**2, np.exp(-0.5 * distance2 / kernel["sigma"]**2), 0.0)
+        # a narrow kernel on a coarse grid may not reach any grid point -> nearest grid point (centre of the stencil)
+        weights[weights.sum(axis=1) == 0, len(offsets) // 2] = 1.0
+        weights /= weights.sum(axis=1, keepdims=True)
+
+    ix, iy, iz = np.moveaxis((base[:, None, :] + offsets[None, :, :]) % bins, -1, 0)
+    return (iz * bins[1] + iy) * bins[0] + ix, weights
+
+
+def GroupKernelWeights(fractional, atoms, shape, kernel, cell):
+    """
+    Same as GroupVoxelIndices, but with kernel deposition (KernelWeights)
+    returns flat grid point indices, weights (1D arrays of the same length)
+    """
+    N_voxels = int(np.prod(shape))
+    indices, weights = [], []
+    for g, group in enumerate(_AtomGroups(atoms)):
+        flat, w = KernelWeights(fractional[group], shape, kernel, cell)
+        indices.append(flat.ravel() + g * N_voxels)
+        weights.append(w.ravel())
+    return np.concatenate(indices), np.concatenate(weights)
+
+
+def SplitGroups(counts, shape, N_groups, sparse=False):
+    """
+    Takes hit counts of stacked grids (see GroupVoxelIndices), dense or sparse (index, hits)
+    returns list with the hit counts of every group (in the same format)
+    """
+    N_voxels = int(np.prod(shape))
+    if not sparse:
+        return [counts[g * N_voxels:(g + 1) * N_voxels] for g in range(N_groups)]
+    index, hits = counts
+    edges = np.searchsorted(index, np.arange(N_groups + 1) * N_voxels)
+    return [(index[i:j] - g * N_voxels, hits[i:j]) for g, (i, j) in enumerate(zip(edges[:-1], edges[1:]))]
+
+
+def _Deposit(positions, atoms, shape, kernel, cell):
+    """
+    returns (flat voxel indices, None) without kernel, (flat grid point indices, weights) with kernel
+    """
+    if kernel is None:
+        return GroupVoxelIndices(positions, atoms, shape), None
+    return GroupKernelWeights(positions, atoms, shape, kernel, cell)
+
+
+def _Batches(frames, atoms, shape, batch_size, kernel, volumes):
+    """
+    Deposits the frames and collects them in batches of batch_size frames (at most MAX_DEPOSITS weights with a kernel).
+    The cell volume of every frame is appended to volumes.
+    yields (flat indices, weights or None, last cell) of every batch
+    """
+    batch = []
+    N_deposits = 0
+    for cell, positions in frames:
+        batch.append(_Deposit(positions, atoms, shape, kernel, cell))
+        volumes.append(abs(np.linalg.det(cell)))
+        N_deposits += len(batch[-1][0])
+        if len(batch) == batch_size or (kernel is not None and N_deposits >= MAX_DEPOSITS):
+            yield np.concatenate([i for i, _ in batch]), None if kernel is None else np.concatenate([w for _, w in batch]), cell
+            batch = []
+            N_deposits = 0
+    if batch:
+        yield np.concatenate([i for i, _ in batch]), None if kernel is None else np.concatenate([w for _, w in batch]), cell
+
+
+def BinFrames(frames, atoms, shape, batch_size=1024, counts=None, kernel=None):
+    """
+    Takes an iterable of (cell, fractional positions) frames, the atoms to be binned
+    (slice or index array, or a list of them for stacked grids, see GroupVoxelIndices),
+    the grid shape, optionally an existing count array to add to and a deposition kernel (DepositionKernel).
+    The flat voxel indices of batch_size frames are collected and added with a single bincount.
+    returns hit counts (flat uint32 array, float64 with a kernel), last cell, cell volume of every binned frame
+    """
+    N_voxels = int(np.prod(shape)) * len(_AtomGroups(atoms))
+    if counts is None:
+        counts = np.zeros(N_voxels, dtype=np.uint32 if kernel is None else np.float64)
+
+    volumes = []
+    cell = None
+    for indices, weights, cell in _Batches(frames, atoms, shape, batch_size, kernel, volumes):
+        hits = np.bincount(indices, weights=weights, minlength=N_voxels)
+        np.add(counts, hits, out=counts, casting="unsafe")
+
+    return counts, cell, np.array(volumes)
+
+
+def MergeSparseCounts(index, hits, new_index, new_hits):
+    """
+    Adds sparse hit counts (sorted unique flat indices + counts) to another set of sparse hit counts
+    returns merged (index, hits), hits stay uint32 if both are integer hits (float64 for kernel weights)
+    """
+    floating = np.issubdtype(np.asarray(hits).dtype, np.floating) or np.issubdtype(np.asarray(new_hits).dtype, np.floating)
+    dtype = np.float64 if floating else np.uint32
+    index, inverse = np.unique(np.concatenate((index, new_index)), return_inverse=True)
+    hits = np.bincount(inverse, weights=np.concatenate((hits, new_hits)), minlength=len(index))
+    return index, hits.astype(dtype)
+
+
+def BinFramesSparse(frames, atoms, shape, batch_size=1024, kernel=None):
+    """
+    Same as BinFrames, but the hits are kept as sparse arrays (sorted flat voxel indices + counts).
+    Memory scales with the number of visited voxels instead of bins_x*bins_y*bins_z.
+    returns (index, hits), last cell, cell volume of every binned frame
+    """
+    index = np.zeros(0, dtype=np.int64)
+    hits = np.zeros(0, dtype=np.uint32 if kernel is None else np.float64)
+    volumes = []
+    cell = None
+
+    for indices, weights, cell in _Batches(frames, atoms, shape, batch_size, kernel, volumes):
+        if weights is None:
+            index, hits = MergeSparseCounts(index, hits, *np.unique(indices, return_counts=True))
+        else:
+            unique, inverse = np.unique(indices, return_inverse=True)
+            index, hits = MergeSparseCounts(index, hits, unique, np.bincount(inverse, weights=weights, minlength=len(unique)))
+
+    return (index, hits), cell, np.array(volumes)
+
+
+def _WithProgress(frames, first_frame, every=1000):
+    """
+    Passes the frames through and prints a progress line every 1000 frames
+    """
+    for frame, data in enumerate(frames, start=first_frame):
+        if frame % every == 0:
+            print("Computing frame {}".format(frame), flush=True)
+        yield data
+
+
+def _BinShard(job):
+    """
+    Worker function for BinTrajectory: bins the frames [start, stop) of one shard
+    returns the same as BinFrames
+    """
+    filename, start, stop, atoms, shape, batch_size, sparse, kernel = job
+    frames = _WithProgress(xdatcar.IterateFrames(filename, start=start, stop=stop), start)
+    if sparse:
+        return BinFramesSparse(frames, atoms, shape, batch_size, kernel)
+    return BinFrames(frames, atoms, shape, batch_size, kernel=kernel)
+
+
+def ShardRanges(start, stop, N_shards):
+    """
+    Splits the frame range [start, stop) into N_shards contiguous, nearly equal ranges
+    returns list of (start, stop) tuples (empty shards are dropped)
+    """
+    edges = np.linspace(start, stop, N_shards + 1).round().astype(int)
+    return [(int(i), int(j)) for i, j in zip(edges[:-1], edges[1:]) if j > i]
+
+
+def BinTrajectory(filename, start, stop, atoms, shape, workers=1, batch_size=1024, sparse=False, kernel=None):
+    """
+    Bins the frames [start, stop) of an XDATCAR. With workers > 1 the frame range is split into
+    shards that are binned in separate processes; the integer counts of the shards are summed up,
+    so the result is bit-identical to a serial run (with a kernel up to the rounding of the float sums).
+    returns hit counts (flat uint32 array, or (index, hits) if sparse), last cell, cell volume of every binned frame
+    """
+    jobs = [(filename, i, j, atoms, shape, batch_size, sparse, kernel) for i, j in ShardRanges(start, stop, max(workers, 1))]
+    if workers <= 1 or len(jobs) <= 1:
+        # also an empty frame range (e.g. start >= number of frames): empty counts as in a serial run
+        return _BinShard((filename, start, stop, atoms, shape, batch_size, sparse, kernel))
+
+    with multiprocessing.Pool(min(workers, len(jobs))) as pool:
+        results = pool.map(_BinShard, jobs)
+
+    counts = results[0][0]
+    for shard_counts, _, _ in results[1:]:
+        if sparse:
+            counts = MergeSparseCounts(*counts, *shard_counts)
+        else:
+            counts += shard_counts
+    cell = results[-1][1]
+    volumes = np.concatenate([shard_volumes for _, _, shard_volumes in results])
+    return counts, cell, volumes
+
+
+def CountsToDensity(counts, volumes, shape):
+    """
+    Takes the hit counts of BinFrames and the cell volumes of the binned frames
+    returns the time-averaged density (atoms per Angstrom^3) with shape (bins_z, bins_y, bins_x)
+    """
+    N_frames = len(volumes)
+    if N_frames == 0:
+        raise ValueError("No frames have been binned")
+    # fsum is exactly rounded -> same bin volume no matter how the frames were sharded
+    bin_volume = math.fsum(volumes) / N_frames / counts.size
+    return np.reshape(counts / (N_frames * bin_volume), shape)
+
+
+### Density file I/O ##################################################################################################
+#
+# Binary format: a .npy/.npz pair with the same base name, e.g. Li_density.npy + Li_density.npz
+#   <base>.npy -> raw density array, float64, shape (bins_z, bins_y, bins_x); can be memory-mapped
+#   <base>.npz -> header: lattice (rows a, b, c), shape, number of frames, species, deposition kernel
+# Coordinates are implied by the grid and are not stored: grid point (x, y, z) sits at
+# x*a/bins_x + y*b/bins_y + z*c/bins_z, exactly as in Li_density.xyz.
+
+def GridBaseName(filename):
+    """
+    Takes Li_density, Li_density.npy or Li_density.npz
+    returns the base name of the binary pair (Li_density)
+    """
+    base, ext = os.path.splitext(filename)
+    return base if ext in (".npy", ".npz") else filename
+
+
+def WriteDensityGrid(filename, grid, cell, N_frames, species, deposition="ngp"):
+    """
+    Writes the density grid in the binary format (see above)
+    """
+    base = GridBaseName(filename)
+    np.save(base + ".npy", np.ascontiguousarray(grid, dtype=np.float64))
+    np.savez(base + ".npz",
+             cell=np.asarray(cell, dtype=np.float64),
+             shape=np.array(grid.shape, dtype=np.int64),
+             frames=np.array(N_frames, dtype=np.int64),
+             species=np.array(species),
+             deposition=np.array(deposition))
+
+
+def ReadDensityGrid(filename, mmap=True):
+    """
+    Reads a density grid in the binary format. The grid is memory-mapped (read-only) by default.
+    returns grid with shape (bins_z, bins_y, bins_x), header dictionary (cell, shape, frames, species, deposition)
+    """
+    base = GridBaseName(filename)
+    with np.load(base + ".npz") as stored:
+        header = {"cell": stored["cell"],
+                  "shape": tuple(int(n) for n in stored["shape"]),
+                  "frames": int(stored["frames"]),
+                  "species": str(stored["species"]),
+                  # grids written before kernel deposition existed have plain hits
+                  "deposition": str(stored["deposition"]) if "deposition" in stored.files else "ngp"}
+    grid = np.load(base + ".npy", mmap_mode="r" if mmap else None)
+    if grid.shape != header["shape"]:
+        raise ValueError("Grid shape {} in {}.npy does not match its header {}".format(grid.shape, base, header["shape"]))
+    return grid, header
+
+
+def GridPoints(cell, shape):
+    """
+    Takes the cell (rows a, b, c) and the grid shape (bins_z, bins_y, bins_x)
+    returns the Cartesian coordinates of all grid points, (N_voxels, 3), in the flat grid order
+    """
+    bins_z, bins_y, bins_x = shape
+    a, b, c = np.asarray(cell, dtype=np.float64)
+    z, y, x = np.meshgrid(np.arange(bins_z), np.arange(bins_y), np.arange(bins_x), indexing="ij")
+    x, y, z = x.reshape(-1, 1), y.reshape(-1, 1), z.reshape(-1, 1)
+    return x*a/bins_x + y*b/bins_y + z*c/bins_z
+
+
+def GridPointsAt(cell, shape, flat_indices):
+    """
+    Same as GridPoints, but only for the given flat voxel indices
+    returns Cartesian coordinates, (N, 3)
+    """
+    bins_z, bins_y, bins_x = shape
+    a, b, c = np.asarray(cell, dtype=np.float64)
+    z, y, x = np.unravel_index(np.asarray(flat_indices), shape)
+    x, y, z = x.reshape(-1, 1), y.reshape(-1, 1), z.reshape(-1, 1)
+    return x*a/bins_x + y*b/bins_y + z*c/bins_z
+
+
+def WriteExtendedXYZ(filename, grid, cell):
+    """
+    Writes the density grid as extended xyz file (one line per grid point, readable by OVITO)
+    """
+    bins_z, bins_y, bins_x = grid.shape
+    lattice_string = " ".join("{:.8f}".format(i) for i in np.asarray(cell).ravel())
+
+    with open(filename, 'w') as f:
+        f.write("{}\n".format(bins_x*bins_y*bins_z))
+        f.write('Lattice="{}" Properties=pos:R:3:Density:R:1 Time=0.0\n'.format(lattice_string))
+        # Write slab by slab to keep the temporary coordinate arrays small
+        slab_points = GridPoints(cell, (1, bins_y, bins_x))
+        for z in range(bins_z):
+            table = np.empty((bins_y*bins_x, 4))
+            table[:, :3] = slab_points + z*np.asarray(cell)[2]/bins_z
+            table[:, 3] = grid[z].ravel()
+            np.savetxt(f, table, fmt="%.8f", delimiter="\t")
+
+
+def _ParseXYZComment(line):
+    """
+    Parses the comment line of an extended xyz file
+    returns cell (rows a, b, c), number of columns, column index of the density
+    """
+    lattice = re.search(r'Lattice="([^"]*)"', line)
+    if lattice is None:
+        raise ValueError("No Lattice=\"...\" in the xyz header. Only extended xyz files can be read.")
+    cell = np.array(lattice.group(1).split(), dtype=np.float64).reshape(3, 3)
+
+    properties = re.search(r'Properties=(\S+)', line)
+    spec = properties.group(1).split(":") if properties else ["pos", "R", "3", "Density", "R", "1"]
+    N_columns = 0
+    density_column = None
+    for name, _, width in zip(spec[0::3], spec[1::3], spec[2::3]):
+        if name.lower() == "density":
+            density_column = N_columns
+        N_columns += int(width)
+    if density_column is None:
+        raise ValueError("No Density column in the xyz properties {}".format(spec))
+    return cell, N_columns, density_column
+
+
+def _InferGridShape(first_points, N_points, cell):
+    """
+    Takes the first grid points of the file (x running fastest) and the total number of points.
+    Point 1 sits at a/bins_x and point bins_x at b/bins_y.
+    returns grid shape (bins_z, bins_y, bins_x)
+    """
+    frac = first_points @ np.linalg.inv(cell)
+    bins_x = int(round(1.0 / frac[1, 0])) if N_points > 1 and frac[1, 0] > 1e-9 else 1
+    if bins_x >= len(frac):
+        raise ValueError("Not enough points to infer the grid shape")
+    bins_y = int(round(1.0 / frac[bins_x, 1])) if frac[bins_x, 1] > 1e-9 else 1
+    if N_points % (bins_x * bins_y):
+        raise ValueError("The points in the xyz file do not form a regular grid")
+    return (N_points // (bins_x * bins_y), bins_y, bins_x)
+
+
+def ReadExtendedXYZ(filename, chunk_size=64*1024*1024):
+    """
+    Reads a density grid from an (archived) extended xyz file as written by Li_density_ovito3.py.
+    The grid shape is inferred from the regular coordinate pattern, the Density column is
+    read in large chunks with vectorized parsing.
+    returns grid with shape (bins_z, bins_y, bins_x), cell (rows a, b, c)
+    """
+    chunk_size = max(chunk_size, 1024*1024)
+    with open(filename, "rb") as f:
+        N_points = int(f.readline())
+        cell, N_columns, density_column = _ParseXYZComment(f.readline().decode())
+
+        density = np.empty(N_points)
+        filled = 0
+        shape = None
+        rest = b""
+        while filled < N_points:
+            chunk = f.read(chunk_size)
+            if not chunk and not rest:
+                break
+            # Only parse complete lines, keep the remainder for the next chunk
+            chunk = rest + chunk
+            cut = chunk.rfind(b"\n") + 1 if len(chunk) > len(rest) else len(chunk)
+            chunk, rest = chunk[:cut], chunk[cut:]
+            if not chunk:
+                continue
+
+            try:
+                table = np.array(chunk.split(), dtype=np.float64)
+            except ValueError:
+                table = None
+            if table is None or table.size % N_columns:
+                raise ValueError("Malformed line in {}".format(filename))
+            table = table.reshape(-1, N_columns)[:N_points - filled]
+
+            if shape is None:
+                shape = _InferGridShape(table[:, :3], N_points, cell)
+                bins_z, bins_y, bins_x = shape
+            # Cheap consistency check: first and last point of the chunk must be on the grid
+            for row in (0, len(table) - 1):
+                i = filled + row
+                z, y, x = i // (bins_x*bins_y), (i // bins_x) % bins_y, i % bins_x
+                expected = x*cell[0]/bins_x + y*cell[1]/bins_y + z*cell[2]/bins_z
+                if not np.allclose(table[row, :3], expected, atol=1e-6):
+                    raise ValueError("Point {} in {} is not on the inferred grid {}".format(i, filename, shape))
+
+            density[filled:filled + len(table)] = table[:, density_column]
+            filled += len(table)
+
+    if filled != N_points:
+        raise ValueError("{} contains only {} of {} points".format(filename, filled, N_points))
+    return density.reshape(shape), cell
+
+
+def ConvertExtendedXYZ(filename, out_filename=None, species="Li"):
+    """
+    Converts an archived Li_density.xyz into the binary format (Li_density.npy/.npz).
+    The number of frames is not known from the xyz file and is stored as 0.
+    """
+    grid, cell = ReadExtendedXYZ(filename)
+    if out_filename is None:
+        out_filename = os.path.splitext(filename)[0]
+    WriteDensityGrid(out_filename, grid, cell, 0, species)
+
+
+### Sparse density grids ##############################################################################################
+#
+# Most voxels of the argyrodite cells are empty (Li only sits near the tetrahedral cages). A sparse grid stores
+# only the occupied voxels as dictionary:
+#   index   -> sorted flat voxel indices (int64), same flat order as the dense grid (x fastest)
+#   values  -> density of these voxels (float64)
+#   shape   -> (bins_z, bins_y, bins_x)
+#   cell    -> lattice (rows a, b, c)
+#   frames, species, deposition -> as in the binary dense format
+# File format: <base>.sparse.npz
+
+def SparseFromCounts(counts, volumes, shape, cell, species, deposition="ngp"):
+    """
+    Takes the (index, hits) of BinFramesSparse (or BinTrajectory with sparse=True) and the cell volumes
+    of the binned frames. The normalization is the same as in CountsToDensity.
+    returns sparse grid
+    """
+    index, hits = counts
+    N_frames = len(volumes)
+    if N_frames == 0:
+        raise ValueError("No frames have been binned")
+    bin_volume = math.fsum(volumes) / N_frames / int(np.prod(shape))
+    return {"index": np.asarray(index, dtype=np.int64),
+            "values": hits / (N_frames * bin_volume),
+            "shape": tuple(int(n) for n in shape),
+            "cell": np.asarray(cell, dtype=np.float64),
+            "frames": N_frames,
+            "species": species,
+            "deposition": deposition}
+
+
+def DenseToSparse(grid, cell, N_frames=0, species="Li", deposition="ngp"):
+    """
+    returns sparse grid with all nonzero voxels of a dense grid
+    """
+    flat = np.asarray(grid).ravel()
+    index = np.flatnonzero(flat)
+    return {"index": index, "values": flat[index], "shape": tuple(grid.shape),
+            "cell": np.asarray(cell, dtype=np.float64), "frames": N_frames, "species": species,
+            "deposition": deposition}
+
+
+def SparseValuesAt(sparse, flat_indices):
+    """
+    Looks up the density at arbitrary flat voxel indices (binary search in the sorted index)
+    returns values (0 for empty voxels)
+    """
+    flat_indices = np.asarray(flat_indices)
+    index = sparse["index"]
+    if len(index) == 0:
+        return np.zeros(flat_indices.shape)
+    position = np.minimum(np.searchsorted(index, flat_indices), len(index) - 1)
+    return np.where(index[position] == flat_indices, sparse["values"][position], 0.0)
+
+
+def WriteSparseGrid(filename, sparse):
+    """
+    Writes a sparse grid to <base>.sparse.npz
+    """
+    base = filename[:-len(".sparse.npz")] if filename.endswith(".sparse.npz") else GridBaseName(filename)
+    np.savez(base + ".sparse.npz",
+             index=sparse["index"], values=sparse["values"],
+             shape=np.array(sparse["shape"], dtype=np.int64),
+             cell=sparse["cell"],
+             frames=np.array(sparse["frames"], dtype=np.int64),
+             species=np.array(sparse["species"]),
+             deposition=np.array(sparse.get("deposition", "ngp")))
+
+
+def ReadSparseGrid(filename):
+    """
+    returns sparse grid read from <base>.sparse.npz
+    """
+    with np.load(filename) as stored:
+        return {"index": stored["index"], "values": stored["values"],
+                "shape": tuple(int(n) for n in stored["shape"]),
+                "cell": stored["cell"],
+                "frames": int(stored["frames"]),
+                "species": str(stored["species"]),
+                "deposition": str(stored["deposition"]) if "deposition" in stored.files else "ngp"}
+
+
+### Checkpoints for growing trajectories ##############################################################################
+#
+# Restart segments are appended to the XDATCAR (see README). A checkpoint <base>.checkpoint.npz keeps the raw
+# integer hits, the cell volume of every binned frame and the part of the XDATCAR they came from (size + PrefixHash
+# of the frames binned so far, see xdatcar.py). If the XDATCAR has only been appended to and the binning parameters
+# are the same, only the new frames are binned and added. Since the hits are integers and the bin volume is taken
+# from the exactly rounded sum of the frame volumes, the result is identical to binning everything again
+# (with a deposition kernel the hits are float weights, identical up to the rounding of their sums).
+
+CHECKPOINT_SUFFIX = ".checkpoint.npz"
+
+
+def _CheckpointParameters(start, atoms, shape, sparse, kernel=None):
+    """
+    returns the binning parameters a checkpoint is only valid for, as int64 array
+    """
+    # sigma and cutoff of the kernel in units of 1e-6
+    if kernel is None:
+        deposition = [0, 0, 0]
+    else:
+        deposition = [KERNELS.index(kernel["name"]), round(kernel["sigma"] * 1e6), round(kernel["cutoff"] * 1e6)]
+    parameters = [[start, int(sparse)], shape, deposition]
+    for group in _AtomGroups(atoms):
+        group = np.arange(group.start, group.stop) if isinstance(group, slice) else np.asarray(group)
+        parameters += [[len(group)], group]
+    return np.concatenate(parameters).astype(np.int64)
+
+
+def LoadCheckpoint(filename, xdatcar_file, start, atoms, shape, sparse=False, kernel=None):
+    """
+    Takes the base name of the density output, the XDATCAR and the binning parameters
+    returns the checkpoint as dictionary (counts, cell, volumes, stop = first frame not binned yet),
+    or None if there is none or it does not match the XDATCAR or the parameters
+    """
+    checkpoint_file = GridBaseName(filename) + CHECKPOINT_SUFFIX
+    if not os.path.exists(checkpoint_file):
+        return None
+    with np.load(checkpoint_file) as stored:
+        checkpoint = {key: stored[key] for key in stored.files}
+
+    if not np.array_equal(checkpoint["parameters"], _CheckpointParameters(start, atoms, shape, sparse, kernel)):
+        print("Checkpoint {} was written with other parameters, binning all frames".format(checkpoint_file))
+        return None
+    # The checkpoint is checked against the trajectory text (for a binary store the trajectory it was converted from),
+    # so that it stays valid when the trajectory is converted to a store or read from the text again
+    size, source_hash = int(checkpoint["source_size"]), str(checkpoint["source_hash"])
+    source = xdatcar.StoreSource(xdatcar_file) if xdatcar.IsStore(xdatcar_file) else xdatcar_file
+    if os.path.exists(source):
+        unchanged = xdatcar.IsAppended(source, size, source_hash)
+    else:
+        # only the store is left: the checkpoint is valid if it was written for the whole converted trajectory
+        store = xdatcar.ReadStoreHeader(xdatcar_file)
+        unchanged = (store["source_size"], store["source_hash"]) == (size, source_hash)
+    if not unchanged:
+        print("{} has changed (not only appended) since checkpoint {}, binning all frames".format(source, checkpoint_file))
+        return None
+
+    counts = (checkpoint["index"], checkpoint["hits"]) if sparse else checkpoint["counts"]
+    return {"counts": counts, "cell": checkpoint["cell"], "volumes": checkpoint["volumes"],
+            "stop": int(checkpoint["stop"])}
+
+
+def WriteCheckpoint(filename, xdatcar_file, start, stop, atoms, shape, counts, cell, volumes, sparse=False, kernel=None):
+    """
+    Writes the raw hits of the frames [start, stop) of xdatcar_file to <base>.checkpoint.npz
+    (replaced atomically, an interrupted run keeps the old checkpoint)
+    """
+    # The checkpoint covers the file up to the first frame that has not been binned
+    # (a compressed file as a whole, the offsets are positions in the decompressed stream).
+    # For a binary store the trajectory it was converted from is recorded as a whole (see LoadCheckpoint).
+    if xdatcar.IsStore(xdatcar_file):
+        store = xdatcar.ReadStoreHeader(xdatcar_file)
+        size, source_hash = store["source_size"], store["source_hash"]
+    else:
+        index = xdatcar.LoadIndex(xdatcar_file)
+        if stop < len(index["offsets"]) and not xdatcar.IsCompressed(xdatcar_file):
+            size = int(index["offsets"][stop])
+        else:
+            size = int(index["end"])
+        source_hash = xdatcar.PrefixHash(xdatcar_file, size)
+    arrays = {"index": counts[0], "hits": counts[1]} if sparse else {"counts": counts}
+
+    checkpoint_file = GridBaseName(filename) + CHECKPOINT_SUFFIX
+    with open(checkpoint_file + ".tmp", "wb") as f:
+        np.savez(f, parameters=_CheckpointParameters(start, atoms, shape, sparse, kernel),
+                 stop=np.array(stop, dtype=np.int64), cell=cell, volumes=volumes,
+                 source_size=np.array(size, dtype=np.int64),
+                 source_hash=np.array(source_hash), **arrays)
+    os.replace(checkpoint_file + ".tmp", checkpoint_file)
+
+
+def BinTrajectoryCheckpointed(filename, start, stop, atoms, shape, checkpoint, workers=1, batch_size=1024, sparse=False,
+                              kernel=None):
+    """
+    Same as BinTrajectory, but continues from the checkpoint <checkpoint>.checkpoint.npz if it is valid
+    (only frames appended since then are binned) and writes a new checkpoint afterwards.
+    returns hit counts, last cell, cell volume of every binned frame (all frames [start, stop), not only the new ones),
+    first frame binned in this run (start without a valid checkpoint)
+    """
+    previous = LoadCheckpoint(checkpoint, filename, start, atoms, shape, sparse, kernel)
+    first = start
+    if previous is not None and previous["stop"] <= stop:
+        first = previous["stop"]
+        print("Resuming from checkpoint: frames {} to {} already binned, {} new frames".format(start, first - 1, stop - first))
+
+    counts, cell, volumes = BinTrajectory(filename, first, stop, atoms, shape, workers, batch_size, sparse, kernel)
+
+    if first > start:
+        if sparse:
+            counts = MergeSparseCounts(*previous["counts"], *counts)
+        else:
+            counts += previous["counts"]
+        volumes = np.concatenate((previous["volumes"], volumes))
+        if cell is None:
+            cell = previous["cell"]
+
+    if len(volumes) > 0:
+        WriteCheckpoint(checkpoint, filename, start, start + len(volumes), atoms, shape, counts, cell, volumes, sparse, kernel)
+    return counts, cell, volumes, first
+
+
+if __name__ == "__main__":
+    # Conversion of archived extended xyz files: python density_grid.py Li_density.xyz [more.xyz ...]
+    for xyz_file in sys.argv[1:]:
+        print("Converting {}".format(xyz_file))
+        ConvertExtendedXYZ(xyz_file)
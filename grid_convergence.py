@@ -0,0 +1,182 @@
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+import anion_sites
+import benchmark
+import block_average
+import density_grid
+import occupancy_series
+import tetrahedra
+import xdatcar
+
+# Convergence of the tetrahedral occupancies with the grid size for the deposition kernels of density_grid.py.
+#
+# Reference: the occupancies straight from the trajectory (every Li of every frame tested against the tetrahedra,
+# occupancy_series.py). They do not depend on a grid, so every deviation of the grid based values is discretization.
+# For every kernel (ngp, cic, gaussian) and every grid (the base grid of Li_density_ovito3.py divided by 1, 2, 4, ...
+# per axis) the density is binned from the same frames and the Li per site of every column of
+# Tetrahdral_Occupancies_Absolute_per_site.txt is summed up with the voxel masks, as in Li_tetra_type.py.
+# With --method weights every voxel counts with the exact fraction of its volume inside the tetrahedra instead
+# (Li_tetra_type.py with OccupancyMethod="weights"), which removes the error of the voxels cut by the faces.
+#
+#   python grid_convergence.py                          -> XDATCAR + POSCAR of the current directory
+#   python grid_convergence.py --synthetic 2000         -> synthetic trajectory built from POSCAR (see benchmark.py)
+#
+# Two deviations are reported per kernel and grid:
+#   max error  -> from the exact occupancies (discretization + smoothing by the kernel)
+#   grid error -> from the same kernel on the finest grid, i.e. how far the grid is from being converged.
+#                 A Gaussian smooths the density over sigma independently of the grid, so it converges on much
+#                 coarser grids than ngp, but to slightly smoothed occupancies (sigma should stay well below the
+#                 size of a tetrahedron).
+# Results: grid_convergence.txt (one line per kernel and grid) and a summary table.
+# The tetrahedra are those of Li_tetra_type.py, i.e. with the corners from the structure file (tetrahedra.StructureTetrahedra).
+
+### Parameters ########################################################################################################
+EquilibrationTime = 500        # Skip this number of frames from the XDATCAR (same as in Li_density_ovito3.py), so the reference
+                               # and the grids are computed from the frames of the Tetrahdral_Occupancies_* tables
+                               # (a synthetic trajectory has no equilibration and starts at frame 0)
+#######################################################################################################################
+
+DEFAULT_COARSEN = (1, 2, 4, 8)
+
+
+def GridOccupancy(grid, cell, sites_frac, method="grid", voxel_origin=0.0, fractional=None):
+    """
+    Takes a dense density grid (atoms per Angstrom^3), its cell, the fractional sites (occupancy_series.SitesFractional),
+    the OccupancyMethod of Li_tetra_type.py ("grid" or "weights"), the voxel origin of the deposition kernel and the
+    fractional tetrahedra (tetrahedra.StructureTetrahedra, default tetrahedra.TETRA_FRACTIONAL)
+    returns (len(COLUMNS),) Li per site
+    """
+    if method == "grid":
+        library = tetrahedra.TetrahedronLibrary(cell, grid.shape, fractional)
+    voxel_volume = abs(np.linalg.det(cell)) / grid.size
+    occupancy = np.zeros(len(occupancy_series.COLUMNS))
+    for i, (_, key, _, name) in enumerate(occupancy_series.COLUMNS):
+        if len(sites_frac[key]) == 0:
+            continue
+        positions = sites_frac[key] @ cell
+        if method == "grid":
+            sites = tetrahedra.SiteVoxels(positions, cell, grid.shape)
+            total = tetrahedra.SumMaskAroundSites(grid, sites, library["masks"][name])
+        else:
+            total = tetrahedra.SumWeightsAroundSites(grid, positions, cell, name, voxel_origin, fractional)
+        occupancy[i] = total * voxel_volume / len(positions)
+    return occupancy
+
+
+def CoarsenedShapes(base_shape, coarsen):
+    """
+    Takes the base grid shape (bins_z, bins_y, bins_x) and the divisors per axis
+    returns list of (divisor, shape)
+    """
+    return [(n, tuple(max(1, int(round(bins / n))) for bins in base_shape)) for n in coarsen]
+
+
+def ConvergenceStudy(filename, start, stop, atoms, sites_frac, base_shape, coarsen=DEFAULT_COARSEN,
+                     kernels=density_grid.KERNELS, sigma=0.15, workers=1, method="grid", fractional=None):
+    """
+    Bins the frames [start, stop) for every kernel and grid and compares the occupancies (method "grid" or "weights")
+    to the exact ones, both with the fractional tetrahedra (tetrahedra.StructureTetrahedra)
+    returns dictionary with
+      reference -> (len(COLUMNS),) exact Li per site (occupancy_series.py)
+      rows      -> list of dictionaries (kernel, divisor, shape, voxels, occupancy, max_error, grid_error, bin_s, occupancy_s)
+    """
+    print("Exact occupancies from the trajectory...")
+    _, accumulator = occupancy_series.OccupancySeries(filename, start, stop, atoms, sites_frac, workers, keep_series=False,
+                                                     fractional=fractional)
+    reference = occupancy_series.PerSite(block_average.BlockingAnalysis(accumulator)["mean"], sites_frac)
+
+    rows = []
+    for name in kernels:
+        kernel = density_grid.DepositionKernel(name, sigma)
+        for divisor, shape in CoarsenedShapes(base_shape, coarsen):
+            print("Binning {}x{}x{} with {}...".format(*shape[::-1], name))
+            tic = time.perf_counter()
+            counts, cell, volumes = density_grid.BinTrajectory(filename, start, stop, atoms, shape, workers=workers, kernel=kernel)
+            grid = density_grid.CountsToDensity(counts, volumes, shape)
+            bin_time = time.perf_counter() - tic
+
+            tic = time.perf_counter()
+            occupancy = GridOccupancy(grid, cell, sites_frac, method, density_grid.VOXEL_ORIGIN[name], fractional)
+            rows.append({"kernel": name, "divisor": divisor, "shape": shape, "voxels": int(np.prod(shape)),
+                         "occupancy": occupancy, "max_error": float(np.max(np.abs(occupancy - reference))),
+                         "bin_s": bin_time, "occupancy_s": time.perf_counter() - tic})
+
+    for name in kernels:
+        kernel_rows = [row for row in rows if row["kernel"] == name]
+        finest = min(kernel_rows, key=lambda row: row["divisor"])
+        for row in kernel_rows:
+            row["grid_error"] = float(np.max(np.abs(row["occupancy"] - finest["occupancy"])))
+    return {"reference": reference, "rows": rows}
+
+
+def WriteConvergence(filename, study):
+    """
+    Writes the exact occupancies and those of every kernel and grid as tab separated text
+    """
+    columns = ["{}_Type{:d}".format(label, Type + 1) for label, _, Type, _ in occupancy_series.COLUMNS]
+    with open(filename, "w") as f:
+        f.write("\t".join(["Kernel", "Bins_x", "Bins_y", "Bins_z", "Voxels", "Max_error", "Grid_error", "Bin_s", "Occupancy_s"]
+                          + columns) + "\n")
+        f.write("exact\t.\t.\t.\t.\t0.000\t.\t.\t.\t" + "\t".join("{:.3f}".format(v) for v in study["reference"]) + "\n")
+        for row in study["rows"]:
+            bins_z, bins_y, bins_x = row["shape"]
+            f.write("{}\t{}\t{}\t{}\t{}\t{:.3f}\t{:.3f}\t{:.2f}\t{:.2f}\t".format(row["kernel"], bins_x, bins_y, bins_z, row["voxels"],
+                    row["max_error"], row["grid_error"], row["bin_s"], row["occupancy_s"]))
+            f.write("\t".join("{:.3f}".format(v) for v in row["occupancy"]) + "\n")
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Convergence of the tetrahedral occupancies with grid size and deposition kernel")
+    parser.add_argument("--xdatcar", default="XDATCAR", help="trajectory, also .gz/.xz/.bz2/.zst (default: XDATCAR or a compressed XDATCAR.*)")
+    parser.add_argument("--structure", default="POSCAR", help="structure file for the site classification (default: POSCAR)")
+    parser.add_argument("--synthetic", type=int, default=0, metavar="FRAMES",
+                        help="use a synthetic trajectory with this many frames built from the structure (see benchmark.py)")
+    parser.add_argument("--start", type=int, default=None,
+                        help="first frame, skips the equilibration (default: EquilibrationTime = {}, as in Li_density_ovito3.py; "
+                             "0 with --synthetic)".format(EquilibrationTime))
+    parser.add_argument("--grid", type=int, nargs=3, default=(192, 192, 256), metavar=("BINS_X", "BINS_Y", "BINS_Z"),
+                        help="finest grid (default: 192 192 256, as in Li_density_ovito3.py)")
+    parser.add_argument("--coarsen", type=int, nargs="+", default=DEFAULT_COARSEN, help="divisors of the grid per axis (default: 1 2 4 8)")
+    parser.add_argument("--kernels", nargs="+", choices=density_grid.KERNELS, default=density_grid.KERNELS, help="kernels to compare")
+    parser.add_argument("--sigma", type=float, default=0.15, help="width of the Gaussian kernel in Angstrom (default: 0.15)")
+    parser.add_argument("--workers", type=int, default=1, help="number of worker processes (default: 1)")
+    parser.add_argument("--method", choices=("grid", "weights"), default="grid",
+                        help="voxel masks or exact partial volume weights, as OccupancyMethod in Li_tetra_type.py (default: grid)")
+    parser.add_argument("--output", default="grid_convergence.txt", help="output file (default: grid_convergence.txt)")
+    args = parser.parse_args()
+    args.xdatcar = xdatcar.FindTrajectory(args.xdatcar)
+
+    header, positions = xdatcar.ReadPOSCAR(args.structure)
+    species = anion_sites.SpeciesPerAtom(header)
+    sites = anion_sites.ClassifyAnionSites(header["cell"], positions, species)
+    sites_frac = occupancy_series.SitesFractional(sites, header["cell"])
+    fractional, deviation = tetrahedra.StructureTetrahedra(header["cell"], positions, species, sites)
+    print("Tetrahedron corners deviate by up to {:.4f} A from the library".format(deviation))
+    bins_x, bins_y, bins_z = args.grid
+
+    with tempfile.TemporaryDirectory() as workdir:
+        filename = args.xdatcar
+        if args.synthetic:
+            filename = os.path.join(workdir, "XDATCAR")
+            print("Writing synthetic XDATCAR with {} frames".format(args.synthetic))
+            benchmark.WriteSyntheticXDATCAR(args.structure, filename, args.synthetic)
+        start = args.start if args.start is not None else (0 if args.synthetic else EquilibrationTime)
+        N_frames = xdatcar.CountFrames(filename)
+        if start >= N_frames:
+            raise SystemExit("Equilibration (--start {}) skips all {} frames of {}".format(start, N_frames, filename))
+        atoms = xdatcar.SpeciesSlice(xdatcar.ReadHeader(filename), "Li")
+        study = ConvergenceStudy(filename, start, N_frames, atoms, sites_frac, (bins_z, bins_y, bins_x),
+                                 args.coarsen, args.kernels, args.sigma, args.workers, args.method, fractional)
+
+    print("Writing {}".format(args.output))
+    WriteConvergence(args.output, study)
+
+    print("\nLargest deviation in Li per site (all S/Br 4d/4a columns) from the exact values and from the finest grid:")
+    print("kernel     grid            voxels   max error  grid error   bin (s)   occupancy (s)")
+    for row in study["rows"]:
+        print("{:9s} {:>14s} {:9d}   {:9.3f} {:10.3f} {:9.2f} {:12.2f}".format(row["kernel"], "{}x{}x{}".format(*row["shape"][::-1]),
+              row["voxels"], row["max_error"], row["grid_error"], row["bin_s"], row["occupancy_s"]))
@@ -0,0 +1,313 @@
+import argparse
+import multiprocessing
+import numpy as np
+import anion_sites
+import density_grid
+import occupancy_series
+import tetrahedra
+import xdatcar
+
+### Parameters ########################################################################################################
+EquilibrationTime = 500        # Skip this number of frames from the XDATCAR (same as in Li_density_ovito3.py), jumps during
+                               # the equilibration are not counted
+#######################################################################################################################
+
+# Li jump network between the tetrahedral sites.
+#
+# All tetrahedra around the 32 anion sites (types as in Li_tetra_type.py) are collected and tetrahedra that are
+# listed by two sites (type 2 and 5 are shared by a 4d and a 4a site) are merged, which gives the network of
+# unique tetrahedral sites. Every unique site has a type (T1..T5) and an environment, the site classes
+# (S_4d, Br_4d, S_4a, Br_4a) of the anions it belongs to, e.g. T5(S_4d|Br_4a).
+#
+# Every frame each Li is labelled with the site it is in (-1 if it is in none, e.g. while passing a shared face
+# region that is not covered). A jump is counted when a Li shows up in a site different from the last site it was
+# seen in, so rattling across a face without entering the neighbour and frames outside of all sites do not count.
+# Only the last site of every Li, the residence counters of the sites and a sparse {(from, to): count} dictionary
+# are kept, so time is linear and memory constant in the number of frames.
+#
+# Jumps between two T5 sites sharing a face are doublet jumps. Other jumps between sites of the same cage (the
+# tetrahedra listed around the same 4d site) are intracage jumps, all others are intercage jumps.
+
+# (label, key of anion_sites.ClassifyAnionSites, tetrahedron types around the site)
+SITE_CLASSES = [("S_4d",  "S_on_4d",  tetrahedra.TYPES_4D),
+                ("Br_4d", "Br_on_4d", tetrahedra.TYPES_4D),
+                ("S_4a",  "S_on_4a",  tetrahedra.TYPES_4A),
+                ("Br_4a", "Br_on_4a", tetrahedra.TYPES_4A)]
+
+# Tetrahedra (centres) or vertices closer than this (in Angstrom) are the same
+MERGE_TOLERANCE = 0.1
+
+JUMP_CLASSES = ["doublet", "intracage", "intercage"]
+
+
+def _MinimumImageDistances(first, second, cell):
+    """
+    returns (len(first), len(second)) minimum image distances in Angstrom between fractional positions
+    """
+    delta = first[:, None, :] - second[None, :, :]
+    delta -= np.round(delta)
+    return np.linalg.norm(delta @ cell, axis=-1)
+
+
+def TetrahedralNetwork(sites_frac, cell, fractional=None):
+    """
+    Takes the fractional sites (occupancy_series.SitesFractional), the cell and the fractional tetrahedra
+    (default tetrahedra.TETRA_FRACTIONAL, see tetrahedra.StructureTetrahedra)
+    returns the network of unique tetrahedral sites as dictionary with
+      vertices    -> (N_tet, 4, 3) fractional corners
+      type        -> (N_tet,) tetrahedron type 1..5
+      environment -> list of the site classes around every tetrahedron, e.g. "S_4d|Br_4a"
+      cages       -> list of sets of the 4d sites ("S_4d:3") every tetrahedron belongs to
+      category    -> (N_tet,) index into categories, categories -> sorted labels "T5(S_4d|Br_4a)"
+      compiled    -> compiled tetrahedra in fractional coordinates (use periodic=True)
+    """
+    fractional = tetrahedra.TETRA_FRACTIONAL if fractional is None else fractional
+    vertices, types, owners = [], [], []
+    for label, key, site_types in SITE_CLASSES:
+        for i, site in enumerate(sites_frac[key]):
+            for Type, name in enumerate(site_types):
+                if name is None:
+                    continue
+                for corners in fractional[name]:
+                    vertices.append(site + corners)
+                    types.append(Type + 1)
+                    owners.append((label, "{}:{}".format(label, i)))
+
+    vertices = np.array(vertices).reshape(-1, 4, 3)
+    centres = vertices.mean(axis=1)
+    same = _MinimumImageDistances(centres, centres, cell) < MERGE_TOLERANCE
+    representative = np.argmax(same, axis=1)            # first instance of every tetrahedron
+    unique, instance_of = np.unique(representative, return_inverse=True)
+
+    environment = [set() for _ in unique]
+    cages = [set() for _ in unique]
+    for instance, tet in enumerate(instance_of):
+        label, site = owners[instance]
+        environment[tet].add(label)
+        if label.endswith("_4d"):
+            cages[tet].add(site)
+    order = [label for label, _, _ in SITE_CLASSES]
+    environment = ["|".join(sorted(labels, key=order.index)) for labels in environment]
+
+    types = np.array(types)[unique]
+    names = ["T{:d}({})".format(Type, env) for Type, env in zip(types, environment)]
+    categories = sorted(set(names), key=lambda name: (name[1], [order.index(l) for l in name[3:-1].split("|")]))
+
+    return {"vertices": vertices[unique],
+            "type": types,
+            "environment": environment,
+            "cages": cages,
+            "category": np.array([categories.index(name) for name in names]),
+            "categories": categories,
+            "compiled": tetrahedra.CompileTetrahedra(vertices[unique])}
+
+
+def LabelFrame(li_frac, network):
+    """
+    Takes fractional Li positions of one frame and the network
+    returns (N_Li,) index of the tetrahedral site of every Li (-1 if in none)
+    """
+    return tetrahedra.AssignTetrahedra(li_frac, network["compiled"], periodic=True)
+
+
+def JumpCounter(N_Li, N_tet):
+    """
+    returns an empty jump counter (dictionary) for N_Li Li and N_tet tetrahedral sites
+    """
+    return {"first": np.full(N_Li, -1, dtype=np.int64),      # first site each Li was seen in (to join shards)
+            "last": np.full(N_Li, -1, dtype=np.int64),       # last site each Li was seen in
+            "jumps": {},                                      # {(from, to): number of jumps}
+            "residence": np.zeros(N_tet, dtype=np.int64),     # Li-frames spent in every site
+            "unassigned": 0,                                  # Li-frames outside of all sites
+            "frames": 0}
+
+
+def AddFrameLabels(counter, labels):
+    """
+    Adds the site labels of one frame (LabelFrame) to the jump counter (in place)
+    """
+    assigned = labels >= 0
+    counter["residence"] += np.bincount(labels[assigned], minlength=len(counter["residence"]))
+    counter["unassigned"] += int(np.count_nonzero(~assigned))
+    counter["frames"] += 1
+
+    first_time = assigned & (counter["first"] < 0)
+    counter["first"][first_time] = labels[first_time]
+
+    moved = assigned & (counter["last"] >= 0) & (labels != counter["last"])
+    jumps = counter["jumps"]
+    for pair in zip(counter["last"][moved].tolist(), labels[moved].tolist()):
+        jumps[pair] = jumps.get(pair, 0) + 1
+    counter["last"][assigned] = labels[assigned]
+
+
+def MergeJumpCounters(counters):
+    """
+    Takes the jump counters of consecutive parts of the trajectory, in order
+    returns one jump counter, identical to following the whole trajectory at once
+    (jumps between the last site in one part and the first site in the next part are added)
+    """
+    merged = counters[0]
+    for other in counters[1:]:
+        jumps = dict(merged["jumps"])
+        for pair, count in other["jumps"].items():
+            jumps[pair] = jumps.get(pair, 0) + count
+        boundary = (merged["last"] >= 0) & (other["first"] >= 0) & (merged["last"] != other["first"])
+        for pair in zip(merged["last"][boundary].tolist(), other["first"][boundary].tolist()):
+            jumps[pair] = jumps.get(pair, 0) + 1
+        merged = {"first": np.where(merged["first"] >= 0, merged["first"], other["first"]),
+                  "last": np.where(other["last"] >= 0, other["last"], merged["last"]),
+                  "jumps": jumps,
+                  "residence": merged["residence"] + other["residence"],
+                  "unassigned": merged["unassigned"] + other["unassigned"],
+                  "frames": merged["frames"] + other["frames"]}
+    return merged
+
+
+def _JumpShard(job):
+    """
+    Worker function for FollowJumps: follows the Li through the frames [start, stop) of one shard
+    returns jump counter
+    """
+    filename, start, stop, atoms, network = job
+    counter = None
+    for frame, (cell, positions) in enumerate(xdatcar.IterateFrames(filename, start=start, stop=stop), start=start):
+        if frame % 1000 == 0:
+            print("Computing frame {}".format(frame), flush=True)
+        labels = LabelFrame(positions[atoms], network)
+        if counter is None:
+            counter = JumpCounter(len(labels), len(network["type"]))
+        AddFrameLabels(counter, labels)
+    return counter
+
+
+def FollowJumps(filename, start, stop, atoms, network, workers=1):
+    """
+    Follows every Li through the tetrahedral network in the frames [start, stop) of an XDATCAR (one pass).
+    With workers > 1 the frame range is split into shards (see density_grid.ShardRanges).
+    returns jump counter
+    """
+    jobs = [(filename, i, j, atoms, network) for i, j in density_grid.ShardRanges(start, stop, max(workers, 1))]
+    if workers <= 1 or len(jobs) <= 1:
+        # also an empty frame range (e.g. start >= number of frames), reported below as in a serial run
+        counters = [_JumpShard((filename, start, stop, atoms, network))]
+    else:
+        with multiprocessing.Pool(min(workers, len(jobs))) as pool:
+            counters = pool.map(_JumpShard, jobs)
+    counters = [counter for counter in counters if counter is not None]
+    if not counters:
+        raise ValueError("No frames in {} between {} and {}".format(filename, start, stop))
+    return MergeJumpCounters(counters)
+
+
+def JumpClass(network, cell, i, j):
+    """
+    returns "doublet", "intracage" or "intercage" for a jump between the tetrahedral sites i and j
+    """
+    if network["type"][i] == 5 and network["type"][j] == 5:
+        shared = _MinimumImageDistances(network["vertices"][i], network["vertices"][j], cell) < MERGE_TOLERANCE
+        if np.count_nonzero(shared.any(axis=1)) >= 3:
+            return "doublet"
+    if network["cages"][i] & network["cages"][j]:
+        return "intracage"
+    return "intercage"
+
+
+def JumpStatistics(counter, network, cell, time_per_frame=1.0):
+    """
+    Takes a jump counter, the network, the cell and the time between two frames (in ps)
+    returns dictionary with
+      categories -> site categories, matrix -> (K, K) number of jumps from category (row) to category (column)
+      residence  -> Li-frames per category, occupancy -> average number of Li per category
+      rate_out   -> jumps out of a category per Li residing in it and ps, residence_time -> mean residence time in ps
+      classes    -> {doublet/intracage/intercage: number of jumps}, class_rate -> jumps per Li and ps
+    """
+    K = len(network["categories"])
+    category = network["category"]
+    matrix = np.zeros((K, K), dtype=np.int64)
+    classes = dict.fromkeys(JUMP_CLASSES, 0)
+    for (i, j), count in counter["jumps"].items():
+        matrix[category[i], category[j]] += count
+        classes[JumpClass(network, cell, i, j)] += count
+
+    residence = np.bincount(category, weights=counter["residence"], minlength=K)
+    jumps_out = matrix.sum(axis=1)
+    total_time = counter["frames"] * time_per_frame
+    N_Li = len(counter["last"])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rate_out = np.where(residence > 0, jumps_out / (residence * time_per_frame), 0.0)
+        residence_time = np.where(jumps_out > 0, residence * time_per_frame / jumps_out, np.inf)
+
+    return {"categories": network["categories"],
+            "matrix": matrix,
+            "residence": residence,
+            "occupancy": residence / max(counter["frames"], 1),
+            "rate_out": rate_out,
+            "residence_time": residence_time,
+            "classes": classes,
+            "class_rate": {name: count / (N_Li * total_time) if total_time > 0 else 0.0 for name, count in classes.items()},
+            "unassigned": counter["unassigned"] / max(counter["frames"] * N_Li, 1)}
+
+
+def WriteTransitionMatrix(filename, statistics):
+    """
+    Writes the number of jumps between the site categories (rows: from, columns: to) as tab separated text
+    """
+    with open(filename, "w") as f:
+        f.write("From\\To\t" + "\t".join(statistics["categories"]) + "\n")
+        for name, row in zip(statistics["categories"], statistics["matrix"]):
+            f.write(name + "\t" + "\t".join("{:d}".format(count) for count in row) + "\n")
+
+
+def WriteJumpRates(filename, statistics, time_per_frame):
+    """
+    Writes occupancy, jump rates and residence times per site category and the doublet/intracage/intercage statistics
+    """
+    with open(filename, "w") as f:
+        f.write("# time between frames: {} ps, Li outside of all tetrahedra: {:.2f}%\n".format(time_per_frame, 100 * statistics["unassigned"]))
+        f.write("Site\tLi_per_frame\tJumps_out\tRate_out(1/ps)\tResidence_time(ps)\n")
+        for i, name in enumerate(statistics["categories"]):
+            f.write("{}\t{:.3f}\t{:d}\t{:.4f}\t{:.3f}\n".format(name, statistics["occupancy"][i], statistics["matrix"][i].sum(),
+                                                             statistics["rate_out"][i], statistics["residence_time"][i]))
+        f.write("\nJump\tCount\tRate_per_Li(1/ps)\n")
+        for name in JUMP_CLASSES:
+            f.write("{}\t{:d}\t{:.4f}\n".format(name, statistics["classes"][name], statistics["class_rate"][name]))
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Li jumps between tetrahedral sites from an XDATCAR")
+    parser.add_argument("--xdatcar", default="XDATCAR", help="trajectory, also .gz/.xz/.bz2/.zst (default: XDATCAR or a compressed XDATCAR.*)")
+    parser.add_argument("--structure", default="POSCAR", help="structure file for the site classification (default: POSCAR)")
+    parser.add_argument("--start", type=int, default=EquilibrationTime,
+                        help="first frame, skips the equilibration (default: EquilibrationTime = {}, as in Li_density_ovito3.py)".format(EquilibrationTime))
+    parser.add_argument("--timestep", type=float, default=1.0, help="time between two frames in fs, i.e. POTIM*NBLOCK (default: 1)")
+    parser.add_argument("--workers", type=int, default=1, help="number of worker processes (default: 1)")
+    parser.add_argument("--species", default="Li", help="species to be followed (default: Li)")
+    args = parser.parse_args()
+    args.xdatcar = xdatcar.FindTrajectory(args.xdatcar)
+
+    header, positions = xdatcar.ReadPOSCAR(args.structure)
+    species = anion_sites.SpeciesPerAtom(header)
+    sites = anion_sites.ClassifyAnionSites(header["cell"], positions, species)
+    anion_sites.PrintPositionalAnalysis(sites)
+    fractional, deviation = tetrahedra.StructureTetrahedra(header["cell"], positions, species, sites)
+    print("Tetrahedron corners deviate by up to {:.4f} A from the library".format(deviation))
+    network = TetrahedralNetwork(occupancy_series.SitesFractional(sites, header["cell"]), header["cell"], fractional)
+    print("Tetrahedral network: {} sites in {} categories".format(len(network["type"]), len(network["categories"])))
+
+    atoms    = xdatcar.SpeciesSlice(xdatcar.ReadHeader(args.xdatcar), args.species)
+    N_frames = xdatcar.CountFrames(args.xdatcar)
+    if args.start >= N_frames:
+        raise SystemExit("Equilibration (--start {}) skips all {} frames of {}".format(args.start, N_frames, args.xdatcar))
+    counter  = FollowJumps(args.xdatcar, args.start, N_frames, atoms, network, args.workers)
+
+    time_per_frame = args.timestep / 1000
+    statistics = JumpStatistics(counter, network, header["cell"], time_per_frame)
+    print("Writing Li_jump_matrix.txt and Li_jump_rates.txt")
+    WriteTransitionMatrix("Li_jump_matrix.txt", statistics)
+    WriteJumpRates("Li_jump_rates.txt", statistics, time_per_frame)
+
+    print("\nJumps in {} frames:".format(counter["frames"]))
+    for name in JUMP_CLASSES:
+        print("  {:10s} {:8d}  ({:.4f} per Li and ps)".format(name, statistics["classes"][name], statistics["class_rate"][name]))
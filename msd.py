@@ -0,0 +1,238 @@
+import argparse
+import numpy as np
+import anion_sites
+import occupancy_series
+import xdatcar
+
+### Parameters ########################################################################################################
+EquilibrationTime = 500        # Skip this number of frames from the XDATCAR (same as in Li_density_ovito3.py), the
+                               # equilibration does not enter the MSD and the diffusion fit
+#######################################################################################################################
+
+# Mean square displacements and diffusion coefficients of Li from an XDATCAR.
+#
+# The frames are streamed with xdatcar.IterateFrames (same reader as Li_density_ovito3.py). Positions are unwrapped
+# on the fly: the fractional displacement between two frames is taken with the minimum image convention and converted
+# with the cell of the frame, so variable-cell runs work as well. The drift of the framework (mean displacement of
+# all other atoms) is removed by default.
+#
+# The MSD over all time origins is computed with the FFT algorithm (Calandrini et al., Kneller et al.; as in nMOLDYN
+# and MDAnalysis) in O(N log N) instead of the O(N^2) loop over time origins:
+#   MSD(m) = S1(m) - 2 S2(m), S2 = position autocorrelation (FFT), S1 from cumulative sums of |r|^2
+#
+#   tracer MSD      -> average of the single-Li MSDs                     -> D_tracer = slope / 6
+#   collective MSD  -> MSD of the summed Li displacement divided by N_Li  -> D_sigma  = slope / 6
+# D_sigma is the charge diffusion coefficient (Nernst-Einstein conductivity sigma = N e^2 D_sigma / (V kB T)),
+# the Haven ratio is D_tracer / D_sigma.
+#
+# Every Li is assigned to the anion site class (S_4d, Br_4d, S_4a, Br_4a) it is closest to in most frames, so the
+# tracer MSD can be split by environment.
+
+SITE_CLASSES = ["S_on_4d", "Br_on_4d", "S_on_4a", "Br_on_4a"]
+
+ELEMENTARY_CHARGE = 1.602176634e-19     # C
+BOLTZMANN         = 1.380649e-23        # J/K
+
+
+def UnwrapTrajectory(filename, start, stop, atoms, sites_frac=None, remove_drift=True):
+    """
+    Streams the frames [start, stop) of an XDATCAR and unwraps the positions of atoms.
+    With sites_frac (occupancy_series.SitesFractional) the nearest anion site class of every atom is counted per frame.
+    returns dictionary with
+      positions -> (N_frames, N_atoms, 3) unwrapped Cartesian positions in Angstrom
+      volumes   -> (N_frames,) cell volumes
+      nearest   -> (N_atoms, len(SITE_CLASSES)) number of frames each atom was closest to each site class (or None)
+    """
+    positions, volumes = [], []
+    nearest = None
+    previous = None
+    for frame, (cell, frac) in enumerate(xdatcar.IterateFrames(filename, start=start, stop=stop), start=start):
+        if frame % 1000 == 0:
+            print("Reading frame {}".format(frame), flush=True)
+        volumes.append(abs(np.linalg.det(cell)))
+
+        if previous is None:
+            current = frac[atoms] @ cell
+            drift = np.zeros(3)
+        else:
+            step = frac - previous
+            step -= np.round(step)
+            step = step @ cell
+            mask = np.ones(len(frac), dtype=bool)
+            mask[atoms] = False
+            if remove_drift and mask.any():
+                drift = drift + step[mask].mean(axis=0)
+            current = current + step[atoms]
+        positions.append(current - drift)
+        previous = frac
+
+        if sites_frac is not None:
+            nearest = _CountNearestClass(frac[atoms], sites_frac, cell, nearest)
+
+    if not positions:
+        raise ValueError("No frames in {} between {} and {}".format(filename, start, stop))
+    return {"positions": np.array(positions),
+            "volumes": np.array(volumes),
+            "nearest": nearest}
+
+
+def _CountNearestClass(frac, sites_frac, cell, nearest=None):
+    """
+    Adds one frame to the counts of the nearest anion site class of every atom
+    returns (N_atoms, len(SITE_CLASSES)) counts
+    """
+    if nearest is None:
+        nearest = np.zeros((len(frac), len(SITE_CLASSES)), dtype=np.int64)
+    distances = np.full((len(frac), len(SITE_CLASSES)), np.inf)
+    for c, key in enumerate(SITE_CLASSES):
+        if len(sites_frac[key]) == 0:
+            continue
+        delta = frac[:, None, :] - sites_frac[key][None, :, :]
+        delta -= np.round(delta)
+        distances[:, c] = np.linalg.norm(delta @ cell, axis=-1).min(axis=1)
+    nearest[np.arange(len(frac)), np.argmin(distances, axis=1)] += 1
+    return nearest
+
+
+def MSDFFT(positions):
+    """
+    Takes (N_frames, N_particles, 3) unwrapped positions
+    returns (N_frames, N_particles) MSD of every particle for lag 0 .. N_frames-1, averaged over all time origins
+    """
+    positions = np.asarray(positions, dtype=np.float64)
+    N = len(positions)
+    lags = N - np.arange(N)
+
+    # S2: autocorrelation of the positions via FFT (zero padded to avoid circular correlation)
+    transform = np.fft.rfft(positions, n=2 * N, axis=0)
+    S2 = np.fft.irfft(transform * transform.conj(), n=2 * N, axis=0)[:N].sum(axis=-1) / lags[:, None]
+
+    # S1(m) = (sum_{k=0}^{N-m-1} |r(k)|^2 + |r(k+m)|^2) / (N-m), with cumulative sums from both ends
+    squared = np.sum(positions**2, axis=-1)
+    total = 2 * squared.sum(axis=0)
+    removed = np.zeros_like(squared)
+    removed[1:] = np.cumsum(squared[:-1], axis=0) + np.cumsum(squared[::-1], axis=0)[:-1]
+    S1 = (total - removed) / lags[:, None]
+
+    return S1 - 2 * S2
+
+
+def TracerMSD(positions):
+    """
+    returns (N_frames,) MSD averaged over all particles
+    """
+    return MSDFFT(positions).mean(axis=1)
+
+
+def CollectiveMSD(positions):
+    """
+    returns (N_frames,) MSD of the summed displacement of all particles divided by the number of particles
+    """
+    return MSDFFT(np.sum(positions, axis=1, keepdims=True))[:, 0] / positions.shape[1]
+
+
+def FitDiffusion(time, msd, fit_range=(0.1, 0.5)):
+    """
+    Takes lag times (ps), an MSD (Angstrom^2) and the fitted part of the lag times (fractions of the longest lag).
+    Short lags are ballistic and long lags have only few time origins, therefore only the middle part is fitted.
+    returns (D in Angstrom^2/ps, intercept) of the linear fit MSD = 6 D t + intercept
+    """
+    first, last = (int(f * (len(time) - 1)) for f in fit_range)
+    if last - first < 2:
+        return float("nan"), float("nan")
+    slope, intercept = np.polyfit(time[first:last + 1], msd[first:last + 1], 1)
+    return slope / 6, intercept
+
+
+def Conductivity(D_sigma, N_ions, volume, temperature, charge=1):
+    """
+    Takes D_sigma (Angstrom^2/ps), number of ions, cell volume (Angstrom^3), temperature (K) and ionic charge
+    returns Nernst-Einstein conductivity in S/cm
+    """
+    D = D_sigma * 1e-8                           # Angstrom^2/ps -> m^2/s
+    n = N_ions / (volume * 1e-30)                # ions per m^3
+    sigma = n * (charge * ELEMENTARY_CHARGE)**2 * D / (BOLTZMANN * temperature)   # S/m
+    return sigma / 100
+
+
+def DiffusionAnalysis(trajectory, time_per_frame, fit_range=(0.1, 0.5), temperature=None):
+    """
+    Takes the result of UnwrapTrajectory, the time between two frames (ps), the fit range and optionally the temperature
+    returns dictionary with time, tracer/collective MSD, D_tracer, D_sigma, Haven ratio, conductivity (or None)
+    and per site class: class of every atom, MSD and D_tracer
+    """
+    positions = trajectory["positions"]
+    time = np.arange(len(positions)) * time_per_frame
+    single = MSDFFT(positions)
+    tracer = single.mean(axis=1)
+    collective = CollectiveMSD(positions)
+
+    D_tracer, _ = FitDiffusion(time, tracer, fit_range)
+    D_sigma, _ = FitDiffusion(time, collective, fit_range)
+    result = {"time": time, "tracer": tracer, "collective": collective,
+              "D_tracer": D_tracer, "D_sigma": D_sigma,
+              "haven_ratio": D_tracer / D_sigma if D_sigma > 0 else float("nan"),
+              "conductivity": None, "classes": {}}
+    if temperature:
+        result["conductivity"] = Conductivity(D_sigma, positions.shape[1], trajectory["volumes"].mean(), temperature)
+
+    if trajectory["nearest"] is not None:
+        assigned = np.argmax(trajectory["nearest"], axis=1)
+        for c, key in enumerate(SITE_CLASSES):
+            members = assigned == c
+            if members.any():
+                msd = single[:, members].mean(axis=1)
+                result["classes"][key] = {"N": int(members.sum()), "msd": msd, "D_tracer": FitDiffusion(time, msd, fit_range)[0]}
+    return result
+
+
+def WriteMSD(filename, result):
+    """
+    Writes time (ps), tracer MSD, collective MSD and the tracer MSD per site class (Angstrom^2) as tab separated text
+    """
+    classes = list(result["classes"])
+    columns = [result["time"], result["tracer"], result["collective"]] + [result["classes"][key]["msd"] for key in classes]
+    header = "\t".join(["Time(ps)", "MSD_tracer", "MSD_collective"] + ["MSD_" + key for key in classes])
+    np.savetxt(filename, np.column_stack(columns), fmt="%.6f", delimiter="\t", header=header, comments="")
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="FFT-based MSD and diffusion coefficients from an XDATCAR")
+    parser.add_argument("--xdatcar", default="XDATCAR", help="trajectory, also .gz/.xz/.bz2/.zst (default: XDATCAR or a compressed XDATCAR.*)")
+    parser.add_argument("--structure", default="POSCAR", help="structure file for the site classes (default: POSCAR, '' to skip)")
+    parser.add_argument("--start", type=int, default=EquilibrationTime,
+                        help="first frame, skips the equilibration (default: EquilibrationTime = {}, as in Li_density_ovito3.py)".format(EquilibrationTime))
+    parser.add_argument("--timestep", type=float, default=1.0, help="time between two frames in fs, i.e. POTIM*NBLOCK (default: 1)")
+    parser.add_argument("--fit", type=float, nargs=2, default=(0.1, 0.5), help="fitted part of the lag times (default: 0.1 0.5)")
+    parser.add_argument("--temperature", type=float, default=None, help="temperature in K for the Nernst-Einstein conductivity")
+    parser.add_argument("--species", default="Li", help="diffusing species (default: Li)")
+    parser.add_argument("--keep-drift", dest="remove_drift", action="store_false", help="do not remove the drift of the framework")
+    args = parser.parse_args()
+    args.xdatcar = xdatcar.FindTrajectory(args.xdatcar)
+
+    sites_frac = None
+    if args.structure:
+        header, positions = xdatcar.ReadPOSCAR(args.structure)
+        sites = anion_sites.ClassifyAnionSites(header["cell"], positions, anion_sites.SpeciesPerAtom(header))
+        sites_frac = occupancy_series.SitesFractional(sites, header["cell"])
+
+    atoms    = xdatcar.SpeciesSlice(xdatcar.ReadHeader(args.xdatcar), args.species)
+    N_frames = xdatcar.CountFrames(args.xdatcar)
+    if args.start >= N_frames:
+        raise SystemExit("Equilibration (--start {}) skips all {} frames of {}".format(args.start, N_frames, args.xdatcar))
+    trajectory = UnwrapTrajectory(args.xdatcar, args.start, N_frames, atoms, sites_frac, args.remove_drift)
+    result = DiffusionAnalysis(trajectory, args.timestep / 1000, tuple(args.fit), args.temperature)
+
+    print("Writing {}_msd.txt".format(args.species))
+    WriteMSD("{}_msd.txt".format(args.species), result)
+
+    # 1 Angstrom^2/ps = 1e-4 cm^2/s
+    print("\nFrames: {}, {}: {}".format(len(result["time"]), args.species, trajectory["positions"].shape[1]))
+    print("D_tracer = {:.4e} cm^2/s".format(result["D_tracer"] * 1e-4))
+    print("D_sigma  = {:.4e} cm^2/s".format(result["D_sigma"] * 1e-4))
+    print("Haven ratio = {:.3f}".format(result["haven_ratio"]))
+    if result["conductivity"] is not None:
+        print("sigma (Nernst-Einstein, {} K) = {:.4e} S/cm".format(args.temperature, result["conductivity"]))
+    for key, values in result["classes"].items():
+        print("  {:9s} ({:3d} {}): D_tracer = {:.4e} cm^2/s".format(key, values["N"], args.species, values["D_tracer"] * 1e-4))
@@ -0,0 +1,232 @@
+import argparse
+import multiprocessing
+import numpy as np
+import anion_sites
+import block_average
+import density_grid
+import tetrahedra
+import xdatcar
+
+### Parameters ########################################################################################################
+EquilibrationTime = 500        # Skip this number of frames from the XDATCAR (same as in Li_density_ovito3.py), so the
+                               # time average sits next to the Tetrahdral_Occupancies_* tables of the same frames
+#######################################################################################################################
+
+# Time-resolved tetrahedral occupancy straight from the trajectory (no density grid).
+#
+# Every Li of every frame is tested against the tetrahedra around the S/Br sites of Part 1 of
+# Li_tetra_type.py (anion_sites.py). Per frame the number of Li inside the tetrahedra of each type
+# around each site class is counted, which gives the same numbers as Tetrahdral_Occupancies_Absolute_per_site.txt
+# (Li per site), but for every frame or window of frames instead of only the time average.
+#
+# The test is done in fractional coordinates with the fractional tetrahedra of the library (TETRA_FRACTIONAL):
+# barycentric coordinates do not change under the linear map fractional -> Cartesian, so the result is
+# the same as with the tetrahedra scaled to the cell of the frame, also for variable-cell runs.
+# The sites are kept at their fractional positions from the structure file (as for the density analysis).
+# Only the Li of the current frame and their distances to the sites are held in memory.
+# Standard errors (naive and autocorrelation-corrected by blocking, see block_average.py) are accumulated in the
+# same pass with O(blocks) memory, so the per-frame series only has to be kept if it is written out.
+
+# Columns of the time series: (site class, key of anion_sites.ClassifyAnionSites, type index 0..4, tetrahedron type)
+# Same layout as Tetrahdral_Occupancies_Absolute_per_site.txt (type 3 is not listed there)
+COLUMNS = [(label, key, Type, name)
+           for label, key, site_types in (("S_4d",  "S_on_4d",  tetrahedra.TYPES_4D),
+                                          ("Br_4d", "Br_on_4d", tetrahedra.TYPES_4D),
+                                          ("S_4a",  "S_on_4a",  tetrahedra.TYPES_4A),
+                                          ("Br_4a", "Br_on_4a", tetrahedra.TYPES_4A))
+           for Type, name in enumerate(site_types) if name is not None and Type != 2]
+
+
+def FractionalTetrahedra(fractional=None):
+    """
+    Compiles all tetrahedron types in fractional coordinates (relative to the site),
+    default tetrahedra.TETRA_FRACTIONAL or those of tetrahedra.StructureTetrahedra
+    returns {type: (compiled tetrahedra, fractional half extent of the bounding box around the site)}
+    """
+    fractional = tetrahedra.TETRA_FRACTIONAL if fractional is None else fractional
+    return {name: (tetrahedra.CompileTetrahedra(frac), np.abs(frac).max(axis=(0, 1)))
+            for name, frac in fractional.items()}
+
+
+def SitesFractional(sites, cell):
+    """
+    Takes the classification of anion_sites.ClassifyAnionSites and the cell it was done in
+    returns {key: (N_sites, 3) fractional site positions} for the four site classes
+    """
+    inv_cell = np.linalg.inv(cell)
+    return {key: sites[key] @ inv_cell for key in ("S_on_4d", "Br_on_4d", "S_on_4a", "Br_on_4a")}
+
+
+def CountLiAroundSites(li_frac, site_frac, compiled, extent):
+    """
+    Takes fractional Li positions, fractional site positions and one compiled tetrahedron type (FractionalTetrahedra)
+    returns number of (Li, site) pairs with the Li inside the (union of the) tetrahedra around the site
+    """
+    if len(site_frac) == 0:
+        return 0
+    relative = li_frac[:, None, :] - site_frac[None, :, :]        # (N_Li, N_sites, 3)
+    relative -= np.round(relative)                                 # minimum image
+    close = np.all(np.abs(relative) <= extent, axis=-1)            # bounding box pre-selection
+    if not close.any():
+        return 0
+    return int(np.count_nonzero(tetrahedra.AssignTetrahedra(relative[close], compiled) >= 0))
+
+
+def FrameOccupancy(li_frac, sites_frac, library):
+    """
+    Takes the fractional Li positions of one frame, the fractional sites (SitesFractional)
+    and the fractional tetrahedra (FractionalTetrahedra)
+    returns (len(COLUMNS),) number of Li inside the tetrahedra of every column (not yet per site)
+    """
+    return np.array([CountLiAroundSites(li_frac, sites_frac[key], *library[name])
+                     for _, key, _, name in COLUMNS], dtype=np.int64)
+
+
+def _OccupancyShard(job):
+    """
+    Worker function for OccupancySeries: counts the frames [start, stop) of one shard
+    returns ((N_frames, len(COLUMNS)) counts or None, block accumulator of the counts)
+    """
+    filename, start, stop, atoms, sites_frac, keep_series, fractional = job
+    library = FractionalTetrahedra(fractional)
+    accumulator = block_average.BlockAccumulator(len(COLUMNS))
+    counts = []
+    for frame, (cell, positions) in enumerate(xdatcar.IterateFrames(filename, start=start, stop=stop), start=start):
+        if frame % 1000 == 0:
+            print("Computing frame {}".format(frame), flush=True)
+        frame_counts = FrameOccupancy(positions[atoms], sites_frac, library)
+        block_average.AddFrame(accumulator, frame_counts)
+        if keep_series:
+            counts.append(frame_counts)
+    if not keep_series:
+        return None, accumulator
+    return np.array(counts, dtype=np.int64).reshape(-1, len(COLUMNS)), accumulator
+
+
+def OccupancySeries(filename, start, stop, atoms, sites_frac, workers=1, keep_series=True, fractional=None):
+    """
+    Counts the Li in the tetrahedra around all sites for the frames [start, stop) of an XDATCAR in one pass,
+    with the fractional tetrahedra of tetrahedra.StructureTetrahedra (default tetrahedra.TETRA_FRACTIONAL).
+    With workers > 1 the frame range is split into shards (see density_grid.ShardRanges).
+    returns ((N_frames, len(COLUMNS)) integer counts or None if not keep_series, block accumulator of the counts)
+    """
+    jobs = [(filename, i, j, atoms, sites_frac, keep_series, fractional)
+            for i, j in density_grid.ShardRanges(start, stop, max(workers, 1))]
+    if workers <= 1 or len(jobs) <= 1:
+        # also an empty frame range (e.g. start >= number of frames): no counts as in a serial run
+        return _OccupancyShard((filename, start, stop, atoms, sites_frac, keep_series, fractional))
+
+    with multiprocessing.Pool(min(workers, len(jobs))) as pool:
+        results = pool.map(_OccupancyShard, jobs)
+    accumulator = block_average.MergeAccumulators([shard_accumulator for _, shard_accumulator in results])
+    if not keep_series:
+        return None, accumulator
+    return np.concatenate([shard_counts for shard_counts, _ in results]), accumulator
+
+
+def PerSite(counts, sites_frac):
+    """
+    Takes counts of OccupancySeries and the fractional sites
+    returns Li per site (counts divided by the number of sites of the column's class, 0 for classes without sites)
+    """
+    N_sites = np.array([len(sites_frac[key]) for _, key, _, _ in COLUMNS], dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(N_sites > 0, counts / N_sites, 0.0)
+
+
+def WindowAverage(series, window):
+    """
+    Takes a (N_frames, N_columns) time series and the window length in frames
+    returns (N_windows, N_columns) averages over consecutive windows (an incomplete last window is averaged as well)
+    """
+    if window <= 1:
+        return series
+    starts = np.arange(0, len(series), window)
+    return np.add.reduceat(series, starts, axis=0) / np.diff(np.append(starts, len(series)))[:, None]
+
+
+def WriteOccupancySeries(filename, series, first_frame, window=1):
+    """
+    Writes the (windowed) Li per site time series as tab separated text. The first column is the
+    XDATCAR frame number of the (first frame of the) window.
+    """
+    frames = first_frame + np.arange(len(series)) * max(window, 1)
+    header = "Frame\t" + "\t".join("{}_Type{:d}".format(label, Type + 1) for label, _, Type, _ in COLUMNS)
+    np.savetxt(filename, np.column_stack([frames, series]), fmt=["%d"] + ["%.3f"] * len(COLUMNS),
+               delimiter="\t", header=header, comments="")
+
+
+def WriteOccupancyErrors(filename, statistics, sites_frac, first_frame=0, N_frames=None):
+    """
+    Takes the BlockingAnalysis of the counts, the fractional sites, the first frame averaged (after the equilibration)
+    and the number of frames averaged
+    writes the time-averaged Li per site in the layout of Tetrahdral_Occupancies_Absolute_per_site.txt,
+    every value followed by its naive standard error (SE) and the autocorrelation-corrected one (SE_corr)
+    """
+    mean  = PerSite(statistics["mean"], sites_frac)
+    naive = PerSite(statistics["naive_error"], sites_frac)
+    error = PerSite(statistics["error"], sites_frac)
+
+    with open(filename, "w") as f:
+        f.write("# Frames {} to {} (first frame after the equilibration: {})\n".format(
+                first_frame, "end" if N_frames is None else first_frame + N_frames - 1, first_frame))
+        f.write("Site" + "".join("\tType{:d}\tSE\tSE_corr".format(Type) for Type in range(1, 6)) + "\n")
+        for label in ("S_4d", "Br_4d", "S_4a", "Br_4a"):
+            f.write(label)
+            for Type in range(5):
+                columns = [i for i, column in enumerate(COLUMNS) if column[0] == label and column[2] == Type]
+                if columns:
+                    i = columns[0]
+                    f.write("\t{:.3f}\t{:.3f}\t{:.3f}".format(mean[i], naive[i], error[i]))
+                else:
+                    f.write("\t.\t.\t.")
+            f.write("\n")
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Time-resolved tetrahedral Li occupancy from an XDATCAR")
+    parser.add_argument("--xdatcar", default="XDATCAR", help="trajectory, also .gz/.xz/.bz2/.zst (default: XDATCAR or a compressed XDATCAR.*)")
+    parser.add_argument("--structure", default="POSCAR", help="structure file for the site classification (default: POSCAR)")
+    parser.add_argument("--start", type=int, default=EquilibrationTime,
+                        help="first frame, skips the equilibration (default: EquilibrationTime = {}, as in Li_density_ovito3.py)".format(EquilibrationTime))
+    parser.add_argument("--window", type=int, default=1, help="average over windows of this many frames (default: 1 = every frame)")
+    parser.add_argument("--workers", type=int, default=1, help="number of worker processes (default: 1)")
+    parser.add_argument("--species", default="Li", help="species to be assigned (default: Li)")
+    parser.add_argument("--output", default="Tetrahdral_Occupancies_time_series.txt", help="output file")
+    parser.add_argument("--errors", default="Tetrahdral_Occupancies_Absolute_per_site_errors.txt", help="time average with error bars")
+    parser.add_argument("--no-series", dest="series", action="store_false", help="only write the time average with error bars (O(blocks) memory)")
+    args = parser.parse_args()
+    args.xdatcar = xdatcar.FindTrajectory(args.xdatcar)
+
+    header, positions = xdatcar.ReadPOSCAR(args.structure)
+    species = anion_sites.SpeciesPerAtom(header)
+    sites = anion_sites.ClassifyAnionSites(header["cell"], positions, species)
+    anion_sites.PrintPositionalAnalysis(sites)
+    sites_frac = SitesFractional(sites, header["cell"])
+    fractional, deviation = tetrahedra.StructureTetrahedra(header["cell"], positions, species, sites)
+    print("Tetrahedron corners deviate by up to {:.4f} A from the library".format(deviation))
+
+    atoms    = xdatcar.SpeciesSlice(xdatcar.ReadHeader(args.xdatcar), args.species)
+    N_frames = xdatcar.CountFrames(args.xdatcar)
+    if args.start >= N_frames:
+        raise SystemExit("Equilibration (--start {}) skips all {} frames of {}".format(args.start, N_frames, args.xdatcar))
+    print("Assigning {} {} in frames {} to {} with {} worker(s)".format(atoms.stop - atoms.start, args.species,
+                                                                      args.start, N_frames - 1, args.workers))
+    counts, accumulator = OccupancySeries(args.xdatcar, args.start, N_frames, atoms, sites_frac, args.workers, args.series,
+                                          fractional)
+
+    if args.series:
+        series = PerSite(counts, sites_frac)
+        print("Writing {} ({} frames, window {})".format(args.output, len(series), args.window))
+        WriteOccupancySeries(args.output, WindowAverage(series, args.window), args.start, args.window)
+
+    statistics = block_average.BlockingAnalysis(accumulator)
+    print("Writing {}".format(args.errors))
+    WriteOccupancyErrors(args.errors, statistics, sites_frac, args.start, N_frames - args.start)
+
+    print("\nTime average (Li per site) +- standard error (naive / autocorrelation-corrected), statistical inefficiency:")
+    mean, naive, error = (PerSite(statistics[key], sites_frac) for key in ("mean", "naive_error", "error"))
+    for i, (label, _, Type, _) in enumerate(COLUMNS):
+        print("  {:6s}Type{:d}  {:.3f} +- {:.3f} / {:.3f}   {:7.1f}{}".format(label, Type + 1, mean[i], naive[i], error[i],
+              statistics["inefficiency"][i], "" if statistics["converged"][i] else "  (no plateau, trajectory too short)"))
@@ -0,0 +1,136 @@
+import contextlib
+import cProfile
+import datetime
+import io
+import json
+import os
+import pstats
+import sys
+import time
+
+try:
+    import resource
+except ImportError:         # not available on Windows, peak RSS is then not reported
+    resource = None
+
+# Stage timers and a structured run report for the analysis scripts.
+#
+# A report is a dictionary. Every stage of a script is wrapped in "with Stage(report, name):", which adds the wall
+# and CPU time of the block to the stage (a stage entered several times, e.g. once per group, accumulates) and
+# records the peak resident memory reached so far. Throughputs (frames/s, points/s) are added with Rate after a stage.
+# FinishReport writes everything as JSON next to the outputs (e.g. Li_density.report.json), so it is easy to see
+# which stage to work on when a cluster job runs into the time limit.
+#
+# Profiling is opt-in: with profile=True in StartReport the stages entered with profile=True (the hot loops) run
+# under cProfile. The statistics are written to <report>.prof (e.g. for snakeviz) and the top functions are printed.
+# Only the main process is profiled, use a single worker to see the binning itself.
+
+
+def PeakRSS():
+    """
+    returns (peak resident memory of this process, peak of the largest finished child process) in MB, or (None, None)
+    """
+    if resource is None:
+        return None, None
+    # ru_maxrss is in kB on Linux, in bytes on macOS
+    unit = 1 / 1024**2 if sys.platform == "darwin" else 1 / 1024
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit)
+
+
+def StartReport(script, parameters=None, profile=False):
+    """
+    Takes the name of the script, its parameters (JSON serializable dictionary) and whether to profile the hot loops
+    returns an empty report (dictionary)
+    """
+    return {"script": script,
+            "started": datetime.datetime.now().isoformat(timespec="seconds"),
+            "directory": os.getcwd(),
+            "parameters": parameters or {},
+            "stages": {},
+            "counters": {},
+            "rates": {},
+            "profiler": cProfile.Profile() if profile else None,
+            "clock": (time.perf_counter(), time.process_time())}
+
+
+@contextlib.contextmanager
+def Stage(report, name, profile=False):
+    """
+    Context manager that adds the wall and CPU time of the block to the stage name of the report.
+    With profile=True the block runs under the profiler of the report (if profiling is switched on).
+    """
+    profiler = report["profiler"] if profile else None
+    wall, cpu = time.perf_counter(), time.process_time()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        stage = report["stages"].setdefault(name, {"wall_s": 0.0, "cpu_s": 0.0, "calls": 0})
+        stage["wall_s"] += time.perf_counter() - wall
+        stage["cpu_s"] += time.process_time() - cpu
+        stage["calls"] += 1
+        stage["peak_rss_MB"], stage["peak_rss_children_MB"] = PeakRSS()
+
+
+def Count(report, name, value):
+    """
+    Adds value to the counter name of the report (e.g. frames, points)
+    """
+    report["counters"][name] = report["counters"].get(name, 0) + value
+
+
+def Rate(report, name, stage):
+    """
+    Stores the counter name divided by the wall time of stage as <name>_per_s (e.g. frames_per_s),
+    nothing if the counter or the stage does not exist
+    """
+    seconds = report["stages"].get(stage, {}).get("wall_s", 0.0)
+    if seconds > 0 and name in report["counters"]:
+        report["rates"]["{}_per_s".format(name)] = report["counters"].get(name, 0) / seconds
+
+
+def FinishReport(report, filename):
+    """
+    Adds the total times and the peak memory, writes the report as JSON to filename and,
+    if profiling was switched on, the profile to <filename without .json>.prof
+    returns the report without the profiler (as written)
+    """
+    wall, cpu = report["clock"]
+    result = {key: value for key, value in report.items() if key not in ("profiler", "clock")}
+    result["total"] = {"wall_s": time.perf_counter() - wall, "cpu_s": time.process_time() - cpu}
+    result["total"]["peak_rss_MB"], result["total"]["peak_rss_children_MB"] = PeakRSS()
+
+    profiler = report["profiler"]
+    if profiler is not None:
+        profile_file = (filename[:-len(".json")] if filename.endswith(".json") else filename) + ".prof"
+        profiler.dump_stats(profile_file)
+        result["profile"] = profile_file
+
+    with open(filename, "w") as f:
+        json.dump(result, f, indent=1)
+    return result
+
+
+def PrintReport(report, top=15):
+    """
+    Prints the time per stage (and the top functions of the profile, if there is one)
+    """
+    total = report["total"]["wall_s"]
+    print("\nStage          wall (s)   cpu (s)   share   peak RSS (MB)")
+    for name, stage in report["stages"].items():
+        print("{:12s} {:10.2f} {:9.2f} {:6.1f}%   {}".format(name, stage["wall_s"], stage["cpu_s"],
+              100 * stage["wall_s"] / total if total > 0 else 0.0,
+              "-" if stage["peak_rss_MB"] is None else "{:.0f}".format(stage["peak_rss_MB"])))
+    print("{:12s} {:10.2f} {:9.2f}".format("total", total, report["total"]["cpu_s"]))
+    for name, value in report["rates"].items():
+        print("{} = {:.1f}".format(name, value))
+
+    if "profile" in report:
+        stream = io.StringIO()
+        pstats.Stats(report["profile"], stream=stream).sort_stats("cumulative").print_stats(top)
+        print("\nProfile written to {}, top {} functions (cumulative time):".format(report["profile"], top))
+        print(stream.getvalue())
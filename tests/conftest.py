@@ -0,0 +1,32 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+# The analysis scripts are flat modules next to each other (no package), see README.md
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmark
+import xdatcar
+
+# Small synthetic XDATCAR (benchmark.WriteSyntheticXDATCAR) shared by the tests
+N_FRAMES = 40
+SHAPE = (16, 12, 12)        # bins_z, bins_y, bins_x
+
+
+@pytest.fixture(scope="session")
+def trajectory(tmp_path_factory):
+    """
+    returns (file name of a synthetic XDATCAR with N_FRAMES frames, atom slice of the Li)
+    """
+    filename = str(tmp_path_factory.mktemp("synthetic") / "XDATCAR")
+    header = benchmark.WriteSyntheticXDATCAR(benchmark.DEFAULT_STRUCTURE, filename, N_FRAMES)
+    return filename, xdatcar.SpeciesSlice(header, "Li")
+
+
+def ReadAllFrames(filename, **kwargs):
+    """
+    returns (N_frames, 3, 3) cells and (N_frames, N_atoms, 3) fractional positions of a trajectory
+    """
+    cells, positions = zip(*xdatcar.IterateFrames(filename, **kwargs))
+    return np.array(cells), np.array(positions)
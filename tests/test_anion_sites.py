@@ -0,0 +1,48 @@
+import os
+import numpy as np
+import pytest
+import anion_sites
+import xdatcar
+
+# Checks of the S/Br site classification (anion_sites.py) on the POSCARs below data/: the S/Br distribution
+# is known from the name of the data set (16 4d and 16 4a sites per cell).
+
+DATA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+EXPECTED = {"ordered":       ((16, 0, 0, 16), 0.0),
+            "Br_S_defect":   ((15, 1, 0, 16), -1),       # one Br on a 4d site, not stoichiometric
+            "S_Br_defect":   ((16, 0, 1, 15), -1),       # one S on a 4a site
+            "6.25%disorder": ((15, 1, 1, 15), 6.25)}     # one S/Br pair exchanged
+STRUCTURES = sorted(anion_sites.ClassifyDirectory(DATA))
+
+
+@pytest.mark.parametrize("filename", STRUCTURES, ids=[os.path.relpath(f, DATA) for f in STRUCTURES])
+def test_classification_of_the_known_structures(filename):
+    counts, disorder = EXPECTED[os.path.relpath(filename, DATA).split(os.sep)[0]]
+    sites = anion_sites.ClassifyPOSCAR(filename)
+    assert tuple(len(sites[key]) for key in ("S_on_4d", "Br_on_4d", "S_on_4a", "Br_on_4a")) == counts
+    assert sites["SiteDisorder"] == pytest.approx(disorder)
+
+    report = sites["report"]
+    assert not report["outside_tolerance"] and not report["not_anion"] and len(report["shared_atoms"]) == 0
+    species = report["species"]
+    for key, names in (("S_on_4d", anion_sites.SULFUR_NAMES), ("Br_on_4a", anion_sites.BROMINE_NAMES)):
+        assert np.all(np.isin(species[np.isin(report["atom"], sites["atoms"][key])], names))
+
+
+def test_all_data_sets_are_checked():
+    assert len(STRUCTURES) == 10
+    assert {os.path.relpath(f, DATA).split(os.sep)[0] for f in STRUCTURES} == set(EXPECTED)
+
+
+def test_classification_with_displacements_and_shuffled_atoms():
+    header, positions = xdatcar.ReadPOSCAR(os.path.join(DATA, "6.25%disorder", "01", "POSCAR"))
+    species = anion_sites.SpeciesPerAtom(header)
+    reference = anion_sites.ClassifyAnionSites(header["cell"], positions, species)
+
+    rng = np.random.default_rng(0)
+    order = rng.permutation(len(positions))
+    displaced = positions[order] + rng.normal(0, 0.3, positions.shape) @ np.linalg.inv(header["cell"])
+    sites = anion_sites.ClassifyAnionSites(header["cell"], displaced % 1.0, species[order])
+    for key in ("S_on_4d", "Br_on_4d", "S_on_4a", "Br_on_4a"):
+        np.testing.assert_array_equal(np.sort(order[sites["atoms"][key]]), reference["atoms"][key])
+    assert sites["SiteDisorder"] == reference["SiteDisorder"]
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+import block_average
+
+# Checks of the streaming blocking analysis (block_average.py) on an AR(1) series x_t = phi x_{t-1} + noise
+# with known statistics: variance 1/(1-phi^2), statistical inefficiency (1+phi)/(1-phi).
+
+PHI = 0.9
+N_FRAMES = 2**17
+
+
+@pytest.fixture(scope="module")
+def series():
+    """
+    returns (N_FRAMES, 2) series: AR(1) with PHI in the first column, uncorrelated noise in the second
+    """
+    rng = np.random.default_rng(0)
+    noise = rng.normal(size=N_FRAMES)
+    values = np.empty(N_FRAMES)
+    values[0] = noise[0] / np.sqrt(1 - PHI**2)
+    for t in range(1, N_FRAMES):
+        values[t] = PHI * values[t - 1] + noise[t]
+    return np.column_stack((values, rng.normal(size=N_FRAMES)))
+
+
+def Accumulate(values):
+    accumulator = block_average.BlockAccumulator(values.shape[1])
+    for frame in values:
+        block_average.AddFrame(accumulator, frame)
+    return accumulator
+
+
+def test_blocking_recovers_the_known_error(series):
+    statistics = block_average.BlockingAnalysis(Accumulate(series))
+    inefficiency = np.array([(1 + PHI) / (1 - PHI), 1.0])
+    variance = np.array([1 / (1 - PHI**2), 1.0])
+    np.testing.assert_allclose(statistics["mean"], series.mean(axis=0), rtol=1e-10)
+    np.testing.assert_allclose(statistics["naive_error"], series.std(axis=0, ddof=1) / np.sqrt(N_FRAMES), rtol=1e-6)
+    np.testing.assert_allclose(statistics["error"], np.sqrt(variance * inefficiency / N_FRAMES), rtol=0.15)
+    np.testing.assert_allclose(statistics["inefficiency"], inefficiency, rtol=0.2)
+    assert np.all(statistics["converged"])
+
+
+def test_merged_shards_match_one_pass(series):
+    whole = block_average.BlockingAnalysis(Accumulate(series))
+    shards = [Accumulate(part) for part in np.array_split(series, 3)]
+    merged = block_average.BlockingAnalysis(block_average.MergeAccumulators(shards))
+    np.testing.assert_allclose(merged["mean"], whole["mean"], rtol=1e-10)
+    np.testing.assert_allclose(merged["naive_error"], whole["naive_error"], rtol=1e-10)
+    # the unfinished blocks at the shard boundaries are dropped
+    np.testing.assert_allclose(merged["error"], whole["error"], rtol=0.1)
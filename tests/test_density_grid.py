@@ -0,0 +1,143 @@
+import os
+import numpy as np
+import pytest
+import anion_sites
+import benchmark
+import density_grid
+import xdatcar
+from conftest import N_FRAMES, SHAPE
+
+# Checks of the density binning (density_grid.py) on the synthetic XDATCAR of conftest.py:
+# the fast paths against the straightforward ones. Run with "python -m pytest -q" in the directory of the scripts.
+
+
+def test_parallel_binning_is_identical_to_serial(trajectory):
+    filename, atoms = trajectory
+    serial, serial_cell, serial_volumes = density_grid.BinTrajectory(filename, 5, N_FRAMES, atoms, SHAPE)
+    parallel, parallel_cell, parallel_volumes = density_grid.BinTrajectory(filename, 5, N_FRAMES, atoms, SHAPE, workers=3)
+    assert serial.sum() == (N_FRAMES - 5) * (atoms.stop - atoms.start)
+    np.testing.assert_array_equal(parallel, serial)
+    np.testing.assert_array_equal(parallel_cell, serial_cell)
+    np.testing.assert_array_equal(parallel_volumes, serial_volumes)
+
+
+def test_parallel_binning_of_an_empty_frame_range(trajectory):
+    filename, atoms = trajectory
+    counts, cell, volumes = density_grid.BinTrajectory(filename, N_FRAMES, N_FRAMES, atoms, SHAPE, workers=3)
+    assert counts.sum() == 0 and len(volumes) == 0
+
+
+@pytest.mark.parametrize("name", ["cic", "gaussian"])
+def test_deposition_kernels_conserve_the_number_of_atoms(trajectory, name):
+    filename, atoms = trajectory
+    kernel = density_grid.DepositionKernel(name, 0.15)
+    serial, serial_cell, serial_volumes = density_grid.BinTrajectory(filename, 0, N_FRAMES, atoms, SHAPE, kernel=kernel)
+    parallel, parallel_cell, parallel_volumes = density_grid.BinTrajectory(filename, 0, N_FRAMES, atoms, SHAPE, workers=3,
+                                                                          kernel=kernel)
+    assert np.isclose(serial.sum(), N_FRAMES * (atoms.stop - atoms.start), rtol=1e-9)
+    assert serial.min() >= 0 and np.count_nonzero(serial) > N_FRAMES * (atoms.stop - atoms.start) // 4
+    np.testing.assert_allclose(parallel, serial, rtol=1e-9, atol=1e-9)
+
+
+def Density(trajectory):
+    """
+    returns the Li density of the synthetic trajectory and its cell
+    """
+    filename, atoms = trajectory
+    counts, cell, volumes = density_grid.BinTrajectory(filename, 0, N_FRAMES, atoms, SHAPE)
+    return density_grid.CountsToDensity(counts, volumes, SHAPE), cell
+
+
+def test_binary_grid_round_trip(trajectory, tmp_path):
+    grid, cell = Density(trajectory)
+    density_grid.WriteDensityGrid(str(tmp_path / "Li_density.npy"), grid, cell, N_FRAMES, "Li")
+    read, header = density_grid.ReadDensityGrid(str(tmp_path / "Li_density.npy"))
+    np.testing.assert_array_equal(read, grid)
+    np.testing.assert_array_equal(header["cell"], cell)
+    assert header["shape"] == SHAPE and header["frames"] == N_FRAMES
+    assert header["species"] == "Li" and header["deposition"] == "ngp"
+
+
+def test_extended_xyz_round_trip(trajectory, tmp_path):
+    grid, cell = Density(trajectory)
+    filename = str(tmp_path / "Li_density.xyz")
+    density_grid.WriteExtendedXYZ(filename, grid, cell)
+    read, read_cell = density_grid.ReadExtendedXYZ(filename)
+    np.testing.assert_allclose(read, grid, rtol=0, atol=5e-9)       # written with 8 decimals
+    np.testing.assert_allclose(read_cell, cell, rtol=0, atol=5e-9)
+    assert read.shape == SHAPE
+
+
+def test_sparse_binning_matches_dense(trajectory):
+    filename, atoms = trajectory
+    dense, _, _ = density_grid.BinTrajectory(filename, 0, N_FRAMES, atoms, SHAPE)
+    (index, hits), _, _ = density_grid.BinTrajectory(filename, 0, N_FRAMES, atoms, SHAPE, workers=2, sparse=True)
+    np.testing.assert_array_equal(index, np.flatnonzero(dense))
+    np.testing.assert_array_equal(hits, dense[index])
+
+
+def test_sparse_grid_matches_dense_density(trajectory, tmp_path):
+    filename, atoms = trajectory
+    grid, cell = Density(trajectory)
+    counts, _, volumes = density_grid.BinTrajectory(filename, 0, N_FRAMES, atoms, SHAPE, sparse=True)
+    density_grid.WriteSparseGrid(str(tmp_path / "Li_density"), density_grid.SparseFromCounts(counts, volumes, SHAPE, cell, "Li"))
+    sparse = density_grid.ReadSparseGrid(str(tmp_path / "Li_density.sparse.npz"))
+    assert sparse["shape"] == SHAPE and sparse["frames"] == N_FRAMES
+    # every voxel, also the empty ones
+    np.testing.assert_allclose(density_grid.SparseValuesAt(sparse, np.arange(grid.size)), grid.ravel(), rtol=1e-12)
+
+
+def test_checkpoint_resume_matches_full_run(tmp_path):
+    filename = str(tmp_path / "XDATCAR")
+    header = benchmark.WriteSyntheticXDATCAR(benchmark.DEFAULT_STRUCTURE, filename, 25)
+    atoms = xdatcar.SpeciesSlice(header, "Li")
+    checkpoint = str(tmp_path / "Li_density")
+    _, _, _, first = density_grid.BinTrajectoryCheckpointed(filename, 5, 25, atoms, SHAPE, checkpoint)
+    assert first == 5
+
+    # same seed -> the first 25 frames are unchanged, 15 frames are appended
+    benchmark.WriteSyntheticXDATCAR(benchmark.DEFAULT_STRUCTURE, filename, N_FRAMES)
+    counts, cell, volumes, first = density_grid.BinTrajectoryCheckpointed(filename, 5, N_FRAMES, atoms, SHAPE, checkpoint)
+    assert first == 25
+
+    full_counts, full_cell, full_volumes = density_grid.BinTrajectory(filename, 5, N_FRAMES, atoms, SHAPE)
+    np.testing.assert_array_equal(counts, full_counts)
+    np.testing.assert_array_equal(cell, full_cell)
+    np.testing.assert_array_equal(volumes, full_volumes)
+
+
+def test_checkpoint_stays_valid_for_the_binary_store(tmp_path):
+    filename = str(tmp_path / "XDATCAR")
+    header = benchmark.WriteSyntheticXDATCAR(benchmark.DEFAULT_STRUCTURE, filename, 25)
+    atoms = xdatcar.SpeciesSlice(header, "Li")
+    checkpoint = str(tmp_path / "Li_density")
+    previous, _, _, _ = density_grid.BinTrajectoryCheckpointed(filename, 5, 25, atoms, SHAPE, checkpoint)
+
+    # frames appended and converted: the store is read, the frames binned from the text are kept
+    benchmark.WriteSyntheticXDATCAR(benchmark.DEFAULT_STRUCTURE, filename, N_FRAMES)
+    xdatcar.ConvertToStore(filename)
+    store = xdatcar.FindTrajectory(filename)
+    assert xdatcar.IsStore(store)
+    counts, _, volumes, first = density_grid.BinTrajectoryCheckpointed(store, 5, N_FRAMES, atoms, SHAPE, checkpoint)
+    assert first == 25 and len(volumes) == N_FRAMES - 5
+    np.testing.assert_array_equal(counts, previous + density_grid.BinTrajectory(store, 25, N_FRAMES, atoms, SHAPE)[0])
+
+    # checkpoint written from the store: still valid when the text is read again, or when only the store is left
+    assert density_grid.BinTrajectoryCheckpointed(filename, 5, N_FRAMES, atoms, SHAPE, checkpoint)[3] == N_FRAMES
+    os.remove(filename)
+    assert density_grid.BinTrajectoryCheckpointed(store, 5, N_FRAMES, atoms, SHAPE, checkpoint)[3] == N_FRAMES
+
+
+def test_stacked_groups_match_separate_runs(trajectory):
+    filename, li = trajectory
+    header = xdatcar.ReadHeader(filename)
+    structure, positions = xdatcar.ReadPOSCAR(benchmark.DEFAULT_STRUCTURE)
+    sites = anion_sites.ClassifyAnionSites(structure["cell"], positions, anion_sites.SpeciesPerAtom(structure))
+    groups = [li, xdatcar.SpeciesSlice(header, "P"), sites["atoms"]["S_on_4d"]]
+
+    for sparse in (False, True):
+        stacked, _, _ = density_grid.BinTrajectory(filename, 0, N_FRAMES, groups, SHAPE, workers=2, sparse=sparse)
+        for group, counts in zip(groups, density_grid.SplitGroups(stacked, SHAPE, len(groups), sparse)):
+            separate, _, _ = density_grid.BinTrajectory(filename, 0, N_FRAMES, group, SHAPE, sparse=sparse)
+            for part, expected in zip(counts if sparse else [counts], separate if sparse else [separate]):
+                np.testing.assert_array_equal(part, expected)
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+import anion_sites
+import benchmark
+import jump_network
+import occupancy_series
+import xdatcar
+from conftest import N_FRAMES
+
+# Checks of the jump counting (jump_network.py) on a scripted sequence of site labels (-1: in no site)
+
+LABELS = np.array([[ 0, -1,  2],
+                   [ 0, -1, -1],
+                   [ 1,  3,  2],      # Li 0: 0 -> 1
+                   [ 1,  3,  1],      # Li 2: 2 -> 1
+                   [-1,  3,  2],      # Li 2: 1 -> 2
+                   [ 1,  0,  1],      # Li 0 back in 1 after leaving all sites: no jump; Li 1: 3 -> 0; Li 2: 2 -> 1
+                   [ 2,  0,  1]])     # Li 0: 1 -> 2
+JUMPS = {(0, 1): 1, (1, 2): 2, (2, 1): 2, (3, 0): 1}
+N_TET = 4
+
+
+def Follow(labels):
+    counter = jump_network.JumpCounter(labels.shape[1], N_TET)
+    for frame in labels:
+        jump_network.AddFrameLabels(counter, frame)
+    return counter
+
+
+def test_jumps_of_a_scripted_sequence():
+    counter = Follow(LABELS)
+    assert counter["jumps"] == JUMPS
+    np.testing.assert_array_equal(counter["residence"], [4, 6, 4, 3])
+    assert counter["unassigned"] == 4 and counter["frames"] == len(LABELS)
+    np.testing.assert_array_equal(counter["first"], [0, 3, 2])
+    np.testing.assert_array_equal(counter["last"], [2, 0, 1])
+
+
+@pytest.mark.parametrize("edges", [(1,), (2,), (4, 5), (1, 2, 3, 6)])
+def test_merged_shards_match_one_pass(edges):
+    counter = jump_network.MergeJumpCounters([Follow(part) for part in np.split(LABELS, edges)])
+    assert counter["jumps"] == JUMPS
+    np.testing.assert_array_equal(counter["residence"], [4, 6, 4, 3])
+    assert counter["frames"] == len(LABELS)
+    np.testing.assert_array_equal(counter["last"], [2, 0, 1])
+
+
+@pytest.fixture(scope="module")
+def network():
+    header, positions = xdatcar.ReadPOSCAR(benchmark.DEFAULT_STRUCTURE)
+    sites = anion_sites.ClassifyAnionSites(header["cell"], positions, anion_sites.SpeciesPerAtom(header))
+    return jump_network.TetrahedralNetwork(occupancy_series.SitesFractional(sites, header["cell"]), header["cell"])
+
+
+def test_parallel_jumps_are_identical_to_serial(trajectory, network):
+    filename, atoms = trajectory
+    serial = jump_network.FollowJumps(filename, 5, N_FRAMES, atoms, network)
+    parallel = jump_network.FollowJumps(filename, 5, N_FRAMES, atoms, network, workers=3)
+    assert serial["jumps"] and parallel["jumps"] == serial["jumps"]
+    np.testing.assert_array_equal(parallel["residence"], serial["residence"])
+
+
+def test_empty_frame_range_with_several_workers(trajectory, network):
+    filename, atoms = trajectory
+    with pytest.raises(ValueError, match="No frames"):
+        jump_network.FollowJumps(filename, N_FRAMES, N_FRAMES, atoms, network, workers=3)
@@ -0,0 +1,23 @@
+import numpy as np
+import msd
+
+# Checks of the FFT based MSD (msd.py) against the direct O(N^2) average over all time origins
+
+
+def DirectMSD(positions):
+    """
+    returns (N_frames, N_particles) MSD for every lag, averaged over all time origins with an explicit loop
+    """
+    return np.array([np.mean(np.sum((positions[m:] - positions[:len(positions) - m])**2, axis=-1), axis=0)
+                     for m in range(len(positions))])
+
+
+def test_msd_fft_matches_direct_sum():
+    positions = np.cumsum(np.random.default_rng(0).normal(size=(50, 4, 3)), axis=0)
+    np.testing.assert_allclose(msd.MSDFFT(positions), DirectMSD(positions), rtol=1e-10, atol=1e-10)
+
+
+def test_collective_msd_of_one_particle_is_the_tracer_msd():
+    positions = np.cumsum(np.random.default_rng(1).normal(size=(30, 1, 3)), axis=0)
+    np.testing.assert_allclose(msd.CollectiveMSD(positions), msd.TracerMSD(positions), rtol=1e-12)
+    np.testing.assert_allclose(msd.TracerMSD(positions), DirectMSD(positions)[:, 0], rtol=1e-10, atol=1e-10)
@@ -0,0 +1,44 @@
+import numpy as np
+import anion_sites
+import benchmark
+import occupancy_series
+import tetrahedra
+import xdatcar
+from conftest import N_FRAMES, ReadAllFrames
+
+# Checks of the time-resolved occupancy (occupancy_series.py) on the synthetic XDATCAR of conftest.py.
+
+
+def Sites():
+    header, positions = xdatcar.ReadPOSCAR(benchmark.DEFAULT_STRUCTURE)
+    sites = anion_sites.ClassifyAnionSites(header["cell"], positions, anion_sites.SpeciesPerAtom(header))
+    return occupancy_series.SitesFractional(sites, header["cell"])
+
+
+def test_parallel_series_is_identical_to_serial(trajectory):
+    filename, atoms = trajectory
+    sites_frac = Sites()
+    serial, serial_accumulator = occupancy_series.OccupancySeries(filename, 5, N_FRAMES, atoms, sites_frac)
+    parallel, parallel_accumulator = occupancy_series.OccupancySeries(filename, 5, N_FRAMES, atoms, sites_frac, workers=3)
+    assert serial.shape == (N_FRAMES - 5, len(occupancy_series.COLUMNS)) and serial.sum() > 0
+    np.testing.assert_array_equal(parallel, serial)
+    np.testing.assert_allclose(parallel_accumulator["mean"], serial.mean(axis=0), rtol=1e-12)
+
+
+def test_series_of_an_empty_frame_range(trajectory):
+    filename, atoms = trajectory
+    counts, accumulator = occupancy_series.OccupancySeries(filename, N_FRAMES, N_FRAMES, atoms, Sites(), workers=3)
+    assert counts.shape == (0, len(occupancy_series.COLUMNS)) and accumulator["n"] == 0
+
+
+def test_counts_match_a_direct_assignment(trajectory):
+    filename, atoms = trajectory
+    sites_frac = Sites()
+    counts, _ = occupancy_series.OccupancySeries(filename, 0, 3, atoms, sites_frac)
+    for frame, positions in enumerate(ReadAllFrames(filename, stop=3)[1]):
+        for column, (_, key, _, name) in enumerate(occupancy_series.COLUMNS):
+            compiled = tetrahedra.CompileTetrahedra(tetrahedra.TETRA_FRACTIONAL[name])
+            # every (Li, site) pair against the tetrahedra around the site, without the bounding box pre-selection
+            expected = sum(int(np.count_nonzero(tetrahedra.AssignTetrahedra(positions[atoms] - site, compiled, periodic=True) >= 0))
+                           for site in sites_frac[key])
+            assert counts[frame, column] == expected
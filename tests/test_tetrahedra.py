@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+import anion_sites
+import benchmark
+import density_grid
+import tetrahedra
+import xdatcar
+
+# Checks of the tetrahedral occupancy (tetrahedra.py): the grid, points and weights methods against each other
+# and against the volumes of the tetrahedra.
+
+SHAPE = (32, 24, 24)        # bins_z, bins_y, bins_x; the sites of the bundled POSCAR sit on grid points
+
+
+@pytest.fixture(scope="module")
+def structure():
+    """
+    returns cell, fractional positions, species and site classification of the bundled POSCAR
+    """
+    header, positions = xdatcar.ReadPOSCAR(benchmark.DEFAULT_STRUCTURE)
+    species = anion_sites.SpeciesPerAtom(header)
+    return header["cell"], positions, species, anion_sites.ClassifyAnionSites(header["cell"], positions, species)
+
+
+def test_grid_and_points_method_agree(structure):
+    cell, positions, species, sites = structure
+    # Corners of a slightly distorted structure: no grid point lies exactly on a face, where the two methods
+    # may decide differently by round-off (see Li_tetra_type.py)
+    rng = np.random.default_rng(3)
+    fractional, deviation = tetrahedra.StructureTetrahedra(cell, positions + rng.normal(0, 0.002, positions.shape),
+                                                           species, sites)
+    assert fractional is not tetrahedra.TETRA_FRACTIONAL and deviation > 0.01
+
+    grid = rng.random(SHAPE)
+    library = tetrahedra.TetrahedronLibrary(cell, SHAPE, fractional)
+    sparse = density_grid.DenseToSparse(grid, cell)
+    cell_list = tetrahedra.BuildCellList(density_grid.GridPointsAt(cell, SHAPE, sparse["index"]), cell)
+    for key, site_types in (("S_on_4d", tetrahedra.TYPES_4D), ("Br_on_4a", tetrahedra.TYPES_4A)):
+        for name in filter(None, site_types):
+            on_grid = tetrahedra.SumMaskAroundSites(grid, tetrahedra.SiteVoxels(sites[key], cell, SHAPE),
+                                                    library["masks"][name])
+            on_points = tetrahedra.SumDensityAroundSitesPoints(cell_list, sparse["values"], library["relative"][name],
+                                                               sites[key])
+            assert on_grid == pytest.approx(on_points, rel=1e-12)
+
+
+
+def test_ideal_structure_uses_the_library(structure):
+    fractional, deviation = tetrahedra.StructureTetrahedra(*structure)
+    assert fractional is tetrahedra.TETRA_FRACTIONAL and deviation < 0.01
+
+
+@pytest.mark.parametrize("voxel_origin", [0.0, -0.5])
+@pytest.mark.parametrize("name", sorted(tetrahedra.TETRA_FRACTIONAL))
+def test_weights_add_up_to_the_volume(structure, name, voxel_origin):
+    cell = structure[0]
+    offsets, weights = tetrahedra.WeightTable(name, SHAPE, (0.3, -0.2, 0.45), voxel_origin)
+    tetra_grid = tetrahedra.TETRA_FRACTIONAL[name] * np.array(SHAPE[::-1])
+    assert weights.min() > 0 and weights.max() <= 1 + 1e-12
+    assert weights.sum() == pytest.approx(tetrahedra.TetrahedraVolumes(tetra_grid).sum(), rel=1e-10)
+    # the same with the voxels in Angstrom^3
+    voxel = abs(np.linalg.det(cell)) / np.prod(SHAPE)
+    assert weights.sum() * voxel == pytest.approx(tetrahedra.TetrahedraVolumes(tetrahedra.TETRA_FRACTIONAL[name] @ cell).sum(),
+                                                  rel=1e-10)
+
+
+def test_equivalent_sites_share_one_weight_table(structure):
+    cell, positions, species, sites = structure
+    tetrahedra._WEIGHT_CACHE.clear()
+    grid = np.random.default_rng(5).random(SHAPE)
+    # every S on 4d sits on a grid point: shifts of +-1e-7 voxels and -0.0 (as from a cell that differs in the last digits)
+    # must not build new tables
+    exact = tetrahedra.SumWeightsAroundSites(grid, sites["S_on_4d"], cell, "4d_type1")
+    assert len(tetrahedra._WEIGHT_CACHE) == 1
+    shifts = np.array([[1e-7, -1e-7, 0.0], [-0.0, -0.0, -0.0], [-1e-7, 0.0, 1e-7]])
+    for shift in shifts:
+        tetrahedra.WeightTable("4d_type1", SHAPE, shift)
+    nudged = sites["S_on_4d"] + 1e-6 * np.random.default_rng(6).standard_normal(sites["S_on_4d"].shape)
+    assert tetrahedra.SumWeightsAroundSites(grid, nudged, cell * (1 + 1e-7), "4d_type1") == pytest.approx(exact, rel=1e-12)
+    assert len(tetrahedra._WEIGHT_CACHE) == 1
+
+
+def test_weight_cache_is_bounded(monkeypatch):
+    monkeypatch.setattr(tetrahedra, "MAX_WEIGHT_TABLES", 2)
+    tetrahedra._WEIGHT_CACHE.clear()
+    for x in (0.1, 0.2, 0.3):
+        tetrahedra.WeightTable("4a_type2", SHAPE, (x, 0.0, 0.0))
+    assert len(tetrahedra._WEIGHT_CACHE) == 2
@@ -0,0 +1,136 @@
+import bz2
+import gzip
+import importlib.util
+import lzma
+import os
+import shutil
+import subprocess
+import numpy as np
+import pytest
+import benchmark
+import xdatcar
+from conftest import N_FRAMES, ReadAllFrames
+
+# Checks of the trajectory reader (xdatcar.py): frame index, compressed input and the binary store
+# against plain sequential reading of the synthetic XDATCAR of conftest.py.
+
+
+def test_index_resumes_after_appended_frames(tmp_path):
+    filename = str(tmp_path / "XDATCAR")
+    benchmark.WriteSyntheticXDATCAR(benchmark.DEFAULT_STRUCTURE, filename, 25)
+    previous = xdatcar.BuildIndex(filename)
+    assert len(previous["offsets"]) == 25
+
+    # same seed -> the first 25 frames are unchanged, 15 frames are appended
+    benchmark.WriteSyntheticXDATCAR(benchmark.DEFAULT_STRUCTURE, filename, N_FRAMES)
+    assert xdatcar.IsAppended(filename, int(previous["end"]), str(previous["prefix_hash"]))
+    resumed = xdatcar.BuildIndex(filename, resume=previous)
+    rebuilt = xdatcar.BuildIndex(filename)
+    for key in ("end", "prefix_hash", "offsets", "numbers", "cartesian", "header_frames", "header_cells", "counts"):
+        np.testing.assert_array_equal(resumed[key], rebuilt[key])
+    assert len(resumed["offsets"]) == N_FRAMES
+
+
+def test_indexed_and_sequential_reading_agree(trajectory):
+    filename, _ = trajectory
+    cells, positions = ReadAllFrames(filename, use_index=False)
+    indexed_cells, indexed_positions = ReadAllFrames(filename)
+    np.testing.assert_array_equal(indexed_cells, cells)
+    np.testing.assert_array_equal(indexed_positions, positions)
+    _, selected = ReadAllFrames(filename, start=7, stop=30, step=5)
+    np.testing.assert_array_equal(selected, positions[7:30:5])
+
+
+def test_partially_written_frame_is_not_read(trajectory, tmp_path):
+    filename, _ = trajectory
+    truncated = str(tmp_path / "XDATCAR")
+    with open(filename, "rb") as f:
+        content = f.read()
+    with open(truncated, "wb") as f:
+        f.write(content[:len(content) - 20])     # last line of the last frame without its end
+    assert os.path.getsize(truncated) < len(content)
+    for use_index in (True, False):
+        assert xdatcar.CountFrames(truncated, use_index=use_index) == N_FRAMES - 1
+        assert len(ReadAllFrames(truncated, use_index=use_index)[1]) == N_FRAMES - 1
+
+
+def Compress(filename, suffix):
+    """
+    returns the name of a compressed copy of filename (.gz, .xz, .bz2 with the Python modules, .zst with the zstd binary)
+    """
+    compressed = filename + suffix
+    if suffix == ".zst":
+        if shutil.which("zstd") is None:
+            pytest.skip("zstd is not installed")
+        subprocess.run(["zstd", "-q", "-f", "-o", compressed, filename], check=True)
+        return compressed
+    with open(filename, "rb") as f, {".gz": gzip, ".xz": lzma, ".bz2": bz2}[suffix].open(compressed, "wb") as out:
+        shutil.copyfileobj(f, out)
+    return compressed
+
+
+@pytest.mark.parametrize("command_line", [True, False])
+@pytest.mark.parametrize("suffix", [".gz", ".xz", ".bz2", ".zst"])
+def test_compressed_stream_matches_plain_file(trajectory, tmp_path, monkeypatch, suffix, command_line):
+    filename, _ = trajectory
+    text = str(tmp_path / "XDATCAR")
+    shutil.copy(filename, text)
+    compressed = Compress(text, suffix)
+    if not command_line:
+        # no decompressor on the PATH: the Python module decompresses in the child process
+        if suffix == ".zst" and importlib.util.find_spec("zstandard") is None:
+            pytest.skip("zstandard is not installed")
+        monkeypatch.setattr(xdatcar.shutil, "which", lambda command: None)
+    elif not any(shutil.which(command[0]) for command in xdatcar.DECOMPRESSORS[suffix]):
+        pytest.skip("no decompressor for {} on the PATH".format(suffix))
+    os.remove(text)
+    assert xdatcar.FindTrajectory(text) == compressed
+
+    cells, positions = ReadAllFrames(filename, use_index=False)
+    assert xdatcar.CountFrames(compressed) == N_FRAMES
+    for use_index in (True, False):
+        compressed_cells, compressed_positions = ReadAllFrames(compressed, use_index=use_index)
+        np.testing.assert_array_equal(compressed_cells, cells)
+        np.testing.assert_array_equal(compressed_positions, positions)
+    # forward seeks in the stream
+    np.testing.assert_array_equal(ReadAllFrames(compressed, start=7, stop=30, step=5)[1], positions[7:30:5])
+
+
+def test_store_matches_text_trajectory(trajectory, tmp_path):
+    filename, _ = trajectory
+    text = str(tmp_path / "XDATCAR")
+    shutil.copy(filename, text)
+    store = xdatcar.ConvertToStore(text)
+    assert xdatcar.FindTrajectory(text) == store
+
+    cells, positions = ReadAllFrames(text)
+    store_cells, store_positions = ReadAllFrames(store)
+    np.testing.assert_array_equal(store_cells, cells)
+    np.testing.assert_allclose(store_positions, positions, rtol=0, atol=1e-7)      # float32
+    header, stored = xdatcar.ReadHeader(text), xdatcar.ReadStoreHeader(store)
+    assert stored["species"] == header["species"] and stored["counts"] == header["counts"]
+    assert xdatcar.CountFrames(store) == N_FRAMES
+    np.testing.assert_array_equal(stored["numbers"], xdatcar.FrameNumbers(text))
+    _, selected = ReadAllFrames(store, start=7, stop=30, step=5)
+    np.testing.assert_array_equal(selected, store_positions[7:30:5])
+
+
+def test_store_is_outdated_after_an_edit_in_the_middle(trajectory, tmp_path):
+    filename, _ = trajectory
+    text = str(tmp_path / "XDATCAR")
+    shutil.copy(filename, text)
+    store = xdatcar.ConvertToStore(text)
+    assert xdatcar.IsStoreCurrent(store)
+
+    # same size, same first and last 64 kB (PrefixHash), only the modification time tells
+    with open(text, "r+b") as f:
+        f.seek(os.path.getsize(text) // 2)
+        f.readline()
+        digit = f.tell() - 3
+        f.seek(digit)
+        f.write(b"0" if f.read(1) != b"0" else b"1")
+    stat = os.stat(text)
+    os.utime(text, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert xdatcar.PrefixHash(text, os.path.getsize(text)) == xdatcar.ReadStoreHeader(store)["source_hash"]
+    assert not xdatcar.IsStoreCurrent(store)
+    assert xdatcar.FindTrajectory(text) == text
@@ -0,0 +1,749 @@
+import numpy as np
+import density_grid
+
+# Tetrahedral site occupancies on a regular density grid.
+#
+# Instead of translating + wrapping the whole density for every anion site (and testing all points
+# against the tetrahedra again), every tetrahedron type is rasterized only once as a voxel mask
+# relative to a site. A mask is an (M, 3) array of integer grid offsets (dz, dy, dx) of all grid points
+# inside the (union of the) tetrahedra. The occupancy around a site is then the density summed over
+# the mask shifted to the grid point closest to the site, with periodic index wrapping.
+#
+# Grid convention: see density_grid.py, grid point (x, y, z) sits at x*a/bins_x + y*b/bins_y + z*c/bins_z.
+
+
+# Batched version of Tetrahedron() and pointInside() taken from https://stackoverflow.com/a/60745339:
+# a point p is inside if the coordinates inv(edges) @ (p - origin) are all >= 0 and sum up to <= 1.
+def CompileTetrahedra(tetra_lists):
+    """
+    Takes one or several lists of tetrahedra (each (T, 4, 3) Cartesian vertices)
+    and stacks the inverse matrices and origins of all tetrahedra (one np.linalg.inv call).
+    returns compiled tetrahedra as dictionary:
+        inverse -> (T, 3, 3), origin -> (T, 3), list_id -> (T,) index of the list each tetrahedron came from
+    """
+    if isinstance(tetra_lists, np.ndarray) and tetra_lists.ndim == 3:
+        tetra_lists = [tetra_lists]
+    vertices = np.concatenate([np.asarray(t, dtype=np.float64).reshape(-1, 4, 3) for t in tetra_lists])
+    list_id = np.concatenate([np.full(len(np.asarray(t).reshape(-1, 4, 3)), i) for i, t in enumerate(tetra_lists)])
+
+    origin = vertices[:, 0]
+    edges = np.transpose(vertices[:, 1:] - origin[:, None, :], (0, 2, 1))
+    return {"inverse": np.linalg.inv(edges),
+            "origin": origin,
+            "list_id": list_id}
+
+
+def AssignTetrahedra(points, compiled, max_elements=4*1024*1024, periodic=False):
+    """
+    Batched point-in-tetrahedron test of all points against all compiled tetrahedra.
+    Points are processed in chunks so that at most max_elements barycentric coordinates
+    are held in memory at once. With periodic, points and tetrahedra are in fractional coordinates
+    and every point is tested in its periodic image closest to the origin of each tetrahedron.
+    returns (N,) index of the (first) tetrahedron containing each point, -1 if none
+    """
+    points = np.atleast_2d(np.asarray(points, dtype=np.float64))
+    inverse, origin = compiled["inverse"], compiled["origin"]
+    N_tetra = len(origin)
+    chunk = max(1, max_elements // (3 * max(N_tetra, 1)))
+
+    result = np.full(len(points), -1, dtype=np.int64)
+    for first in range(0, len(points), chunk):
+        relative = points[first:first + chunk, None, :] - origin[None, :, :]       # (C, T, 3)
+        if periodic:
+            relative -= np.round(relative)
+        bary = np.einsum("tij,ctj->cti", inverse, relative)                          # (C, T, 3)
+        inside = (np.all(bary >= 0, axis=-1) & np.all(bary <= 1, axis=-1)
+                  & (np.sum(bary, axis=-1) <= 1))                                     # (C, T)
+        hit = inside.any(axis=1)
+        result[first:first + chunk][hit] = np.argmax(inside[hit], axis=1)
+    return result
+
+
+def RasterizeTetrahedra(tetra_list, centre, cell, shape):
+    """
+    Takes a list of tetrahedra (Cartesian vertices around the reference site at centre),
+    the cell (rows a, b, c) and the grid shape (bins_z, bins_y, bins_x).
+    Each tetrahedron is tested only against the grid points within its bounding box.
+    returns voxel mask: (M, 3) integer offsets (dz, dy, dx) of all grid points inside any of the tetrahedra
+    """
+    cell = np.asarray(cell, dtype=np.float64)
+    n = np.array(shape[::-1])                      # bins_x, bins_y, bins_z
+    relative = np.asarray(tetra_list, dtype=np.float64).reshape(-1, 4, 3) - centre
+    compiled = CompileTetrahedra(relative)
+    frac = relative @ np.linalg.inv(cell) * n      # vertices in units of grid steps
+
+    inside = []
+    for t, (lo, hi) in enumerate(zip(np.floor(frac.min(axis=1)).astype(int), np.ceil(frac.max(axis=1)).astype(int))):
+        ox, oy, oz = np.meshgrid(*[np.arange(l, h + 1) for l, h in zip(lo, hi)], indexing="ij")
+        offsets = np.column_stack((ox.ravel(), oy.ravel(), oz.ravel()))
+        single = {"inverse": compiled["inverse"][t:t+1], "origin": compiled["origin"][t:t+1]}
+        inside.append(offsets[AssignTetrahedra((offsets / n) @ cell, single) >= 0])
+
+    # Union of all tetrahedra; np.unique on flat indices is much faster than np.unique(axis=0)
+    inside = np.concatenate(inside)
+    lo = inside.min(axis=0)
+    dims = tuple(inside.max(axis=0) - lo + 1)
+    flat = np.unique(np.ravel_multi_index(tuple((inside - lo).T), dims))
+    dx, dy, dz = np.unravel_index(flat, dims) + lo[:, None]
+    return np.column_stack((dz, dy, dx))
+
+
+### Tetrahedron library ###############################################################################################
+#
+# Corners of the tetrahedral sites around a 4d (or 4a) site. They have been constructed via coordination polyhedra
+# (dummy atoms and bonds between them and the needed real atoms) in the ovito GUI and exported as vtk for the
+# reference cell below, with the site of interest shifted to the center of the box.
+# Only the fractional offsets from the site are used, so the tetrahedra follow the actual cell of the density. The
+# corners themselves can be taken from the structure file instead, see StructureTetrahedra below.
+#
+# Type 1: only around 4d sites
+# Type 2: between 4a and 4d sites
+# Type 3: only between PS4^3- units
+# Type 4: only around 4a sites
+# Type 5: between 4a and 4d sites
+REFERENCE_CELL   = np.diag([14.5458002090, 14.5458002090, 20.5708999634])
+REFERENCE_CENTRE = np.diag(REFERENCE_CELL) / 2
+
+tetra_list_4d_type1 = np.array([[[7.2729001045, 7.2729000523, 10.2854474863],
+                                 [8.9527950216, 10.9093501045, 11.6690458064],
+                                 [5.5930056529, 10.9093501045, 11.6690458064],
+                                 [7.2729001045, 9.2294556529, 14.0445731902]],
+                                [[7.2729001045, 7.2729000523, 10.2854474863],
+                                 [8.9527950216, 3.63645, 11.6690458064],
+                                 [5.5930056529, 3.63645, 11.6690458064],
+                                 [7.2729001045, 5.3163444516, 14.0445731902]],
+                                [[7.2729001045, 7.2729000523, 10.2854474863],
+                                 [10.9093503895, 5.5930054843, 8.9018486725],
+                                 [10.9093503895, 8.9527942566, 8.9018486725],
+                                 [9.2294549924, 7.2729000523, 6.5263210624]],
+                                [[7.2729001045, 7.2729000523, 10.2854474863],
+                                 [3.6364500523, 5.5930054843, 8.9018486725],
+                                 [3.6364500523, 8.9527942566, 8.9018486725],
+                                 [5.3163442566, 7.2729000523, 6.5263210624]]])
+
+tetra_list_4d_type2 = np.array([[[7.2729001045, 7.2729000523, 10.2854474863],
+                                 [10.9093503895, 7.2729000523, 12.8568099817],
+                                 [8.9527950216, 10.9093501045, 11.6690458064],
+                                 [7.2729001045, 9.2294556529, 14.0445731902]],
+                                [[7.2729001045, 7.2729000523, 10.2854474863],
+                                 [10.9093503895, 7.2729000523, 12.8568099817],
+                                 [8.9527950216, 3.63645, 11.6690458064],
+                                 [7.2729001045, 5.3163444516, 14.0445731902]],
+                                [[7.2729001045, 7.2729000523, 10.2854474863],
+                                 [10.9093503895, 7.2729000523, 12.8568099817],
+                                 [10.9093503895, 5.5930054843, 8.9018486725],
+                                 [10.9093503895, 8.9527942566, 8.9018486725]],
+                                [[7.2729001045, 7.2729000523, 10.2854474863],
+                                 [3.6364500523, 7.2729000523, 12.8568099817],
+                                 [5.5930056529, 10.9093501045, 11.6690458064],
+                                 [7.2729001045, 9.2294556529, 14.0445731902]],
+                                [[7.2729001045, 7.2729000523, 10.2854474863],
+                                 [3.6364500523, 7.2729000523, 12.8568099817],
+                                 [5.5930056529, 3.63645, 11.6690458064],
+                                 [7.2729001045, 5.3163444516, 14.0445731902]],
+                                [[7.2729001045, 7.2729000523, 10.2854474863],
+                                 [3.6364500523, 7.2729000523, 12.8568099817],
+                                 [3.6364500523, 5.5930054843, 8.9018486725],
+                                 [3.6364500523, 8.9527942566, 8.9018486725]],
+                                [[7.2729001045, 7.2729000523, 10.2854474863],
+                                 [7.2729001045, 10.9093501045, 7.7140849909],
+                                 [10.9093503895, 8.9527942566, 8.9018486725],
+                                 [9.2294549924, 7.2729000523, 6.5263210624]],
+                                [[7.2729001045, 7.2729000523, 10.2854474863],
+                                 [7.2729001045, 10.9093501045, 7.7140849909],
+                                 [3.6364500523, 8.9527942566, 8.9018486725],
+                                 [5.3163442566, 7.2729000523, 6.5263210624]],
+                                [[7.2729001045, 7.2729000523, 10.2854474863],
+                                 [7.2729001045, 10.9093501045, 7.7140849909],
+                                 [8.9527950216, 10.9093501045, 11.6690458064],
+                                 [5.5930056529, 10.9093501045, 11.6690458064]],
+                                [[7.2729001045, 7.2729000523, 10.2854474863],
+                                 [7.2729001045, 3.63645, 7.7140849909],
+                                 [10.9093503895, 5.5930054843, 8.9018486725],
+                                 [9.2294549924, 7.2729000523, 6.5263210624]],
+                                [[7.2729001045, 7.2729000523, 10.2854474863],
+                                 [7.2729001045, 3.63645, 7.7140849909],
+                                 [3.6364500523, 5.5930054843, 8.9018486725],
+                                 [5.3163442566, 7.2729000523, 6.5263210624]],
+                                [[7.2729001045, 7.2729000523, 10.2854474863],
+                                 [7.2729001045, 3.63645, 7.7140849909],
+                                 [8.9527950216, 3.63645, 11.6690458064],
+                                 [5.5930056529, 3.63645, 11.6690458064]]])
+
+tetra_list_4a_type2 = np.array([[[10.9093503895, 7.2729001045, 7.7140924954],
+                                 [7.2729001045, 7.2729001045, 10.2854549908],
+                                 [9.2294549924, 10.9093503895, 9.0976910624],
+                                 [10.9093503895, 9.2294549924, 11.4732186725]],
+                                [[10.9093503895, 7.2729001045, 7.7140924954],
+                                 [7.2729001045, 7.2729001045, 10.2854549908],
+                                 [9.2294549924, 3.6364500523, 9.0976910624],
+                                 [10.9093503895, 5.3163442566, 11.4732186725]],
+                                [[3.6364500523, 7.2729001045, 7.7140924954],
+                                 [7.2729001045, 7.2729001045, 10.2854549908],
+                                 [5.3163442566, 10.9093503895, 9.0976910624],
+                                 [3.6364500523, 9.2294549924, 11.4732186725]],
+                                [[3.6364500523, 7.2729001045, 7.7140924954],
+                                 [7.2729001045, 7.2729001045, 10.2854549908],
+                                 [5.3163442566, 3.6364500523, 9.0976910624],
+                                 [3.6364500523, 5.3163442566, 11.4732186725]],
+                                [[10.9093503895, 7.2729001045, 7.7140924954],
+                                 [7.2729001045, 7.2729001045, 10.2854549908],
+                                 [7.2729001045, 8.9527950216, 6.3304936816],
+                                 [7.2729001045, 5.5930056529, 6.3304936816]],
+                                [[3.6364500523, 7.2729001045, 7.7140924954],
+                                 [7.2729001045, 7.2729001045, 10.2854549908],
+                                 [7.2729001045, 8.9527950216, 6.3304936816],
+                                 [7.2729001045, 5.5930056529, 6.3304936816]],
+                                [[7.2729001045, 10.9093503895, 12.8568174863],
+                                 [7.2729001045, 7.2729001045, 10.2854549908],
+                                 [10.9093503895, 9.2294549924, 11.4732186725],
+                                 [9.2294549924, 10.9093503895, 9.0976910624]],
+                                [[7.2729001045, 3.6364500523, 12.8568174863],
+                                 [7.2729001045, 7.2729001045, 10.2854549908],
+                                 [10.9093503895, 5.3163442566, 11.4732186725],
+                                 [9.2294549924, 3.6364500523, 9.0976910624]],
+                                [[7.2729001045, 10.9093503895, 12.8568174863],
+                                 [7.2729001045, 7.2729001045, 10.2854549908],
+                                 [3.6364500523, 9.2294549924, 11.4732186725],
+                                 [5.3163442566, 10.9093503895, 9.0976910624]],
+                                [[7.2729001045, 3.6364500523, 12.8568174863],
+                                 [7.2729001045, 7.2729001045, 10.2854549908],
+                                 [3.6364500523, 5.3163442566, 11.4732186725],
+                                 [5.3163442566, 3.6364500523, 9.0976910624]],
+                                [[7.2729001045, 10.9093503895, 12.8568174863],
+                                 [7.2729001045, 7.2729001045, 10.2854549908],
+                                 [8.9527950216, 7.2729001045, 14.2404158064],
+                                 [5.5930056529, 7.2729001045, 14.2404158064]],
+                                [[7.2729001045, 3.6364500523, 12.8568174863],
+                                 [7.2729001045, 7.2729001045, 10.2854549908],
+                                 [8.9527950216, 7.2729001045, 14.2404158064],
+                                 [5.5930056529, 7.2729001045, 14.2404158064]]])
+
+tetra_list_4d_type3 = np.array([[[5.3163442566, 7.2729000523, 16.8117717641],
+                                 [7.2729001045, 5.3163444516, 14.0445731902],
+                                 [7.2729001045, 9.2294556529, 14.0445731902],
+                                 [9.2294549924, 7.2729000523, 16.8117717641]]])
+
+tetra_list_4d_type4 = np.array([[[9.2294549924, 7.2729000523, 16.8117717641],
+                                 [10.9093503895, 7.2729000523, 12.8568099817],
+                                 [7.2729001045, 5.3163444516, 14.0445731902],
+                                 [7.2729001045, 9.2294556529, 14.0445731902]],
+                                [[5.3163442566, 7.2729000523, 16.8117717641],
+                                 [3.6364500523, 7.2729000523, 12.8568099817],
+                                 [7.2729001045, 5.3163444516, 14.0445731902],
+                                 [7.2729001045, 9.2294556529, 14.0445731902]],
+                                [[5.3163442566, 7.2729000523, 6.5263210624],
+                                 [7.2729001045, 10.9093501045, 7.7140849909],
+                                 [7.2729001045, 9.2294556529, 3.7591236816],
+                                 [9.2294549924, 7.2729000523, 6.5263210624]],
+                                [[5.3163442566, 7.2729000523, 6.5263210624],
+                                 [7.2729001045, 3.63645, 7.7140849909],
+                                 [7.2729001045, 5.3163444516, 3.7591236816],
+                                 [9.2294549924, 7.2729000523, 6.5263210624]]])
+
+tetra_list_4a_type4 = np.array([[[10.9093503895, 9.2294549924, 11.4732186725],
+                                 [7.2729001045, 7.2729001045, 10.2854549908],
+                                 [8.9527950216, 7.2729001045, 14.2404158064],
+                                 [10.9093503895, 5.3163442566, 11.4732186725]],
+                                [[3.6364500523, 5.3163442566, 11.4732186725],
+                                 [7.2729001045, 7.2729001045, 10.2854549908],
+                                 [5.5930056529, 7.2729001045, 14.2404158064],
+                                 [3.6364500523, 9.2294549924, 11.4732186725]],
+                                [[9.2294549924, 10.9093503895, 9.0976910624],
+                                 [7.2729001045, 7.2729001045, 10.2854549908],
+                                 [7.2729001045, 8.9527950216, 6.3304936816],
+                                 [5.3163442566, 10.9093503895, 9.0976910624]],
+                                [[5.3163442566, 3.6364500523, 9.0976910624],
+                                 [7.2729001045, 7.2729001045, 10.2854549908],
+                                 [7.2729001045, 5.5930056529, 6.3304936816],
+                                 [9.2294549924, 3.6364500523, 9.0976910624]]])
+
+tetra_list_4d_type5 = np.array([[[7.2729001045, 7.2729000523, 10.2854474863],
+                                 [10.9093503895, 7.2729000523, 12.8568099817],
+                                 [7.2729001045, 5.3163444516, 14.0445731902],
+                                 [7.2729001045, 9.2294556529, 14.0445731902]],
+                                [[7.2729001045, 7.2729000523, 10.2854474863],
+                                 [3.6364500523, 7.2729000523, 12.8568099817],
+                                 [7.2729001045, 5.3163444516, 14.0445731902],
+                                 [7.2729001045, 9.2294556529, 14.0445731902]],
+                                [[7.2729001045, 7.2729000523, 10.2854474863],
+                                 [7.2729001045, 10.9093501045, 7.7140849909],
+                                 [5.3163442566, 7.2729000523, 6.5263210624],
+                                 [9.2294549924, 7.2729000523, 6.5263210624]],
+                                [[7.2729001045, 7.2729000523, 10.2854474863],
+                                 [7.2729001045, 3.63645, 7.7140849909],
+                                 [5.3163442566, 7.2729000523, 6.5263210624],
+                                 [9.2294549924, 7.2729000523, 6.5263210624]],
+                                [[7.2729001045, 7.2729000523, 10.2854474863],
+                                 [10.9093503895, 7.2729000523, 12.8568099817],
+                                 [10.9093503895, 5.5930054843, 8.9018486725],
+                                 [8.9527950216, 3.63645, 11.6690458064]],
+                                [[7.2729001045, 7.2729000523, 10.2854474863],
+                                 [7.2729001045, 3.63645, 7.7140849909],
+                                 [8.9527950216, 3.63645, 11.6690458064],
+                                 [10.9093503895, 5.5930054843, 8.9018486725]],
+                                [[7.2729001045, 7.2729000523, 10.2854474863],
+                                 [10.9093503895, 7.2729000523, 12.8568099817],
+                                 [10.9093503895, 8.9527942566, 8.9018486725],
+                                 [8.9527950216, 10.9093501045, 11.6690458064]],
+                                [[7.2729001045, 7.2729000523, 10.2854474863],
+                                 [7.2729001045, 10.9093501045, 7.7140849909],
+                                 [8.9527950216, 10.9093501045, 11.6690458064],
+                                 [10.9093503895, 8.9527942566, 8.9018486725]],
+                                [[7.2729001045, 7.2729000523, 10.2854474863],
+                                 [3.6364500523, 7.2729000523, 12.8568099817],
+                                 [3.6364500523, 5.5930054843, 8.9018486725],
+                                 [5.5930056529, 3.63645, 11.6690458064]],
+                                [[7.2729001045, 7.2729000523, 10.2854474863],
+                                 [7.2729001045, 3.63645, 7.7140849909],
+                                 [5.5930056529, 3.63645, 11.6690458064],
+                                 [3.6364500523, 5.5930054843, 8.9018486725]],
+                                [[7.2729001045, 7.2729000523, 10.2854474863],
+                                 [3.6364500523, 7.2729000523, 12.8568099817],
+                                 [3.6364500523, 8.9527942566, 8.9018486725],
+                                 [5.5930056529, 10.9093501045, 11.6690458064]],
+                                [[7.2729001045, 7.2729000523, 10.2854474863],
+                                 [7.2729001045, 10.9093501045, 7.7140849909],
+                                 [5.5930056529, 10.9093501045, 11.6690458064],
+                                 [3.6364500523, 8.9527942566, 8.9018486725]]])
+
+tetra_list_4a_type5 = np.array([[[7.2729001045, 10.9093503895, 12.8568174863],
+                                 [7.2729001045, 7.2729001045, 10.2854549908],
+                                 [8.9527950216, 7.2729001045, 14.2404158064],
+                                 [10.9093503895, 9.2294549924, 11.4732186725]],
+                                [[7.2729001045, 10.9093503895, 12.8568174863],
+                                 [7.2729001045, 7.2729001045, 10.2854549908],
+                                 [5.5930056529, 7.2729001045, 14.2404158064],
+                                 [3.6364500523, 9.2294549924, 11.4732186725]],
+                                [[7.2729001045, 3.6364500523, 12.8568174863],
+                                 [7.2729001045, 7.2729001045, 10.2854549908],
+                                 [8.9527950216, 7.2729001045, 14.2404158064],
+                                 [10.9093503895, 5.3163442566, 11.4732186725]],
+                                [[7.2729001045, 3.6364500523, 12.8568174863],
+                                 [7.2729001045, 7.2729001045, 10.2854549908],
+                                 [5.5930056529, 7.2729001045, 14.2404158064],
+                                 [3.6364500523, 5.3163442566, 11.4732186725]],
+                                [[10.9093503895, 7.2729001045, 7.7140924954],
+                                 [7.2729001045, 7.2729001045, 10.2854549908],
+                                 [7.2729001045, 8.9527950216, 6.3304936816],
+                                 [9.2294549924, 10.9093503895, 9.0976910624]],
+                                [[3.6364500523, 7.2729001045, 7.7140924954],
+                                 [7.2729001045, 7.2729001045, 10.2854549908],
+                                 [7.2729001045, 8.9527950216, 6.3304936816],
+                                 [5.3163442566, 10.9093503895, 9.0976910624]],
+                                [[10.9093503895, 7.2729001045, 7.7140924954],
+                                 [7.2729001045, 7.2729001045, 10.2854549908],
+                                 [7.2729001045, 5.5930056529, 6.3304936816],
+                                 [9.2294549924, 3.6364500523, 9.0976910624]],
+                                [[3.6364500523, 7.2729001045, 7.7140924954],
+                                 [7.2729001045, 7.2729001045, 10.2854549908],
+                                 [7.2729001045, 5.5930056529, 6.3304936816],
+                                 [5.3163442566, 3.6364500523, 9.0976910624]],
+                                [[10.9093503895, 7.2729001045, 7.7140924954],
+                                 [7.2729001045, 7.2729001045, 10.2854549908],
+                                 [10.9093503895, 5.3163442566, 11.4732186725],
+                                 [10.9093503895, 9.2294549924, 11.4732186725]],
+                                [[3.6364500523, 7.2729001045, 7.7140924954],
+                                 [7.2729001045, 7.2729001045, 10.2854549908],
+                                 [3.6364500523, 5.3163442566, 11.4732186725],
+                                 [3.6364500523, 9.2294549924, 11.4732186725]],
+                                [[7.2729001045, 10.9093503895, 12.8568174863],
+                                 [7.2729001045, 7.2729001045, 10.2854549908],
+                                 [5.3163442566, 10.9093503895, 9.0976910624],
+                                 [9.2294549924, 10.9093503895, 9.0976910624]],
+                                [[7.2729001045, 3.6364500523, 12.8568174863],
+                                 [7.2729001045, 7.2729001045, 10.2854549908],
+                                 [5.3163442566, 3.6364500523, 9.0976910624],
+                                 [9.2294549924, 3.6364500523, 9.0976910624]]])
+
+TETRA_TYPES = {"4d_type1": tetra_list_4d_type1,
+               "4d_type2": tetra_list_4d_type2,
+               "4d_type3": tetra_list_4d_type3,
+               "4d_type4": tetra_list_4d_type4,
+               "4d_type5": tetra_list_4d_type5,
+               "4a_type2": tetra_list_4a_type2,
+               "4a_type4": tetra_list_4a_type4,
+               "4a_type5": tetra_list_4a_type5}
+
+# Fractional offsets of the corners from the site, (T, 4, 3) per type
+TETRA_FRACTIONAL = {name: (tetra_list - REFERENCE_CENTRE) @ np.linalg.inv(REFERENCE_CELL)
+                    for name, tetra_list in TETRA_TYPES.items()}
+
+# Which tetrahedron types are evaluated around which site (index 0..4 -> type 1..5).
+# Type 3 is evaluated based on the 4d sites only, type 4 is not around the 4d site and type 1 not around the 4a site.
+TYPES_4D = ["4d_type1", "4d_type2", "4d_type3", None, "4d_type5"]
+TYPES_4A = [None, "4a_type2", None, "4a_type4", "4a_type5"]
+
+# The library corners are the anion/P positions of the ideal structure. StructureTetrahedra takes the topology
+# (which atoms span a tetrahedron) from the library and the positions from the structure file: every corner is moved
+# to the closest non-Li atom, and the corners are averaged over all sites of the class (4d or 4a), so one geometry
+# per type remains and the masks/weight tables stay shared. The remaining assumption is that the tetrahedra around
+# all sites of a class are the same up to the cell, i.e. the density cell is an affine image of the structure.
+# If the structure reproduces the library within match (Angstrom, e.g. the ideal POSCARs up to the 6 printed
+# digits) the library itself is used, so that grid points lying exactly on a face are assigned as before.
+CLASSES_4D = ("S_on_4d", "Br_on_4d")
+CLASSES_4A = ("S_on_4a", "Br_on_4a")
+
+
+def StructureTetrahedra(cell, positions, species, sites, mobile=("Li",), tolerance=1.0, match=0.01):
+    """
+    Takes the cell, fractional positions and species of the structure, its classification
+    (anion_sites.ClassifyAnionSites), the mobile species (not used as corners) and the largest allowed distance in
+    Angstrom between a library corner and the closest framework atom
+    returns ({type: (T, 4, 3) fractional offsets of the corners from the site} (TETRA_FRACTIONAL if the structure
+    matches it), largest deviation of the averaged corners from the library in Angstrom)
+    """
+    cell = np.asarray(cell, dtype=np.float64)
+    inv_cell = np.linalg.inv(cell)
+    framework = np.asarray(positions, dtype=np.float64)[~np.isin(species, mobile)]
+
+    fractional, deviation = {}, 0.0
+    for name, offsets in TETRA_FRACTIONAL.items():
+        keys = CLASSES_4D if name.startswith("4d") else CLASSES_4A
+        site_frac = np.concatenate([np.asarray(sites[key], dtype=np.float64).reshape(-1, 3) for key in keys]) @ inv_cell
+        if len(site_frac) == 0:
+            fractional[name] = offsets
+            continue
+        corners = site_frac[:, None, :] + offsets.reshape(1, -1, 3)                  # (N_sites, T*4, 3)
+        delta = framework[None, None, :, :] - corners[:, :, None, :]                # (N_sites, T*4, N_framework, 3)
+        delta -= np.round(delta)
+        distance = np.linalg.norm(delta @ cell, axis=-1)
+        closest = np.argmin(distance, axis=-1)
+        snap = np.take_along_axis(distance, closest[..., None], axis=-1)[..., 0]
+        if snap.max() > tolerance:
+            raise ValueError("A corner of {} is {:.2f} A away from the closest framework atom (tolerance {} A)"
+                             .format(name, snap.max(), tolerance))
+        shift = np.take_along_axis(delta, closest[..., None, None], axis=2)[:, :, 0, :].mean(axis=0)
+        fractional[name] = offsets + shift.reshape(offsets.shape)
+        deviation = max(deviation, np.linalg.norm(shift @ cell, axis=-1).max())
+
+    if deviation <= match:
+        return TETRA_FRACTIONAL, deviation
+    return fractional, deviation
+
+
+_LIBRARY_CACHE = {}
+
+
+def _FractionalKey(fractional):
+    """
+    Takes fractional tetrahedra (TETRA_FRACTIONAL or StructureTetrahedra)
+    returns bytes identifying them in the caches
+    """
+    return b"".join(name.encode() + np.round(fractional[name], 9).tobytes() for name in sorted(fractional))
+
+
+def TetrahedronLibrary(cell, shape=None, fractional=None):
+    """
+    Takes the cell (rows a, b, c), optionally the grid shape (bins_z, bins_y, bins_x) and the fractional tetrahedra
+    (default TETRA_FRACTIONAL, see StructureTetrahedra).
+    Scales all tetrahedron types to the cell, compiles them and (with shape) rasterizes the voxel masks.
+    The result is cached per cell and grid shape, so a sweep over many structures pays the geometry cost
+    only once per unique cell.
+    returns dictionary with
+        relative -> {type: (T, 4, 3) Cartesian corners relative to the site}
+        compiled -> {type: compiled tetrahedra (CompileTetrahedra)}
+        masks    -> {type: voxel mask (RasterizeTetrahedra)} (only if shape is given)
+    """
+    fractional = TETRA_FRACTIONAL if fractional is None else fractional
+    cell = np.asarray(cell, dtype=np.float64)
+    key = (np.round(cell, 6).tobytes(), _FractionalKey(fractional), None if shape is None else tuple(int(n) for n in shape))
+    if key in _LIBRARY_CACHE:
+        return _LIBRARY_CACHE[key]
+
+    geometry_key = key[:2] + (None,)
+    if geometry_key in _LIBRARY_CACHE:
+        library = dict(_LIBRARY_CACHE[geometry_key])
+    else:
+        relative = {name: frac @ cell for name, frac in fractional.items()}
+        library = {"relative": relative,
+                   "compiled": {name: CompileTetrahedra(corners) for name, corners in relative.items()}}
+        _LIBRARY_CACHE[geometry_key] = library
+
+    if shape is not None:
+        library = dict(library)
+        library["masks"] = {name: RasterizeTetrahedra(corners, np.zeros(3), cell, shape)
+                            for name, corners in library["relative"].items()}
+        _LIBRARY_CACHE[key] = library
+    return library
+
+
+def SiteVoxels(positions, cell, shape):
+    """
+    Takes Cartesian site positions, the cell (rows a, b, c) and the grid shape
+    returns (N_sites, 3) grid indices (z, y, x) of the grid point closest to every site
+    """
+    frac = np.atleast_2d(positions) @ np.linalg.inv(cell)
+    index = np.rint(frac * np.array(shape[::-1])).astype(int)
+    return index[:, ::-1] % np.array(shape)
+
+
+def SumMaskAroundSites(grid, sites, mask):
+    """
+    Takes the density (dense grid with shape (bins_z, bins_y, bins_x) or sparse grid, see density_grid.py),
+    site grid indices (SiteVoxels) and a voxel mask
+    returns the density inside the mask summed over all sites
+    """
+    if len(sites) == 0:
+        return 0.0
+    sparse = isinstance(grid, dict)
+    shape = np.array(grid["shape"] if sparse else grid.shape)
+    flat = None if sparse else np.asarray(grid).ravel()
+    total = 0.0
+    for site in sites:
+        z, y, x = ((site + mask) % shape).T
+        indices = (z * shape[1] + y) * shape[2] + x
+        total += np.sum(density_grid.SparseValuesAt(grid, indices) if sparse else flat[indices])
+    return total
+
+
+### Exact partial volume weights ######################################################################################
+#
+# The voxel masks count a voxel fully or not at all, depending on whether its grid point lies inside a tetrahedron.
+# Voxels cut by a face are the numerical noise that makes fine grids necessary. Instead, for every tetrahedron type
+# a weight table holds the exact fraction of the volume of every voxel it touches that lies inside the tetrahedra,
+# and the occupancy is the weighted sum of the density over this sparse list.
+#
+# Everything is done in grid units (fractional coordinates times the number of bins): the map to Cartesian space is
+# linear, so volume fractions do not depend on the cell. Voxels completely inside (all 8 corners inside) get weight 1,
+# voxels completely on the outer side of a face are skipped; every remaining voxel (6 tetrahedra) is clipped exactly
+# against the face planes of the tetrahedron (a clip of a tetrahedron by a plane leaves a tetrahedron or a prism =
+# 3 tetrahedra) and the volumes of the pieces are summed. The tetrahedra of one type do not overlap, so their weights add up.
+#
+# Which volume belongs to a grid point depends on how the density was deposited (density_grid.VOXEL_ORIGIN):
+# hits counted per voxel (ngp) belong to [x, x+1) / bins_x, kernel weights to [x-1/2, x+1/2) / bins_x.
+# The tables are placed at the sites (not snapped to the closest grid point) and cached per sub-voxel offset. The offset
+# is rounded to WEIGHT_SHIFT_STEP voxels, so equivalent sites share their table although the cells of POSCAR and XDATCAR
+# differ in the last digits (the weights move by less than half a step, far below the voxel noise they remove).
+
+WEIGHT_SHIFT_STEP = 1e-3       # grid units
+MAX_WEIGHT_TABLES = 1024       # the oldest tables are dropped beyond this (distorted structures have few equivalent sites)
+_WEIGHT_CACHE = {}
+
+
+def TetrahedraVolumes(tetrahedra):
+    """
+    returns the volumes of (T, 4, 3) tetrahedra
+    """
+    edges = tetrahedra[:, 1:] - tetrahedra[:, :1]
+    return np.abs(np.linalg.det(edges)) / 6
+
+
+def _Prisms(P0, P1, P2, Q0, Q1, Q2):
+    """
+    returns the 3 tetrahedra of the prisms with the triangles (P0, P1, P2), (Q0, Q1, Q2) and lateral edges Pi-Qi
+    """
+    return np.concatenate([np.stack(corners, axis=1) for corners in ((P0, P1, P2, Q2), (P0, P1, Q1, Q2), (P0, Q0, Q1, Q2))])
+
+
+def ClipTetrahedra(tetrahedra, owner, normal, offset):
+    """
+    Takes (T, 4, 3) tetrahedra, (T,) the voxel each belongs to and one half space normal . p <= offset per tetrahedron
+    ((T, 3) normals, (T,) offsets)
+    returns the parts of the tetrahedra inside their half space as tetrahedra and their owners
+    """
+    distance = np.einsum("tvi,ti->tv", tetrahedra, normal) - offset[:, None]
+    inside = distance <= 0
+    N_inside = inside.sum(axis=1)
+    pieces, owners = [tetrahedra[N_inside == 4]], [owner[N_inside == 4]]
+
+    for N in (1, 2, 3):
+        rows = N_inside == N
+        if not rows.any():
+            continue
+        # inside corners first
+        order = np.argsort(~inside[rows], axis=1, kind="stable")
+        v = np.take_along_axis(tetrahedra[rows], order[:, :, None], axis=1)
+        d = np.take_along_axis(distance[rows], order, axis=1)
+
+        def Cut(i, j):
+            t = d[:, i] / (d[:, i] - d[:, j])
+            return v[:, i] + t[:, None] * (v[:, j] - v[:, i])
+
+        if N == 1:
+            pieces.append(np.stack((v[:, 0], Cut(0, 1), Cut(0, 2), Cut(0, 3)), axis=1))
+            owners.append(owner[rows])
+        elif N == 2:
+            pieces.append(_Prisms(v[:, 0], Cut(0, 2), Cut(0, 3), v[:, 1], Cut(1, 2), Cut(1, 3)))
+            owners.append(np.tile(owner[rows], 3))
+        else:
+            pieces.append(_Prisms(v[:, 0], v[:, 1], v[:, 2], Cut(0, 3), Cut(1, 3), Cut(2, 3)))
+            owners.append(np.tile(owner[rows], 3))
+    return np.concatenate(pieces), np.concatenate(owners)
+
+
+# Unit cube as 6 tetrahedra around its main diagonal (one per permutation of the axes)
+_UNIT_CUBE = np.array([[[0, 0, 0], np.eye(3)[p[0]], np.eye(3)[p[0]] + np.eye(3)[p[1]], [1, 1, 1]]
+                       for p in ((0, 1, 2), (0, 2, 1), (1, 0, 2), (1, 2, 0), (2, 0, 1), (2, 1, 0))], dtype=np.float64)
+
+
+def VoxelWeights(tetra_grid, voxel_origin=0.0):
+    """
+    Takes tetrahedra in grid units ((T, 4, 3), x, y, z in units of the grid steps, relative to the grid point of the
+    site) and the start of the voxel of a grid point (0 -> [x, x+1), -0.5 -> [x-1/2, x+1/2))
+    returns weight table: (M, 3) integer offsets (dz, dy, dx) of all voxels touched and (M,) volume fraction inside
+    """
+    tetra_grid = np.asarray(tetra_grid, dtype=np.float64).reshape(-1, 4, 3) - voxel_origin
+    corners = np.array([[i, j, k] for i in (0, 1) for j in (0, 1) for k in (0, 1)], dtype=np.float64)
+    faces = np.array([[j for j in range(4) if j != i] for i in range(4)])
+
+    full_voxels, cut_voxels, cut_normals, cut_offsets = [], [], [], []
+    for vertices in tetra_grid:
+        lo, hi = np.floor(vertices.min(axis=0)).astype(int), np.floor(vertices.max(axis=0)).astype(int)
+        ox, oy, oz = np.meshgrid(*[np.arange(l, h + 1) for l, h in zip(lo, hi)], indexing="ij")
+        voxels = np.column_stack((ox.ravel(), oy.ravel(), oz.ravel()))
+
+        # outward face planes normal . p <= offset (face i is opposite to vertex i)
+        normal = np.cross(vertices[faces[:, 1]] - vertices[faces[:, 0]], vertices[faces[:, 2]] - vertices[faces[:, 0]])
+        normal *= np.sign(np.sum(normal * (vertices[faces[:, 0]] - vertices), axis=1))[:, None]
+        offset = np.sum(normal * vertices[faces[:, 0]], axis=1)
+        side = (voxels[:, None, :] + corners[None, :, :]) @ normal.T - offset      # (V, 8, 4)
+        full = np.all(side <= 0, axis=(1, 2))
+        cut = ~full & ~np.any(np.all(side > 0, axis=1), axis=1)
+
+        full_voxels.append(voxels[full])
+        cut_voxels.append(voxels[cut])
+        cut_normals.append(np.repeat(normal[None], np.count_nonzero(cut), axis=0))
+        cut_offsets.append(offset[None, :] - voxels[cut] @ normal.T)               # planes relative to the voxel corner
+
+    # exact clipping of the voxels that are cut by a face against the 4 face planes (all tetrahedra at once)
+    normals, offsets = np.concatenate(cut_normals), np.concatenate(cut_offsets)
+    N_cut = len(normals)
+    pieces = np.tile(_UNIT_CUBE, (N_cut, 1, 1))
+    owner = np.repeat(np.arange(N_cut), len(_UNIT_CUBE))
+    for face in range(4):
+        pieces, owner = ClipTetrahedra(pieces, owner, normals[owner, face], offsets[owner, face])
+    fraction = np.bincount(owner, weights=TetrahedraVolumes(pieces), minlength=N_cut)
+
+    # sum over the tetrahedra of the type (flat indices, much faster than np.unique(axis=0))
+    offsets = np.concatenate(full_voxels + cut_voxels)
+    weights = np.concatenate([np.ones(len(offsets) - N_cut), fraction])
+    lo = offsets.min(axis=0)
+    dims = tuple(offsets.max(axis=0) - lo + 1)
+    flat, inverse = np.unique(np.ravel_multi_index(tuple((offsets - lo).T), dims), return_inverse=True)
+    weights = np.bincount(inverse, weights=weights)
+    keep = weights > 0
+    dx, dy, dz = np.unravel_index(flat[keep], dims) + lo[:, None]
+    return np.column_stack((dz, dy, dx)), weights[keep]
+
+
+def WeightTable(name, shape, shift=(0.0, 0.0, 0.0), voxel_origin=0.0, fractional=None):
+    """
+    Takes a tetrahedron type, the grid shape, the position of the site relative to its closest
+    grid point in grid units (x, y, z), the voxel origin (see VoxelWeights) and the fractional tetrahedra
+    (default TETRA_FRACTIONAL, see StructureTetrahedra)
+    returns the weight table (cached per shift rounded to WEIGHT_SHIFT_STEP)
+    """
+    fractional = TETRA_FRACTIONAL if fractional is None else fractional
+    # + 0.0 turns -0.0 into 0.0, which differs in the bytes of the key
+    shift = np.round(np.asarray(shift, dtype=np.float64) / WEIGHT_SHIFT_STEP) * WEIGHT_SHIFT_STEP + 0.0
+    key = (name, np.round(fractional[name], 9).tobytes(), tuple(int(n) for n in shape), shift.tobytes(), float(voxel_origin))
+    if key not in _WEIGHT_CACHE:
+        if len(_WEIGHT_CACHE) >= MAX_WEIGHT_TABLES:
+            del _WEIGHT_CACHE[next(iter(_WEIGHT_CACHE))]
+        _WEIGHT_CACHE[key] = VoxelWeights(fractional[name] * np.array(shape[::-1]) + shift, voxel_origin)
+    return _WEIGHT_CACHE[key]
+
+
+def SiteGridOffsets(positions, cell, shape):
+    """
+    Takes Cartesian site positions, the cell (rows a, b, c) and the grid shape
+    returns (N_sites, 3) grid indices (z, y, x) of the closest grid points (as SiteVoxels) and
+    (N_sites, 3) positions of the sites relative to them in grid units (x, y, z)
+    """
+    u = np.atleast_2d(positions) @ np.linalg.inv(cell) * np.array(shape[::-1])
+    nearest = np.rint(u)
+    return nearest.astype(int)[:, ::-1] % np.array(shape), u - nearest
+
+
+def SumWeightsAroundSites(grid, positions, cell, name, voxel_origin=0.0, fractional=None):
+    """
+    Takes the density (dense or sparse grid, see density_grid.py), Cartesian site positions, the cell,
+    a tetrahedron type, the voxel origin of the density (density_grid.VOXEL_ORIGIN) and the fractional tetrahedra
+    (default TETRA_FRACTIONAL, see StructureTetrahedra)
+    returns the density inside the tetrahedra, weighted with the exact voxel fractions and summed over all sites
+    """
+    if len(positions) == 0:
+        return 0.0
+    sparse = isinstance(grid, dict)
+    shape = tuple(grid["shape"]) if sparse else grid.shape
+    flat = None if sparse else np.asarray(grid).ravel()
+    total = 0.0
+    for site, shift in zip(*SiteGridOffsets(positions, cell, shape)):
+        offsets, weights = WeightTable(name, shape, shift, voxel_origin, fractional)
+        z, y, x = ((site + offsets) % np.array(shape)).T
+        indices = (z * shape[1] + y) * shape[2] + x
+        total += np.dot(density_grid.SparseValuesAt(grid, indices) if sparse else flat[indices], weights)
+    return total
+
+
+### Point based evaluation with a periodic cell list ##################################################################
+#
+# Alternative to the voxel masks for density points that are not evaluated on the grid, e.g. to place the
+# tetrahedra exactly at the (not snapped) site positions. The points are sorted into a periodic cell list
+# in fractional coordinates. For every tetrahedron only the points in the cells overlapping its bounding box
+# are tested, so a query costs roughly O(points inside) instead of O(all points).
+
+def BuildCellList(points, cell, cell_size=1.0):
+    """
+    Takes Cartesian points, the cell (rows a, b, c) and the approximate edge length of a list cell in Angstrom
+    returns the cell list as dictionary (fractional coordinates, sorted point order, start of every list cell)
+    """
+    cell = np.asarray(cell, dtype=np.float64)
+    inv_cell = np.linalg.inv(cell)
+    frac = np.asarray(points, dtype=np.float64) @ inv_cell
+    frac -= np.floor(frac)
+
+    # Distance between opposite faces of the cell (works for triclinic cells as well)
+    widths = 1.0 / np.linalg.norm(inv_cell, axis=0)
+    n_cells = np.maximum(1, (widths / cell_size).astype(int))
+
+    index = np.minimum((frac * n_cells).astype(np.int64), n_cells - 1)
+    flat = (index[:, 2] * n_cells[1] + index[:, 1]) * n_cells[0] + index[:, 0]
+    order = np.argsort(flat, kind="stable")
+    starts = np.searchsorted(flat[order], np.arange(np.prod(n_cells) + 1))
+
+    return {"frac": frac, "cell": cell, "inv_cell": inv_cell,
+            "n_cells": n_cells, "order": order, "starts": starts}
+
+
+def CandidatesInBox(cell_list, frac_lo, frac_hi):
+    """
+    Takes a cell list and a box in fractional coordinates (may reach beyond [0, 1), periodic images are used)
+    returns indices of all points in the list cells overlapping the box
+    """
+    n_cells = cell_list["n_cells"]
+    ranges = []
+    for lo, hi, n in zip(frac_lo, frac_hi, n_cells):
+        first, last = int(np.floor(lo * n)), int(np.floor(hi * n))
+        ranges.append(np.unique(np.arange(first, min(last, first + n - 1) + 1) % n))
+    ix, iy, iz = np.meshgrid(*ranges, indexing="ij")
+    flat = ((iz * n_cells[1] + iy) * n_cells[0] + ix).ravel()
+
+    starts, order = cell_list["starts"], cell_list["order"]
+    return np.concatenate([order[starts[c]:starts[c + 1]] for c in flat])
+
+
+def SumDensityAroundSitesPoints(cell_list, values, tetra_relative, sites):
+    """
+    Takes a cell list of the density points, their density values, tetrahedra relative to a site
+    ((T, 4, 3) Cartesian, site at the origin) and Cartesian site positions.
+    The tetrahedra are placed exactly at every site (minimum image convention).
+    returns the density inside the (union of the) tetrahedra summed over all sites
+    """
+    cell, inv_cell = cell_list["cell"], cell_list["inv_cell"]
+    tetra_relative = np.asarray(tetra_relative, dtype=np.float64).reshape(-1, 4, 3)
+    compiled = CompileTetrahedra(tetra_relative)
+    frac_vertices = tetra_relative @ inv_cell
+
+    total = 0.0
+    for site in np.atleast_2d(sites) @ inv_cell:
+        selected = []
+        for t, vertices in enumerate(frac_vertices):
+            candidates = CandidatesInBox(cell_list, site + vertices.min(axis=0), site + vertices.max(axis=0))
+            relative = cell_list["frac"][candidates] - site
+            relative -= np.round(relative)
+            single = {"inverse": compiled["inverse"][t:t+1], "origin": compiled["origin"][t:t+1]}
+            selected.append(candidates[AssignTetrahedra(relative @ cell, single) >= 0])
+        total += np.sum(values[np.unique(np.concatenate(selected))])
+    return total
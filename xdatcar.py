@@ -0,0 +1,695 @@
+import hashlib
+import importlib.util
+import io
+import os
+import shutil
+import subprocess
+import sys
+import numpy as np
+
+# Pure NumPy reader for VASP XDATCAR trajectories. No OVITO needed.
+#
+# Frames are yielded as (cell, positions):
+#   cell      -> 3x3 array, rows are the lattice vectors a, b and c in Angstrom
+#                (note: OVITO's data.cell stores the lattice vectors as columns)
+#   positions -> (N_atoms, 3) array of fractional (direct) coordinates
+#
+# Supported layouts:
+#   - constant cell:      one header, then "Direct configuration=" blocks
+#   - variable cell:      a full header block in front of every configuration
+#   - concatenated runs:  several XDATCARs glued together (restarts, see README),
+#                         i.e. a new header whenever a restart segment begins
+# Only one frame is kept in memory at any time.
+#
+# Frame index:
+#   The first time a trajectory is opened, a sidecar file <XDATCAR>.index.npz is written that holds
+#   the byte offset and "Direct configuration=" number of every frame and all header blocks
+#   (cell changes between restart segments). Afterwards every frame can be reached with a single seek.
+#   The index is rebuilt automatically if size or modification time of the XDATCAR change. If frames have only been
+#   appended (restart segments, see README), only the new part of the file is scanned and added to the index.
+#
+# Compressed trajectories:
+#   XDATCAR.gz, .xz, .bz2 and .zst are read as a stream, no uncompressed copy is written. The decompression runs in a
+#   separate process (the frames are read from its pipe), so it runs on another core next to the parsing/binning.
+#   Where the format allows it a parallel decompressor is used if it is installed: pigz for gzip, xz -T0 for xz files
+#   with several blocks (written with xz -T), lbzip2/pbzip2 for bzip2, zstd. Otherwise gzip/bzip2 or the Python
+#   modules (gzip, lzma, bz2, zstandard if installed) decompress in the child process.
+#   A compressed stream can only be read forward: every frame is reached by decompressing (not parsing) everything in
+#   front of it, i.e. with several workers every shard decompresses the frames in front of its first frame.
+#   The frame index holds the offsets in the decompressed stream, while end/prefix hash are size and PrefixHash of the
+#   compressed file; after appending (e.g. cat run2.xz >> XDATCAR.xz) the whole file is scanned again.
+#
+# Binary trajectory store:
+#   "python xdatcar.py XDATCAR" converts a trajectory once into a .npy/.npz pair next to it (see ConvertToStore),
+#   e.g. XDATCAR.traj.npy + XDATCAR.traj.npz. The frames are then read from a memory map instead of being parsed
+#   again (see "Binary trajectory store" below).
+
+INDEX_SUFFIX  = ".index.npz"
+INDEX_VERSION = 2
+
+COMPRESSED_SUFFIXES = (".gz", ".xz", ".bz2", ".zst")
+# Command line decompressors per suffix (first one found on the PATH is used) and the Python module as fallback
+DECOMPRESSORS = {".gz":  [["pigz", "-dc"], ["gzip", "-dc"]],
+                 ".xz":  [["xz", "-dc", "-T0"]],
+                 ".bz2": [["lbzip2", "-dc"], ["pbzip2", "-dc"], ["bzip2", "-dc"]],
+                 ".zst": [["zstd", "-dc"]]}
+DECOMPRESSION_MODULES = {".gz": "gzip", ".xz": "lzma", ".bz2": "bz2", ".zst": "zstandard"}
+_PYTHON_DECOMPRESS = "import shutil, sys; shutil.copyfileobj(__import__(sys.argv[1]).open(sys.argv[2], 'rb'), sys.stdout.buffer, 1 << 20)"
+STREAM_BUFFER = 1 << 20
+
+
+def IsCompressed(filename):
+    """
+    returns the compression suffix of a trajectory (.gz, .xz, .bz2, .zst) or None
+    """
+    suffix = os.path.splitext(filename)[1].lower()
+    return suffix if suffix in COMPRESSED_SUFFIXES else None
+
+
+def FindTrajectory(filename):
+    """
+    Takes a trajectory name (e.g. XDATCAR)
+    returns the binary store of the trajectory (XDATCAR.traj.npy) if it is up to date, otherwise filename if it exists,
+    otherwise the first compressed version that exists (XDATCAR.gz, XDATCAR.xz, ...), otherwise filename
+    """
+    if IsStore(filename):
+        return filename
+    source = filename
+    if not os.path.exists(filename) and not IsCompressed(filename):
+        source = next((filename + suffix for suffix in COMPRESSED_SUFFIXES if os.path.exists(filename + suffix)), filename)
+
+    # a binary store converted from the trajectory (or a compressed version of it) is used instead,
+    # as long as the trajectory has not changed
+    store = StoreFile(source)
+    if os.path.exists(store) and os.path.exists(StoreHeaderFile(store)):
+        if IsStoreCurrent(store):
+            print("Reading the binary store {}".format(store))
+            return store
+        converted = ReadStoreHeader(store)["source"]
+        print("Warning: {} has changed since it was converted to {}, reading the text trajectory "
+              "(convert again with: python xdatcar.py {})".format(converted, store, converted))
+    return source
+
+
+def DecompressorCommand(filename):
+    """
+    returns the command line that writes the decompressed content of a compressed trajectory to stdout
+    """
+    suffix = IsCompressed(filename)
+    for command in DECOMPRESSORS[suffix]:
+        if shutil.which(command[0]):
+            return command + [filename]
+    module = DECOMPRESSION_MODULES[suffix]
+    if importlib.util.find_spec(module) is None:
+        raise RuntimeError("Cannot read {}: install {} or the Python package {}".format(
+                           filename, " or ".join(command[0] for command in DECOMPRESSORS[suffix]), module))
+    return [sys.executable, "-c", _PYTHON_DECOMPRESS, module, filename]
+
+
+class _PipeReader(io.RawIOBase):
+    """
+    Raw stream over the output of a decompressor process. Counts the position (tell), seeks only forward (by reading)
+    and raises if the decompressor fails.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.process = subprocess.Popen(DecompressorCommand(filename), stdin=subprocess.DEVNULL,
+                                        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        N = self.process.stdout.readinto(buffer)
+        if N == 0 and self.process.wait() != 0:
+            raise OSError("Decompression of {} failed: {}".format(self.filename, self.process.stderr.read().decode().strip()))
+        self.position += N
+        return N
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        if whence == io.SEEK_END or offset < self.position:
+            raise io.UnsupportedOperation("{} is compressed and can only be read forward".format(self.filename))
+        buffer = bytearray(min(offset - self.position, STREAM_BUFFER))
+        while self.position < offset:
+            if self.readinto(memoryview(buffer)[:min(len(buffer), offset - self.position)]) == 0:
+                break
+        return self.position
+
+    def close(self):
+        if not self.closed:
+            if self.process.poll() is None:
+                self.process.kill()     # not read to the end
+            self.process.wait()
+            self.process.stdout.close()
+            self.process.stderr.close()
+        super().close()
+
+
+def OpenTrajectory(filename):
+    """
+    Opens a trajectory for binary reading, compressed files are decompressed on the fly (see above)
+    returns file object (readline, read, tell, and seek; only forward for compressed files)
+    """
+    if IsCompressed(filename):
+        return io.BufferedReader(_PipeReader(filename), buffer_size=STREAM_BUFFER)
+    return open(filename, "rb")
+
+
+def _IsConfigurationLine(line):
+    """
+    Takes a raw (bytes) line of the XDATCAR
+    returns True if it starts a new configuration block
+    """
+    stripped = line.lstrip()
+    return stripped.startswith(b"Direct configuration") or stripped.startswith(b"Cartesian configuration")
+
+
+def _ConfigurationNumber(line):
+    """
+    Takes a "Direct configuration=     N" line
+    returns N (or -1 if no number is given)
+    """
+    try:
+        return int(line.split(b"=")[-1])
+    except ValueError:
+        return -1
+
+
+def _ParseHeader(f, first_line):
+    """
+    Parses a POSCAR-like header block. first_line (comment) has already been read.
+    returns dictionary with comment, cell (scaled), scale, species and counts
+    """
+    scale = float(f.readline().split()[0])
+    cell = np.array([f.readline().split()[:3] for _ in range(3)], dtype=np.float64)
+
+    words = f.readline().split()
+    try:
+        counts = [int(w) for w in words]
+        species = None        # VASP 4 style header without species line
+    except ValueError:
+        species = [w.decode() for w in words]
+        counts = [int(w) for w in f.readline().split()]
+
+    # Negative scaling factor means: target volume of the cell
+    if scale < 0.0:
+        scale = (-scale / abs(np.linalg.det(cell))) ** (1.0 / 3.0)
+    cell = cell * scale
+
+    return {"comment": first_line.decode().strip(),
+            "cell": cell,
+            "scale": scale,
+            "species": species,
+            "counts": counts}
+
+
+def ReadHeader(filename):
+    """
+    Reads only the first header block of an XDATCAR (or POSCAR, or the header of a trajectory store)
+    returns dictionary with comment, cell, species and counts
+    """
+    if IsStore(filename):
+        stored = ReadStoreHeader(filename)
+        return {"comment": stored["comment"], "cell": stored["cells"][0], "scale": 1.0,
+                "species": stored["species"], "counts": stored["counts"]}
+    with OpenTrajectory(filename) as f:
+        return _ParseHeader(f, f.readline())
+
+
+def SpeciesSlice(header, name):
+    """
+    Takes a header as returned by ReadHeader and the name of a species (e.g. 'Li')
+    returns the slice of atom indices belonging to this species
+    """
+    if header["species"] is None:
+        raise ValueError("XDATCAR header has no species line (VASP 4 format), cannot look up '{}'".format(name))
+    if name not in header["species"]:
+        raise ValueError("Species '{}' not found in XDATCAR header {}".format(name, header["species"]))
+    i = header["species"].index(name)
+    first = sum(header["counts"][:i])
+    return slice(first, first + header["counts"][i])
+
+
+def _ReadBlock(f):
+    """
+    Reads the next block of the file.
+    returns (header or None, configuration line) or (None, None) at end of file
+    """
+    header = None
+    line = f.readline()
+    while line:
+        if _IsConfigurationLine(line):
+            return header, line
+        if line.strip():
+            header = _ParseHeader(f, line)
+        line = f.readline()
+    return None, None
+
+
+def _ParseCoordinates(lines, N_atoms, filename, frame):
+    """
+    Converts the raw coordinate lines of one frame
+    returns (N_atoms, 3) array
+    """
+    try:
+        positions = np.array(b"".join(lines).split(), dtype=np.float64)
+    except ValueError:
+        positions = None
+    if positions is None or positions.size != 3 * N_atoms:
+        raise ValueError("Incomplete or malformed frame {} in {}".format(frame, filename))
+    return positions.reshape(N_atoms, 3)
+
+
+def _Fingerprint(filename):
+    """
+    returns (size, modification time in ns) of a file
+    """
+    stat = os.stat(filename)
+    return np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+
+def PrefixHash(filename, size, block=65536):
+    """
+    Takes a file and a length in bytes
+    returns SHA-256 over the first and the last block bytes of the first size bytes of the file
+    (cheap check whether a file still starts with the same content, see IsAppended)
+    """
+    sha = hashlib.sha256()
+    with open(filename, "rb") as f:
+        sha.update(f.read(min(block, size)))
+        f.seek(max(0, size - block))
+        sha.update(f.read(size - max(0, size - block)))
+    return sha.hexdigest()
+
+
+def IsAppended(filename, size, prefix_hash):
+    """
+    Takes a file, the size it had before and the PrefixHash of that size
+    returns True if the file still starts with the same content (it is unchanged or only has been appended to)
+    """
+    return os.path.getsize(filename) >= size and PrefixHash(filename, size) == prefix_hash
+
+
+def BuildIndex(filename, resume=None):
+    """
+    Scans an XDATCAR once (coordinates are not parsed)
+    returns the frame index as dictionary (see module header).
+    An incomplete last frame (e.g. from a run killed by the wall time limit) is not indexed.
+    With resume (index of the same file before frames have been appended) the scan starts
+    after the last frame of that index.
+    """
+    offsets, numbers, cartesian = [], [], []
+    header_frames, header_cells = [], []
+    first_header = None
+    N_atoms = None
+    end = 0
+
+    if resume is not None:
+        offsets, numbers, cartesian = list(resume["offsets"]), list(resume["numbers"]), list(resume["cartesian"])
+        # Headers behind the last complete frame are read again
+        kept = resume["header_frames"] < len(offsets)
+        header_frames, header_cells = list(resume["header_frames"][kept]), list(resume["header_cells"][kept])
+        first_header = {"species": [str(name) for name in resume["species"]] or None,
+                        "counts": [int(n) for n in resume["counts"]]}
+        N_atoms = sum(first_header["counts"])
+        end = int(resume["end"])
+
+    with OpenTrajectory(filename) as f:
+        f.seek(end)
+        line = f.readline()
+        while line:
+            if not line.endswith(b"\n"):
+                break       # last line is still being written
+            if _IsConfigurationLine(line):
+                if N_atoms is None:
+                    raise ValueError("{} does not start with a header block".format(filename))
+                offset = f.tell()
+                # A frame is complete if all its lines are (the last line still being written has no newline yet)
+                lines = [f.readline() for _ in range(N_atoms)]
+                if not lines[-1].endswith(b"\n"):
+                    break
+                offsets.append(offset)
+                numbers.append(_ConfigurationNumber(line))
+                cartesian.append(line.lstrip().startswith(b"Cartesian"))
+                end = f.tell()
+            elif line.strip():
+                try:
+                    header = _ParseHeader(f, line)
+                except (ValueError, IndexError):
+                    if f.read(1):
+                        raise
+                    break   # header at the end of the file is still being written
+                if first_header is None:
+                    first_header = header
+                    N_atoms = sum(header["counts"])
+                elif N_atoms != sum(header["counts"]):
+                    raise ValueError("Number of atoms changes within {} (frame {})".format(filename, len(offsets)))
+                header_frames.append(len(offsets))
+                header_cells.append(header["cell"])
+            line = f.readline()
+
+    if first_header is None:
+        raise ValueError("{} does not contain a header block".format(filename))
+    if IsCompressed(filename):
+        end = os.path.getsize(filename)
+
+    return {"version": np.array(INDEX_VERSION),
+            "fingerprint": _Fingerprint(filename),
+            "end": np.array(end, dtype=np.int64),
+            "prefix_hash": np.array(PrefixHash(filename, end)),
+            "offsets": np.array(offsets, dtype=np.int64),
+            "numbers": np.array(numbers, dtype=np.int64),
+            "cartesian": np.array(cartesian, dtype=bool),
+            "header_frames": np.array(header_frames, dtype=np.int64),
+            "header_cells": np.array(header_cells, dtype=np.float64).reshape(-1, 3, 3),
+            "species": np.array(first_header["species"] or [], dtype=str),
+            "counts": np.array(first_header["counts"], dtype=np.int64)}
+
+
+def LoadIndex(filename, rebuild=False):
+    """
+    Loads the sidecar index of an XDATCAR. It is (re)built and saved if it does not exist,
+    is outdated or rebuild is True (only extended if frames have been appended).
+    If the sidecar cannot be written the index is only kept in memory.
+    returns the frame index as dictionary
+    """
+    index_file = filename + INDEX_SUFFIX
+    previous = None
+    if not rebuild and os.path.exists(index_file):
+        with np.load(index_file) as stored:
+            index = {key: stored[key] for key in stored.files}
+        if index.get("version") == INDEX_VERSION:
+            if np.array_equal(index["fingerprint"], _Fingerprint(filename)):
+                return index
+            # the frames appended to a compressed file cannot be found without decompressing everything in front
+            if not IsCompressed(filename) and IsAppended(filename, int(index["end"]), str(index["prefix_hash"])):
+                previous = index
+
+    index = BuildIndex(filename, resume=previous)
+    try:
+        with open(index_file, "wb") as f:
+            np.savez(f, **index)
+    except OSError as error:
+        print("Warning: could not write frame index {} ({})".format(index_file, error))
+    return index
+
+
+def _IterateIndexedFrames(filename, index, start, stop, step):
+    """
+    Same as IterateFrames, but jumps to every requested frame with a seek
+    """
+    N_atoms = int(index["counts"].sum())
+    frames = range(len(index["offsets"]))[start:stop:step]
+    headers = np.searchsorted(index["header_frames"], np.asarray(frames), side="right") - 1
+
+    with OpenTrajectory(filename) as f:
+        for frame, h in zip(frames, headers):
+            f.seek(index["offsets"][frame])
+            lines = [f.readline() for _ in range(N_atoms)]
+            cell = index["header_cells"][h]
+            positions = _ParseCoordinates(lines, N_atoms, filename, frame)
+            if index["cartesian"][frame]:
+                positions = positions @ np.linalg.inv(cell)
+            yield cell, positions
+
+
+def IterateFrames(filename, start=0, stop=None, step=1, use_index=True):
+    """
+    Streams the frames start, start+step, ... (stop excluded) of an XDATCAR.
+    With use_index the sidecar frame index is used (and built if necessary) to seek straight
+    to every requested frame. Otherwise the file is read sequentially and frames that are not
+    requested are skipped without parsing their coordinates.
+    yields (cell, fractional positions) for each requested frame
+    """
+    if start < 0 or step < 1:
+        raise ValueError("start must be >= 0 and step >= 1")
+
+    if IsStore(filename):
+        yield from _IterateStoreFrames(filename, start, stop, step)
+        return
+    if use_index:
+        yield from _IterateIndexedFrames(filename, LoadIndex(filename), start, stop, step)
+        return
+
+    with OpenTrajectory(filename) as f:
+        cell = None
+        N_atoms = None
+        frame = 0
+        while stop is None or frame < stop:
+            header, config_line = _ReadBlock(f)
+            if config_line is None:
+                return
+
+            if header is not None:
+                cell = header["cell"]
+                if N_atoms is None:
+                    N_atoms = sum(header["counts"])
+                elif N_atoms != sum(header["counts"]):
+                    raise ValueError("Number of atoms changes within {} (frame {})".format(filename, frame))
+            if cell is None:
+                raise ValueError("{} does not start with a header block".format(filename))
+
+            wanted = frame >= start and (frame - start) % step == 0
+            if not wanted:
+                # Skip coordinates without parsing them
+                for _ in range(N_atoms):
+                    f.readline()
+            else:
+                lines = [f.readline() for _ in range(N_atoms)]
+                if not lines[-1].endswith(b"\n"):
+                    return        # incomplete last frame (still being written), same check as in BuildIndex
+                positions = _ParseCoordinates(lines, N_atoms, filename, frame)
+                if config_line.lstrip().startswith(b"Cartesian"):
+                    positions = positions @ np.linalg.inv(cell)
+                yield cell, positions
+
+            frame += 1
+
+
+def CountFrames(filename, use_index=True):
+    """
+    Counts the configurations in an XDATCAR without parsing any coordinates
+    (with use_index the frame index is built/loaded on the way)
+    returns number of frames
+    """
+    if IsStore(filename):
+        return len(ReadStoreHeader(filename)["numbers"])
+    if use_index:
+        return len(LoadIndex(filename)["offsets"])
+
+    # Only complete frames are counted (same check as in BuildIndex and IterateFrames)
+    N_frames = 0
+    N_atoms = None
+    with OpenTrajectory(filename) as f:
+        while True:
+            header, config_line = _ReadBlock(f)
+            if config_line is None:
+                return N_frames
+            if header is not None and N_atoms is None:
+                N_atoms = sum(header["counts"])
+            if N_atoms is None:
+                raise ValueError("{} does not start with a header block".format(filename))
+            lines = [f.readline() for _ in range(N_atoms)]
+            if not lines[-1].endswith(b"\n"):
+                return N_frames
+            N_frames += 1
+
+
+def FrameNumbers(filename):
+    """
+    returns the "Direct configuration=" number of every frame (restarts begin again at 1)
+    """
+    if IsStore(filename):
+        return ReadStoreHeader(filename)["numbers"]
+    return LoadIndex(filename)["numbers"]
+
+
+### Binary trajectory store ##########################################################################################
+#
+# Every analysis streams the same trajectory, so parsing the text again is the largest part of every run.
+# The store holds the trajectory as a .npy/.npz pair with the same base name (as the density grids of density_grid.py):
+#   <base>.npy -> fractional coordinates of all frames, float32, shape (N_frames, N_atoms, 3), memory-mapped
+#   <base>.npz -> header: cell of every frame (N_frames, 3, 3), "Direct configuration=" numbers, species, counts,
+#                 comment and size, modification time + PrefixHash of the trajectory it was converted from
+# Base name is the trajectory without compression suffix plus .traj (XDATCAR.xz -> XDATCAR.traj.npy/.npz).
+# A frame (or a range of frames) is a view into the memory map, nothing is copied or parsed, so reading is bound by
+# the disk (or page cache) bandwidth. float32 keeps 7 significant digits (XDATCAR: 8 decimals), i.e. about 1e-7 of
+# the cell, far below any grid step. A store passed as trajectory (XDATCAR.traj.npy) works with IterateFrames,
+# CountFrames, ReadHeader and FrameNumbers, and FindTrajectory picks it up as long as the trajectory it was converted
+# from is unchanged (or has been deleted to save space).
+
+STORE_SUFFIX  = ".traj"
+STORE_VERSION = 1
+
+
+def _StoreBase(filename):
+    """
+    Takes XDATCAR.traj, XDATCAR.traj.npy or XDATCAR.traj.npz
+    returns the base name of the pair (XDATCAR.traj)
+    """
+    base, ext = os.path.splitext(filename)
+    return base if ext in (".npy", ".npz") else filename
+
+
+def IsStore(filename):
+    """
+    returns True if filename is a binary trajectory store (<base>.traj.npy or <base>.traj.npz)
+    """
+    return os.path.splitext(filename)[1] in (".npy", ".npz") and _StoreBase(filename).endswith(STORE_SUFFIX)
+
+
+def StoreFile(filename):
+    """
+    Takes a trajectory (XDATCAR, XDATCAR.gz, ...)
+    returns the file name of its binary store (XDATCAR.traj.npy)
+    """
+    base = filename[:-len(IsCompressed(filename))] if IsCompressed(filename) else filename
+    return base + STORE_SUFFIX + ".npy"
+
+
+def StoreHeaderFile(filename):
+    """
+    returns the header file of a binary store (XDATCAR.traj.npz)
+    """
+    return _StoreBase(filename) + ".npz"
+
+
+def ConvertToStore(filename, store_file=None):
+    """
+    Converts a trajectory (also compressed) once into the binary store (see above). The frames are streamed into
+    the memory-mapped output, so the memory does not grow with the trajectory. Both files are replaced at the end,
+    an interrupted conversion leaves no (incomplete) store behind.
+    returns the file name of the store
+    """
+    store_file = store_file or StoreFile(filename)
+    base = _StoreBase(store_file)
+    index = LoadIndex(filename)
+    N_frames, N_atoms = len(index["offsets"]), int(index["counts"].sum())
+    size = os.path.getsize(filename)
+
+    positions = np.lib.format.open_memmap(base + ".tmp.npy", mode="w+", dtype=np.float32, shape=(N_frames, N_atoms, 3))
+    cells = np.zeros((N_frames, 3, 3))
+    for frame, (cell, frac) in enumerate(IterateFrames(filename)):
+        if frame % 1000 == 0:
+            print("Converting frame {}".format(frame), flush=True)
+        positions[frame] = frac
+        cells[frame] = cell
+    positions.flush()
+    del positions
+
+    with open(base + ".tmp.npz", "wb") as f:
+        np.savez(f, version=np.array(STORE_VERSION), cells=cells, numbers=index["numbers"],
+                 species=index["species"], counts=index["counts"], comment=np.array(ReadHeader(filename)["comment"]),
+                 source=np.array(os.path.basename(filename)), source_size=np.array(size, dtype=np.int64),
+                 source_mtime=np.array(os.stat(filename).st_mtime_ns, dtype=np.int64),
+                 source_hash=np.array(PrefixHash(filename, size)))
+    os.replace(base + ".tmp.npy", base + ".npy")
+    os.replace(base + ".tmp.npz", base + ".npz")
+    return base + ".npy"
+
+
+def ReadStoreHeader(filename):
+    """
+    Reads the header of a binary store (the coordinates are not touched)
+    returns dictionary with cells, numbers, species (or None), counts, comment, source, source_size, source_hash,
+    source_mtime (modification time in ns, None for stores converted before it was recorded)
+    """
+    with np.load(StoreHeaderFile(filename)) as stored:
+        if int(stored["version"]) != STORE_VERSION:
+            raise ValueError("{} has store version {}, expected {} (convert again)".format(
+                             StoreHeaderFile(filename), int(stored["version"]), STORE_VERSION))
+        return {"cells": stored["cells"],
+                "numbers": stored["numbers"],
+                "species": [str(name) for name in stored["species"]] or None,
+                "counts": [int(n) for n in stored["counts"]],
+                "comment": str(stored["comment"]),
+                "source": str(stored["source"]),
+                "source_size": int(stored["source_size"]),
+                "source_hash": str(stored["source_hash"]),
+                "source_mtime": int(stored["source_mtime"]) if "source_mtime" in stored.files else None}
+
+
+def ReadStore(filename, mmap=True):
+    """
+    Reads a binary store. The coordinates are memory-mapped (read-only) by default.
+    returns dictionary as ReadStoreHeader plus positions ((N_frames, N_atoms, 3) float32 fractional coordinates)
+    """
+    store = ReadStoreHeader(filename)
+    store["positions"] = np.load(_StoreBase(filename) + ".npy", mmap_mode="r" if mmap else None)
+    expected = (len(store["numbers"]), sum(store["counts"]), 3)
+    if store["positions"].shape != expected:
+        raise ValueError("Coordinates {} in {}.npy do not match its header {}".format(
+                         store["positions"].shape, _StoreBase(filename), expected))
+    return store
+
+
+def StoreSource(store_file):
+    """
+    returns the trajectory a binary store has been converted from (next to the store, it may not exist any more)
+    """
+    return os.path.join(os.path.dirname(store_file), ReadStoreHeader(store_file)["source"])
+
+
+def IsStoreCurrent(store_file):
+    """
+    returns True if the trajectory the store has been converted from (next to the store) is unchanged
+    (same size, modification time and PrefixHash; PrefixHash alone misses edits in the middle) or does not exist any more
+    """
+    header = ReadStoreHeader(store_file)
+    filename = StoreSource(store_file)
+    if not os.path.exists(filename):
+        return True
+    stat = os.stat(filename)
+    if stat.st_size != header["source_size"]:
+        return False
+    if header["source_mtime"] is not None and stat.st_mtime_ns != header["source_mtime"]:
+        return False
+    return PrefixHash(filename, header["source_size"]) == header["source_hash"]
+
+
+def _IterateStoreFrames(filename, start, stop, step):
+    """
+    Same as IterateFrames for a binary store; the positions are float32 views into the memory map (no copy)
+    """
+    store = ReadStore(filename)
+    for frame in range(len(store["numbers"]))[start:stop:step]:
+        yield store["cells"][frame], store["positions"][frame]
+
+
+def ReadPOSCAR(filename):
+    """
+    Reads a POSCAR/CONTCAR (also with "Selective dynamics" or Cartesian coordinates)
+    returns (header, fractional positions) with header as returned by ReadHeader
+    """
+    with open(filename, "rb") as f:
+        header = _ParseHeader(f, f.readline())
+        mode = f.readline().strip()
+        if mode[:1] in (b"S", b"s"):
+            mode = f.readline().strip()
+        N_atoms = sum(header["counts"])
+        lines = [f.readline().split()[:3] for _ in range(N_atoms)]
+
+    if not lines or len(lines[-1]) < 3:
+        raise ValueError("Incomplete coordinate block in {}".format(filename))
+    positions = np.array(lines, dtype=np.float64)
+    if mode[:1] in (b"C", b"c", b"K", b"k"):
+        # Cartesian coordinates are scaled with the same factor as the lattice
+        positions = header["scale"] * positions @ np.linalg.inv(header["cell"])
+    return header, positions
+
+
+if __name__ == "__main__":
+    # One-time conversion into the binary store: python xdatcar.py XDATCAR [XDATCAR.xz ...]
+    for trajectory in sys.argv[1:]:
+        print("Converting {}".format(trajectory))
+        print("Written {}".format(ConvertToStore(trajectory)))